@@ -0,0 +1,92 @@
+'''
+auth_routes.py
+
+Times a few routes that check the same token several times per request, through the Flask
+test client, in three setups:
+
+    decode   every check runs jwt.decode (no token cache, no auth context), as before
+    cache    decode_token answers repeat checks from its cache (see tokens.py)
+    context  the server also resolves the request's token once, before dispatch
+
+Saves go to a temporary directory, so persisted_data.json is left alone.
+
+    python3 -m benchmarks.auth_routes [number of requests per route]
+'''
+
+import os
+import sys
+import tempfile
+import time
+from src import config
+from src import server
+from src.tokens import token_cache_stats
+from src.other import clear_v1
+
+def setup(client):
+    """Registers two users who share a channel with 50 messages and a dm, and returns the
+    arguments each timed route is called with.
+    """
+    owner = client.post('/auth/register/v2', json={'email': 'owner@email.com', 'password': 'password',
+        'name_first': 'first', 'name_last': 'owner'}).get_json(force=True)
+    user = client.post('/auth/register/v2', json={'email': 'user@email.com', 'password': 'password',
+        'name_first': 'first', 'name_last': 'user'}).get_json(force=True)
+    token = owner['token']
+    channel_id = client.post('/channels/create/v2', json={'token': token, 'name': 'apple', 'is_public': True}).get_json(force=True)['channel_id']
+    client.post('/channel/join/v2', json={'token': user['token'], 'channel_id': channel_id})
+    for i in range(50):
+        message_id = client.post('/message/send/v1', json={'token': token, 'channel_id': channel_id, 'message': f'message {i}'}).get_json(force=True)['message_id']
+    client.post('/dm/create/v1', json={'token': token, 'u_ids': [user['auth_user_id']]})
+    react = {'token': token, 'message_id': message_id, 'react_id': 1}
+    # React and unreact are timed together, so each request undoes the one before it.
+    return {
+        'channel/messages': [('GET', '/channel/messages/v2', {'token': token, 'channel_id': channel_id, 'start': 0})],
+        'channel/details': [('GET', '/channel/details/v2', {'token': token, 'channel_id': channel_id})],
+        'channels/list': [('GET', '/channels/list/v2', {'token': token})],
+        'dm/list': [('GET', '/dm/list/v1', {'token': token})],
+        'message/react+unreact': [('POST', '/message/react/v1', react), ('POST', '/message/unreact/v1', react)],
+        'message/send': [('POST', '/message/send/v1', {'token': token, 'channel_id': channel_id, 'message': 'hello'})],
+    }
+
+def time_requests(client, requests, num_requests):
+    """Returns the mean time of a request in microseconds, sending the requests in turn."""
+    start = time.perf_counter()
+    for i in range(num_requests):
+        method, route, args = requests[i % len(requests)]
+        if method == 'GET':
+            response = client.get(route, query_string=args)
+        else:
+            response = client.post(route, json=args)
+        assert response.status_code == 200, (route, response.get_json(force=True))
+    return (time.perf_counter() - start) / num_requests * 1e6
+
+def run(setup_name, num_requests):
+    open_auth_context = server.open_auth_context
+    config.token_cache_size = 0 if setup_name == 'decode' else 1024
+    if setup_name != 'context':
+        server.open_auth_context = lambda token: None
+    try:
+        clear_v1()
+        client = server.APP.test_client()
+        routes = setup(client)
+        results = {name: time_requests(client, requests, num_requests) for name, requests in routes.items()}
+        return results, token_cache_stats()
+    finally:
+        server.open_auth_context = open_auth_context
+
+if __name__ == '__main__':
+    num_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    with tempfile.TemporaryDirectory() as directory:
+        config.data_file = os.path.join(directory, 'data.json')
+        config.journal_file = os.path.join(directory, 'data.journal')
+        config.durability = 'shutdown'
+        setups = ['decode', 'cache', 'context']
+        results = {}
+        for setup_name in setups:
+            results[setup_name], stats = run(setup_name, num_requests)
+            print(f'{setup_name}: {stats["hits"]} cache hits, {stats["misses"]} misses')
+        clear_v1()
+
+    print(f'{num_requests} requests per route, mean microseconds per request')
+    print(f'{"route":<24}' + ''.join(f'{name:>10}' for name in setups))
+    for route in results['decode']:
+        print(f'{route:<24}' + ''.join(f'{results[name][route]:>10.0f}' for name in setups))
@@ -0,0 +1,58 @@
+'''
+search.py
+
+Times search_v1 on one channel with many messages, for queries that are found in few, some
+and no messages, and a query too short for the trigram index, and reports the size of the index.
+
+Saves go to a temporary directory, so persisted_data.json is left alone.
+
+    python3 -m benchmarks.search [number of messages]
+'''
+
+import os
+import random
+import sys
+import tempfile
+import time
+from src import config
+from src.auth import auth_register_v1
+from src.channels import channels_create_v1
+from src.message import send_channel_message
+from src.incomplete import search_v1
+from src.search_helpers import index_stats
+from src.other import clear_v1
+
+WORDS = ['deploy', 'release', 'build', 'review', 'merge', 'test', 'fix', 'bug', 'lunch', 'meeting']
+
+def setup(num_messages):
+    """Registers a user and sends num_messages random messages to their channel, and returns their token."""
+    user = auth_register_v1('owner@email.com', 'password', 'first', 'owner')
+    channel_id = channels_create_v1(user['token'], 'apple', True)['channel_id']
+    rand = random.Random(0)
+    for i in range(num_messages):
+        words = rand.sample(WORDS, 3) + [f'ticket{i}']
+        send_channel_message(user['auth_user_id'], channel_id, ' '.join(words))
+    return user['token']
+
+def time_search(token, query_str, num_runs=5):
+    """Returns the mean time of a search in milliseconds, and the number of messages found."""
+    start = time.perf_counter()
+    for _ in range(num_runs):
+        found = len(search_v1(token, query_str)['messages'])
+    return (time.perf_counter() - start) / num_runs * 1e3, found
+
+if __name__ == '__main__':
+    num_messages = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    with tempfile.TemporaryDirectory() as directory:
+        config.data_file = os.path.join(directory, 'data.json')
+        config.journal_file = os.path.join(directory, 'data.journal')
+        config.durability = 'shutdown'
+        clear_v1()
+        token = setup(num_messages)
+        print(f'{num_messages} messages')
+        for query_str in ['ticket12345', 'deploy merge', 'redeploy', 'ix']:
+            millis, found = time_search(token, query_str)
+            print(f'{query_str!r:<16}{found:>8} found{millis:>10.2f} ms')
+        stats = index_stats()
+        print(f"index: {stats['grams']} trigrams, {stats['postings']} postings, {stats['total_bytes'] / 2**20:.1f} MiB")
+        clear_v1()
@@ -0,0 +1,123 @@
+'''
+snapshot_load.py
+
+Compares how long load_data takes to read a json snapshot against a binary snapshot (see
+src/snapshot_format.py), and the peak memory of each. Each load runs in a fresh process so
+the peak RSS of one does not hide the other.
+
+    python3 -m benchmarks.snapshot_load [number of messages]
+'''
+
+import os
+import subprocess
+import sys
+import tempfile
+from json import dump
+from src.snapshot_format import dump_snapshot
+
+LOADER = '''
+import resource, sys, time
+from json import load
+from src.snapshot_format import load_snapshot
+start = time.perf_counter()
+if sys.argv[1] == 'json':
+    with open(sys.argv[2], 'r') as File:
+        load(File)
+else:
+    load_snapshot(sys.argv[2])
+elapsed = time.perf_counter() - start
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+'''
+
+def make_snapshot(num_messages):
+    """Builds a snapshot shaped like the real store, with num_messages messages spread over
+    100 channels and 100 dms.
+    """
+    num_users = 1000
+    users = [{
+        'id': u_id,
+        'email': f'user{u_id}@email.com',
+        'password': 'a' * 64,
+        'name_first': 'first',
+        'name_last': 'last',
+        'handle': f'firstlast{u_id}',
+        'permission_id': 2,
+        'removed': False,
+        'reset_code': None,
+        'profile_img_url': '',
+        'stats': {
+            'channels': [{'num_channels_joined': 0, 'time_stamp': 0}],
+            'dms': [{'num_dms_joined': 0, 'time_stamp': 0}],
+            'messages': [{'num_messages_sent': 0, 'time_stamp': 0}],
+        },
+    } for u_id in range(1, num_users + 1)]
+    channels = [{
+        'channel_id': c_id,
+        'name': f'channel{c_id}',
+        'is_public': True,
+        'members': list(range(1, 51)),
+        'owners': [1],
+        'message': [],
+        'standup': {'is_active': False, 'time_finish': None, 'msgqueue': []},
+    } for c_id in range(100)]
+    dms = [{
+        'dm_id': dm_id,
+        'name': 'firstlast1, firstlast2',
+        'owners': {'u_id': 1, 'handle_str': 'firstlast1'},
+        'members': [{'u_id': 1, 'handle_str': 'firstlast1'}, {'u_id': 2, 'handle_str': 'firstlast2'}],
+        'message': [],
+    } for dm_id in range(100)]
+    messages = []
+    for message_id in range(num_messages):
+        message = {
+            'message_id': message_id,
+            'u_id': message_id % num_users + 1,
+            'message': f'message number {message_id} with some text in it',
+            'time_sent': 1600000000 + message_id,
+            'reacts': [{'react_id': 1, 'u_ids': [1, 2], 'is_this_user_reacted': False}],
+            'is_pinned': False,
+        }
+        if message_id % 2:
+            channels[message_id % 100]['message'].append(message)
+            messages.append({'message_id': message_id, 'auth_user_id': message['u_id'], 'channel_id': message_id % 100, 'dm_id': -1})
+        else:
+            dms[message_id % 100]['message'].append(message)
+            messages.append({'message_id': message_id, 'auth_user_id': message['u_id'], 'channel_id': -1, 'dm_id': message_id % 100})
+    return {
+        'data_store': {
+            'users': users,
+            'channels': channels,
+            'tokens': [],
+            'messages': messages,
+            'dms': dms,
+            'workspace': {'channels': [], 'dms': [], 'messages': [], 'num_users': num_users},
+        },
+        'session_tracker': 0,
+        'message_tracker': num_messages,
+        'journal_seq': 0,
+    }
+
+def measure(kind, file_name):
+    output = subprocess.run([sys.executable, '-c', LOADER, kind, file_name],
+        check=True, capture_output=True, text=True).stdout
+    elapsed, peak_kb = output.split()
+    return float(elapsed), int(peak_kb) / 1024
+
+if __name__ == '__main__':
+    num_messages = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    data = make_snapshot(num_messages)
+    with tempfile.TemporaryDirectory() as directory:
+        json_file = os.path.join(directory, 'data.json')
+        binary_file = os.path.join(directory, 'data.snap')
+        with open(json_file, 'w') as File:
+            dump(data, File)
+        with open(binary_file, 'wb') as File:
+            dump_snapshot(data, File)
+        del data
+
+        print(f'{num_messages} messages')
+        print(f'{"format":<8}{"size MB":>10}{"load s":>10}{"peak RSS MB":>14}')
+        for kind, file_name in [('json', json_file), ('binary', binary_file)]:
+            best = min(measure(kind, file_name) for _ in range(3))
+            size = os.path.getsize(file_name) / 1024 / 1024
+            print(f'{kind:<8}{size:>10.1f}{best[0]:>10.2f}{best[1]:>14.1f}')
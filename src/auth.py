@@ -7,11 +7,14 @@ As per iteration 3, this file also includes the passwordreset functions.
 
 '''
 import re
+from src import config
 from src.data_store import data_store
 from src.error import InputError, AccessError
 from src.tokens import *
 from src.other import check_valid_token, hash
 from src.persistence import save_data
+from src.journal import record
+from src.user_helpers import user_by_email, generate_handle, add_user
 import datetime
 import smtplib
 from email.mime.text import MIMEText
@@ -34,26 +37,19 @@ def auth_login_v1(email, password):
             'token': string
             'auth_user_id': integer
     """
-    store = data_store.get()
 
     # check email is registered inside datastore
-    email_found = False
-    for idx, user in enumerate(store["users"]):
-        if user["email"] == email:
-            email_found = True
-            user_index = idx
-            break
-
-    if not email_found:
+    user = user_by_email(email)
+    if user is None:
         raise InputError(description="Email not found")
 
     encrypted_password = hash(password)
 
     # check if password is correct
-    if store["users"][user_index]["password"] != encrypted_password:
+    if user["password"] != encrypted_password:
         raise InputError(description="Incorrect password")
 
-    user_id = store["users"][user_index]["id"]
+    user_id = user["id"]
     token = generate_token(user_id)
     save_data()
 
@@ -90,11 +86,8 @@ def auth_register_v1(email, password, name_first, name_last):
         raise InputError(description="Invalid email")
     
     # Check for duplicate email.
-    for user in store['users']:
-        if user['email'] != email or user['removed'] == True:
-            continue
-        else:
-            raise InputError(description="Duplicate email")
+    if user_by_email(email) is not None:
+        raise InputError(description="Duplicate email")
 
     # Check for valid passwword.
     if len(password) < 6:
@@ -113,17 +106,7 @@ def auth_register_v1(email, password, name_first, name_last):
     handle = (handle.lower())[0:20]
 
     # Check if handle exists, and if so, change handle to new handle.
-    k, repeat = 0, True
-    handle_copy = handle
-    while repeat and len(store['users']) > 0:
-        repeat = False
-        for user in store['users']:
-            if user['handle'] == handle_copy and user['removed'] == False:
-                repeat = True
-                handle_copy = handle + str(k)
-                k += 1
-    
-    handle = handle_copy
+    handle = generate_handle(handle)
 
     # Find the global permission.
     dt = int(datetime.datetime.now().timestamp())
@@ -133,6 +116,8 @@ def auth_register_v1(email, password, name_first, name_last):
         store['workspace']['channels'].append({'num_channels_exist': 0, 'time_stamp': dt})
         store['workspace']['dms'].append({'num_dms_exist': 0, 'time_stamp': dt})
         store['workspace']['messages'].append({'num_messages_exist': 0, 'time_stamp': dt})
+        for series in ['channels', 'dms', 'messages']:
+            record('append', ['workspace', series], store['workspace'][series][-1])
 
     # Register the new user. Done via a dictionary of their details.
     new_user = {
@@ -151,9 +136,13 @@ def auth_register_v1(email, password, name_first, name_last):
             'messages': [{'num_messages_sent': 0, 'time_stamp': dt}],
         },
         'secret_code': '',
+        'notifications': [],
     }
     store['users'].append(new_user)
+    add_user(new_user)
     store['workspace']['num_users'] += 1
+    record('append', ['users'], new_user)
+    record('set', ['workspace', 'num_users'], store['workspace']['num_users'])
     new_id = len(store['users'])
     data_store.set(store)
     token = generate_token(new_id)
@@ -179,9 +168,7 @@ def auth_logout_v1(token):
     if not check_valid_token(token):
         raise AccessError(description="Invalid token")
     
-    store = data_store.get()
-    store['tokens'].remove(token)
-    data_store.set(store)
+    remove_token(token)
     save_data()
     return {}
 
@@ -202,14 +189,18 @@ def auth_passwordreset_request_v1(email):
         empty dictionary.
     """
     reset_code = ''.join(random.choice(string.ascii_letters + string.digits) for _ in range(6))
-    store = data_store.get()
-    for user in store['users']:
-        if user['email'] != email:
-            continue
-        else:
-            user['secret_code'] = reset_code
-    data_store.set(store)
-    save_data()
+    # The data store is only locked while it is changed, not while the email is sent.
+    with data_store.lock:
+        store = data_store.get()
+        for idx, user in enumerate(store['users']):
+            if user['email'] != email:
+                continue
+            else:
+                user['secret_code'] = reset_code
+                record('set', ['users', idx, 'secret_code'], reset_code)
+                revoke_user_sessions(user['id'])
+        data_store.set(store)
+        save_data()
 
     personal_email = 'h13badger@gmail.com'
     password = 'Comp1531'
@@ -220,7 +211,7 @@ def auth_passwordreset_request_v1(email):
     msg['From'] = personal_email
     msg['To'] = email
     msg['Subject'] = 'Seams Password Reset Code'
-    reset_server = smtplib.SMTP('smtp.gmail.com', 587)
+    reset_server = smtplib.SMTP('smtp.gmail.com', 587, timeout=config.network_timeout)
     reset_server.ehlo()
     reset_server.starttls()
     reset_server.login(personal_email, password)
@@ -256,6 +247,9 @@ def auth_passwordreset_reset_v1(reset_code, new_password):
             if len(new_password) < 6:
                 raise InputError(description="Password is too short.")
             user['password'] = hash(new_password)
+            record('set', ['users', user['id'] - 1, 'password'], user['password'])
+            # Sessions from before the reset could belong to whoever the reset locks out.
+            revoke_user_sessions(user['id'])
             break
     
     # Check if the user was found.
@@ -13,6 +13,9 @@ from src.other import *
 from src.tokens import *
 from src.message_helpers import check_react_id
 from src.persistence import save_data
+from src.histories import history
+from src.channel_helpers import add_member, add_owner, remove_member, remove_owner
+from src.notification_helpers import notify_added
 import datetime
 
 
@@ -44,7 +47,7 @@ def channel_invite_v1(token, channel_id, u_id):
     if not check_valid_channel_id(channel_id):
         raise InputError(description="Invalid channel id")
 
-    auth_u_id = decode_token(token)["auth_user_id"]
+    auth_u_id = token_user_id(token)
     # Check auth user is in the channel 
     if not check_channel_memebers(channel_id, auth_u_id):
         raise AccessError(description="Auth user not in channel")
@@ -58,7 +61,8 @@ def channel_invite_v1(token, channel_id, u_id):
         raise InputError(description="User is already a member")
 
     # Add user to channel
-    store["channels"][channel_id]["members"].append(u_id)
+    add_member(channel_id, u_id)
+    notify_added(u_id, auth_u_id, channel_id, -1)
     dt = int(datetime.datetime.now().timestamp())
     stat_user_channel_add(u_id, dt)
     data_store.set(store)
@@ -95,7 +99,7 @@ def channel_details_v1(token, channel_id):
     if not check_valid_channel_id(channel_id):
         raise InputError(description="Invalid channel id")
 
-    u_id = decode_token(token)["auth_user_id"]
+    u_id = token_user_id(token)
     # Check if user is part of the channel.
     if not check_channel_memebers(channel_id, u_id):
         raise AccessError(description="User not in channel")
@@ -164,12 +168,13 @@ def channel_messages_v1(token, channel_id, start):
     if not check_valid_channel_id(channel_id):
         raise InputError(description="Invalid channel id")
 
-    u_id = decode_token(token)["auth_user_id"]
+    u_id = token_user_id(token)
     if not check_channel_memebers(channel_id, u_id):
         raise AccessError(description="User not in channel")
 
+    messages = history(store, "channels", channel_id)
     # start is greater than the total number of messages in the channel
-    total_messages = len(store["channels"][channel_id]["message"])
+    total_messages = len(messages)
     if start >= total_messages and (total_messages != 0 or start != 0):
         raise InputError(description="Not enough messages")
 
@@ -182,11 +187,11 @@ def channel_messages_v1(token, channel_id, start):
     i = start
     message_history = [] 
     while i < end:
-        if check_react_id(token, store["channels"][channel_id]["message"][total_messages - 1 - i]["message_id"]):
-            store["channels"][channel_id]["message"][total_messages - 1 - i]["reacts"][0]["is_this_user_reacted"] = True
+        if check_react_id(token, messages[total_messages - 1 - i]["message_id"]):
+            messages[total_messages - 1 - i]["reacts"][0]["is_this_user_reacted"] = True
         else: 
-            store["channels"][channel_id]["message"][total_messages - 1 - i]["reacts"][0]["is_this_user_reacted"] = False
-        message_history.append(store["channels"][channel_id]["message"][total_messages - 1 - i])
+            messages[total_messages - 1 - i]["reacts"][0]["is_this_user_reacted"] = False
+        message_history.append(messages[total_messages - 1 - i])
         i += 1
 
     return {
@@ -223,17 +228,16 @@ def channel_join_v1(token, channel_id):
     if check_valid_channel_id(channel_id) != True:
         raise InputError(description="Channel ID does not exist")
 
-    payload = decode_token(token)
-    auth_user_id = payload['auth_user_id']
+    auth_user_id = token_user_id(token)
     if check_channel_memebers(channel_id, auth_user_id):
         raise InputError(description="User is already a member in channel")
 
-    user = store['users'][auth_user_id - 1]
+    user = token_user(token)
     chan = store["channels"][channel_id]
     if chan["is_public"] == False and user["global_permission"] == 2:
         raise AccessError(description="You don't have permission")   
 
-    store['channels'][channel_id]['members'].append(auth_user_id)
+    add_member(channel_id, auth_user_id)
     dt = int(datetime.datetime.now().timestamp())
     stat_user_channel_add(auth_user_id, dt)
     data_store.set(store)
@@ -266,15 +270,13 @@ def channel_leave_v1(token, channel_id):
     if check_valid_channel_id(channel_id) != True:
         raise InputError(description="Channel ID does not exist")
 
-    auth_user_id = decode_token(token)['auth_user_id']
+    auth_user_id = token_user_id(token)
 
-    if auth_user_id in store["channels"][channel_id]["members"]:
-        store["channels"][channel_id]["members"].remove(auth_user_id)
-    else:
+    if not check_channel_memebers(channel_id, auth_user_id):
         raise AccessError(description="You are not in the channel")
 
-    if auth_user_id in store["channels"][channel_id]["owners"]:
-        store["channels"][channel_id]["owners"].remove(auth_user_id)
+    # Leaving a channel also gives up ownership of it.
+    remove_member(channel_id, auth_user_id)
 
     dt = int(datetime.datetime.now().timestamp())
     stat_user_channel_remove(auth_user_id, dt)
@@ -313,8 +315,7 @@ def channel_addowner_v1(token, channel_id, u_id):
     if check_valid_channel_id(channel_id) != True:
         raise InputError(description="Channel ID does not exist")
 
-    payload = decode_token(token)
-    auth_user_id = payload['auth_user_id']
+    auth_user_id = token_user_id(token)
     if check_channel_memebers(channel_id, auth_user_id) != True:
         raise AccessError(description="You are not in the channel")
 
@@ -330,13 +331,12 @@ def channel_addowner_v1(token, channel_id, u_id):
         raise InputError(description="User is already an owner of the channel")
 
 
-    user = store['users'][auth_user_id - 1]
+    user = token_user(token)
     if check_channel_owners(channel_id, auth_user_id) != True:
         if user["global_permission"] == 2: 
             raise AccessError(description="You don't have permission")
 
-    owners = store['channels'][channel_id]['owners'] 
-    owners.append(u_id)
+    add_owner(channel_id, u_id)
     data_store.set(store)
     save_data()
     return {}
@@ -372,8 +372,7 @@ def channel_removeowner_v1(token, channel_id, u_id):
     if check_valid_channel_id(channel_id) != True:
         raise InputError(description="Channel ID does not exist")
 
-    payload = decode_token(token)
-    auth_user_id = payload['auth_user_id']
+    auth_user_id = token_user_id(token)
     if check_channel_memebers(channel_id, auth_user_id) != True:
         raise AccessError(description="You are not in the channel")
 
@@ -383,7 +382,7 @@ def channel_removeowner_v1(token, channel_id, u_id):
     if check_channel_owners(channel_id, u_id) != True:
         raise InputError(description="User is not an owner of the channel")
 
-    user = store['users'][auth_user_id - 1]
+    user = token_user(token)
     if check_channel_owners(channel_id, auth_user_id) != True:
         if user["global_permission"] == 2: 
             raise AccessError(description="You don't have permission")
@@ -392,10 +391,7 @@ def channel_removeowner_v1(token, channel_id, u_id):
     if len(owners) == 1:
         raise InputError(description="User is the only owner in the channel")
 
-    owners = store['channels'][channel_id]['owners']
-    for owner in owners:
-        if u_id == owner:
-            owners.remove(owner)
+    remove_owner(channel_id, u_id)
     data_store.set(store)
     save_data()
     return {}
@@ -0,0 +1,112 @@
+"""
+    This module contains the channel membership indexes behind channel.py and channels.py.
+    store["channels"][channel_id]["members"] and ["owners"] are MemberLists (see member_list.py),
+    so channel details and the persisted data keep the order users joined in, while checking for,
+    adding and removing a member take constant time. MEMBERS and OWNERS map each channel_id to
+    those MemberLists.
+
+    USER_CHANNELS maps each u_id to the channel_ids they are a member of, so listing a user's
+    channels or removing a user from every channel only looks at that user's channels.
+    Members and owners are only changed through the functions below so the lists and indexes
+    stay consistent.
+"""
+
+from src.journal import record
+from src.member_list import MemberList
+
+global MEMBERS, OWNERS, USER_CHANNELS
+MEMBERS = {}
+OWNERS = {}
+USER_CHANNELS = {}
+
+def index_channel(channel):
+    """Adds a new channel and its first members to the indexes, turning its members and owners
+    into MemberLists.
+
+    Args:
+        channel (dictionary): the channel in store["channels"]
+    """
+    channel_id = channel["channel_id"]
+    channel["members"] = MEMBERS[channel_id] = MemberList(channel["members"])
+    channel["owners"] = OWNERS[channel_id] = MemberList(channel["owners"])
+    for u_id in channel["members"]:
+        USER_CHANNELS.setdefault(u_id, set()).add(channel_id)
+
+def is_member(channel_id, u_id):
+    """Checks if a user is a member of a channel, in constant time.
+
+    Returns:
+        boolean
+    """
+    return u_id in MEMBERS.get(channel_id, ())
+
+def is_owner(channel_id, u_id):
+    """Checks if a user is an owner of a channel, in constant time.
+
+    Returns:
+        boolean
+    """
+    return u_id in OWNERS.get(channel_id, ())
+
+def user_channels(u_id):
+    """Finds the channels a user is a member of.
+
+    Args:
+        u_id (int): the user
+
+    Returns:
+        list of channel_ids, in the order the channels were created
+    """
+    return sorted(USER_CHANNELS.get(u_id, ()))
+
+def add_member(channel_id, u_id):
+    """Adds a user to the members of a channel.
+    """
+    MEMBERS[channel_id].append(u_id)
+    USER_CHANNELS.setdefault(u_id, set()).add(channel_id)
+    record('append', ['channels', channel_id, 'members'], u_id)
+
+def add_owner(channel_id, u_id):
+    """Adds a member of a channel to its owners.
+    """
+    OWNERS[channel_id].append(u_id)
+    record('append', ['channels', channel_id, 'owners'], u_id)
+
+def remove_owner(channel_id, u_id):
+    """Takes a user out of the owners of a channel, if they are one.
+    """
+    if not is_owner(channel_id, u_id):
+        return
+    OWNERS[channel_id].remove(u_id)
+    record('remove', ['channels', channel_id, 'owners'], u_id)
+
+def remove_member(channel_id, u_id):
+    """Takes a user out of a channel, as both a member and an owner.
+    """
+    remove_owner(channel_id, u_id)
+    if not is_member(channel_id, u_id):
+        return
+    MEMBERS[channel_id].remove(u_id)
+    USER_CHANNELS[u_id].discard(channel_id)
+    record('remove', ['channels', channel_id, 'members'], u_id)
+
+def reset_channels():
+    """Resets the channel indexes, for when data store is reset.
+
+    Returns:
+        Empty dictionary.
+    """
+    MEMBERS.clear()
+    OWNERS.clear()
+    USER_CHANNELS.clear()
+    return {}
+
+def load_channels(channels):
+    """Rebuilds the channel indexes from the channels of a loaded data store.
+
+    Args:
+        channels (list): store["channels"]
+    """
+    reset_channels()
+    for channel in channels:
+        index_channel(channel)
@@ -11,6 +11,8 @@ from src.error import InputError, AccessError
 from src.other import check_valid_token, stat_user_channel_add
 from src.tokens import *
 from src.persistence import save_data
+from src.journal import record
+from src.channel_helpers import index_channel, user_channels
 import datetime
 
 def channels_list_v1(token):
@@ -33,13 +35,10 @@ def channels_list_v1(token):
 
     # list the channels the user is part of with channel id and channel name
     channels = []
-    payload = decode_token(token)
-    auth_user_id = payload['auth_user_id']
-    for channel in store["channels"]:
-        for member in channel["members"]:
-            if auth_user_id == member:
-                channels.append({'channel_id': channel['channel_id'], 'name': channel['name']})            
-                break
+    auth_user_id = token_user_id(token)
+    for channel_id in user_channels(auth_user_id):
+        channel = store["channels"][channel_id]
+        channels.append({'channel_id': channel['channel_id'], 'name': channel['name']})
     return {'channels': channels}
 
 def channels_listall_v1(token):
@@ -91,7 +90,7 @@ def channels_create_v1(token, name, is_public):
         raise InputError(description="Invalid Name")
 
     channel_id = len(store['channels'])
-    auth_user_id = decode_token(token)['auth_user_id']
+    auth_user_id = token_user_id(token)
 
     new_channel = {
         'name': name,
@@ -109,9 +108,12 @@ def channels_create_v1(token, name, is_public):
 
     dt = int(datetime.datetime.now().timestamp())
     store['channels'].append(new_channel)
+    index_channel(new_channel)
+    record('append', ['channels'], new_channel)
     stat_user_channel_add(auth_user_id, dt)
     num_channels = store['workspace']['channels'][-1]['num_channels_exist']
     store['workspace']['channels'].append({'num_channels_exist': num_channels + 1, 'time_stamp': dt})
+    record('append', ['workspace', 'channels'], store['workspace']['channels'][-1])
     data_store.set(store)
     save_data()
     return {'channel_id': channel_id}
@@ -1,3 +1,51 @@
 port = 8080
 
 url = f"http://localhost:{port}/"
+
+# Persistence. 'journal' appends each change to journal_file, 'snapshot' rewrites data_file
+# on every save and 'sections' writes only the changed records to their files in sections_dir.
+persistence_mode = 'journal'
+data_file = 'persisted_data.json'
+journal_file = 'persisted_data.journal'
+sections_dir = 'persisted_data'
+
+# In 'sections' mode, channel and dm histories are loaded on first use and the least recently
+# used saved ones are dropped from memory once more than history_budget messages are loaded.
+history_budget = 100000
+
+# Format data_file is written in, 'json' or 'binary' (see snapshot_format.py). Either format
+# is read back regardless of this setting.
+snapshot_format = 'json'
+
+# The journal is compacted into a fresh snapshot once it reaches compaction_size bytes, or
+# compaction_age seconds after the last snapshot. Checked every compaction_interval seconds.
+compaction_size = 4 * 1024 * 1024
+compaction_age = 300
+compaction_interval = 1
+
+# When saved changes are written to disk: 'always' (straight away), 'interval' (by a
+# background writer, at most every flush_interval seconds or once flush_changes saves are
+# waiting) or 'shutdown' (only when the server is stopped).
+durability = 'always'
+flush_interval = 1
+flush_changes = 100
+
+# A session ends session_idle_timeout seconds after its last request, or session_lifetime
+# seconds after the user logged in. Ended sessions are removed every session_sweep_interval seconds.
+session_idle_timeout = 24 * 60 * 60
+session_lifetime = 7 * 24 * 60 * 60
+session_sweep_interval = 60
+# last_seen is saved at most once every session_seen_interval seconds per session.
+session_seen_interval = 60
+
+# The last stats_raw_points points of a stats series are kept as they are while under an hour
+# old. Older points are folded into per minute, per hour and per day buckets, every
+# stats_sweep_interval seconds, once a series has doubled in length since it was last folded.
+stats_raw_points = 100
+stats_sweep_interval = 60
+
+# Number of decoded tokens kept by decode_token, least recently used first out.
+token_cache_size = 1024
+
+# Seconds to wait on another host, e.g. for a profile photo or the password reset email.
+network_timeout = 10
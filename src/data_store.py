@@ -29,6 +29,7 @@ initial_object = {
     'users': [],
     'channels': [],
     'tokens': [],
+    'sessions': {},
     'messages': [],
     'dms': [],
     'workspace': {
@@ -41,9 +42,14 @@ initial_object = {
 ## YOU SHOULD MODIFY THIS OBJECT ABOVE
 
 ## YOU ARE ALLOWED TO CHANGE THE BELOW IF YOU WISH
+from threading import RLock
+
 class Datastore:
     def __init__(self):
         self.__store = initial_object
+        # Held while a request (or timer) reads and changes the store, so background
+        # persistence always sees the store between requests.
+        self.lock = RLock()
 
     def get(self):
         return self.__store
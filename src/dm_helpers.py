@@ -0,0 +1,98 @@
+"""
+    This module contains the dm membership indexes behind dms.py.
+    store["dms"][dm_id]["members"] is a MemberList keyed by u_id (see member_list.py), in the order
+    users were added, and each member is only a {'u_id': ...} reference, as is the owner. Names,
+    emails and handles are looked up in store["users"] when a dm is read, so they are never out
+    of date.
+
+    DM_MEMBERS maps each dm_id to its members' MemberList, so checking whether a user is in a dm
+    or taking them out of it does not scan its members. USER_DMS maps each u_id to the dm_ids they
+    are a member of, so listing a user's dms or removing a user from every dm only looks at that
+    user's dms. Members are only changed through the functions below so the lists and indexes
+    stay consistent.
+"""
+
+from src.data_store import data_store
+from src.journal import record
+from src.member_list import MemberList
+
+global DM_MEMBERS, USER_DMS
+DM_MEMBERS = {}
+USER_DMS = {}
+
+def index_dm(dm_id, dm):
+    """Adds a dm and its members to the indexes, turning its members into a MemberList.
+
+    Args:
+        dm_id (int): the position of the dm in store["dms"]
+        dm (dictionary): the dm in store["dms"]
+    """
+    dm["members"] = DM_MEMBERS[dm_id] = MemberList(dm["members"], key="u_id")
+    for u_id in DM_MEMBERS[dm_id].keys():
+        USER_DMS.setdefault(u_id, set()).add(dm_id)
+
+def is_dm_member(dm_id, u_id):
+    """Checks if a user is a member of a dm, in constant time.
+
+    Returns:
+        boolean
+    """
+    return dm_id in DM_MEMBERS and DM_MEMBERS[dm_id].has_key(u_id)
+
+def user_dms(u_id):
+    """Finds the dms a user is a member of.
+
+    Args:
+        u_id (int): the user
+
+    Returns:
+        list of dm_ids, in the order the dms were created
+    """
+    return sorted(USER_DMS.get(u_id, ()))
+
+def dm_member_ids(dm_id):
+    """Finds the members of a dm.
+
+    Returns:
+        list of u_ids, in the order they were added to the dm
+    """
+    store = data_store.get()
+    return store["dms"][dm_id]["members"].keys()
+
+def remove_dm_member(dm_id, u_id):
+    """Takes a user out of a dm, if they are in it.
+    """
+    if not is_dm_member(dm_id, u_id):
+        return
+    DM_MEMBERS[dm_id].discard_key(u_id)
+    USER_DMS[u_id].discard(dm_id)
+    record('delete', ['dms', dm_id, 'members', {'u_id': u_id}])
+
+def remove_dm_members(dm_id):
+    """Takes every member out of a dm, for when it is removed.
+    """
+    store = data_store.get()
+    for u_id in DM_MEMBERS[dm_id].keys():
+        USER_DMS[u_id].discard(dm_id)
+    store["dms"][dm_id]["members"] = DM_MEMBERS[dm_id] = MemberList(key="u_id")
+    record('set', ['dms', dm_id, 'members'], [])
+
+def reset_dms():
+    """Resets the dm indexes, for when data store is reset.
+
+    Returns:
+        Empty dictionary.
+    """
+    DM_MEMBERS.clear()
+    USER_DMS.clear()
+    return {}
+
+def load_dms(dms):
+    """Rebuilds the dm indexes from the dms of a loaded data store.
+
+    Args:
+        dms (list): store["dms"]
+    """
+    reset_dms()
+    for dm_id, dm in enumerate(dms):
+        index_dm(dm_id, dm)
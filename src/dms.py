@@ -12,6 +12,10 @@ from src.message_helpers import check_react_id
 from src.tokens import *
 from src.user import *
 from src.persistence import save_data
+from src.journal import record
+from src.histories import history
+from src.dm_helpers import index_dm, user_dms, dm_member_ids, remove_dm_member, remove_dm_members
+from src.notification_helpers import notify_added
 import datetime
 
 def dm_create_v1(token, u_ids):
@@ -51,20 +55,13 @@ def dm_create_v1(token, u_ids):
     
 
     dm_id = len(store['dms'])
-    auth_user_id = decode_token(token)['auth_user_id']
+    auth_user_id = token_user_id(token)
 
-    owner = user_profile_v1(token, auth_user_id)['user']
+    # Members only refer to users, their details are looked up when the dm is read.
+    owner = {'u_id': auth_user_id}
+    members = [owner] + [{'u_id': u_id} for u_id in u_ids]
 
-    # members = []
-    # for u_id in u_ids:
-    #     members.append(user_profile_v1(token, u_id)['user'])
-    members = list(map(lambda u_id: user_profile_v1(token, u_id)["user"], u_ids))
-    members.insert(0, owner)
-
-    # list_name = []
-    # for member in members:
-    #     list_name.append(member['handle_str'])
-    list_name = list(map(lambda member: member["handle_str"], members))
+    list_name = [store['users'][member['u_id'] - 1]['handle'] for member in members]
 
     list_name.sort()
 
@@ -81,11 +78,16 @@ def dm_create_v1(token, u_ids):
 
     dm_store = store['dms']
     dm_store.append(new_dm)
+    index_dm(dm_id, new_dm)
+    record('append', ['dms'], new_dm)
+    for u_id in u_ids:
+        notify_added(u_id, auth_user_id, -1, dm_id)
     dt = int(datetime.datetime.now().timestamp())
     for mem in members:
         stat_user_dm_add(mem['u_id'], dt)
     num_dms = store['workspace']['dms'][-1]['num_dms_exist']
     store['workspace']['dms'].append({'num_dms_exist': num_dms + 1, 'time_stamp': dt})
+    record('append', ['workspace', 'dms'], store['workspace']['dms'][-1])
     data_store.set(store)
     save_data()
     return {'dm_id': dm_id}
@@ -124,8 +126,7 @@ def dm_details_v1(token, dm_id):
     name = dms['name']
     members = []
     
-    for member in dms['members']:
-        member_id = member['u_id']
+    for member_id in dm_member_ids(dm_id):
         member_info = store["users"][member_id - 1]
         member_details = {
             'u_id': member_id,
@@ -159,15 +160,12 @@ def dm_list_v1(token):
     if check_valid_token(token) != True:
         raise AccessError(description="Invalid Login session")     
 
-    payload = decode_token(token)
-    auth_user_id = payload['auth_user_id']
+    auth_user_id = token_user_id(token)
 
     dms_list = []
-    for dms in store["dms"]:
-        for member in dms["members"]:    
-            if member['u_id'] == auth_user_id:
-                dms_list.append({'dm_id': dms['dm_id'], 'name': dms['name']})            
-                break
+    for dm_id in user_dms(auth_user_id):
+        dms = store["dms"][dm_id]
+        dms_list.append({'dm_id': dms['dm_id'], 'name': dms['name']})
     return {'dms': dms_list}
 
 def dm_remove_v1(token, dm_id):
@@ -193,7 +191,7 @@ def dm_remove_v1(token, dm_id):
     if not check_valid_dm_id(dm_id):
         raise InputError(description="Invalid DM ID")
   
-    auth_user_id = decode_token(token)["auth_user_id"] 
+    auth_user_id = token_user_id(token) 
     if store["dms"][dm_id]["owners"]["u_id"] != auth_user_id:
         raise AccessError(description="Authorised user is not original DM creator")
 
@@ -201,15 +199,18 @@ def dm_remove_v1(token, dm_id):
         raise AccessError(description="This user is not a member of this DM")
 
     dt = int(datetime.datetime.now().timestamp())
-    for mem in store['dms'][dm_id]['members']:
-        stat_user_dm_remove(mem['u_id'], dt)
+    for u_id in dm_member_ids(dm_id):
+        stat_user_dm_remove(u_id, dt)
     num_dms = store['workspace']['dms'][-1]['num_dms_exist']
     store['workspace']['dms'].append({'num_dms_exist': num_dms - 1, 'time_stamp': dt})
-    store["dms"][dm_id]["members"] = []
+    record('append', ['workspace', 'dms'], store['workspace']['dms'][-1])
+    remove_dm_members(dm_id)
     store["dms"][dm_id]["dm_id"] = -1
+    record('set', ['dms', dm_id, 'dm_id'], -1)
    
-    num_msgs = store["workspace"]["messages"][-1]["num_messages_exist"] - len(store["dms"][dm_id]["message"])
+    num_msgs = store["workspace"]["messages"][-1]["num_messages_exist"] - len(history(store, "dms", dm_id))
     store["workspace"]["messages"].append({"num_messages_exist": num_msgs, "time_stamp": dt})
+    record('append', ['workspace', 'messages'], store['workspace']['messages'][-1])
     
     data_store.set(store)
     save_data()
@@ -245,11 +246,9 @@ def dm_leave_v1(token, dm_id):
         raise AccessError(description="User not in dm.")
 
     store = data_store.get()
-    for member in store['dms'][dm_id]['members']:
-        if member['u_id'] == decode_token(token)['auth_user_id']:
-            store['dms'][dm_id]['members'].remove(member)
+    remove_dm_member(dm_id, token_user_id(token))
     dt = int(datetime.datetime.now().timestamp())
-    stat_user_dm_remove(decode_token(token)['auth_user_id'], dt)
+    stat_user_dm_remove(token_user_id(token), dt)
     data_store.set(store)
     save_data()
     return {}
@@ -287,7 +286,8 @@ def dm_messages_v1(token, dm_id, start):
     if not check_user_in_dm(token, dm_id):
         raise AccessError(description="User not in dm")
 
-    total_messages = len(store["dms"][dm_id]["message"])
+    messages = history(store, "dms", dm_id)
+    total_messages = len(messages)
     if start >= total_messages and (total_messages != 0 or start != 0):
         raise InputError(description="Not enough messages")
 
@@ -300,11 +300,11 @@ def dm_messages_v1(token, dm_id, start):
     i = start
     message_history = [] 
     while i < end:
-        if check_react_id(token, store["dms"][dm_id]["message"][total_messages - 1 - i]["message_id"]):
-            store["dms"][dm_id]["message"][total_messages - 1 - i]["reacts"][0]["is_this_user_reacted"] = True
+        if check_react_id(token, messages[total_messages - 1 - i]["message_id"]):
+            messages[total_messages - 1 - i]["reacts"][0]["is_this_user_reacted"] = True
         else: 
-            store["dms"][dm_id]["message"][total_messages - 1 - i]["reacts"][0]["is_this_user_reacted"] = False
-        message_history.append(store["dms"][dm_id]["message"][total_messages - 1 - i])
+            messages[total_messages - 1 - i]["reacts"][0]["is_this_user_reacted"] = False
+        message_history.append(messages[total_messages - 1 - i])
         i += 1
 
     return {
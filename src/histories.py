@@ -0,0 +1,136 @@
+'''
+histories.py
+
+This contains access to the message histories of channels and dms. Every read or change of a
+history goes through history(), rather than store['channels'][channel_id]['message'].
+
+In 'sections' persistence mode the histories are not loaded at start up, since most channels
+are cold. history() pages a history in from its segment file the first time it is used. Once
+more than config.history_budget messages are loaded, whether after paging one in or after a
+flush, the least recently used histories are dropped from memory again. A history changed since
+the last flush is dirty (see journal.record) and is only dropped once it has been saved. In
+every other mode the histories are always in memory.
+
+Each history is a MessageHistory (see message_history.py), which history() makes from the
+plain list the first time it is used. A message is found in it by message_id without walking
+the history, and is removed by leaving a tombstone in its slot, so neither depends on how long
+the history is.
+'''
+
+from collections import OrderedDict
+from src import config
+from src.section_store import read_history
+from src.message_history import MessageHistory
+
+# (section, idx) of each loaded history, least recently used first.
+global RESIDENT, DIRTY, LOADED
+RESIDENT = OrderedDict()
+# (section, idx) of each history changed since the last flush
+DIRTY = set()
+# number of messages in the loaded histories
+LOADED = 0
+
+def history(store, section, idx):
+    """Gets the message history of a channel or dm, loading it if needed.
+
+    Args:
+        dictionary: store
+        string: section, 'channels' or 'dms'
+        number: idx, the channel_id or dm_id
+
+    Returns:
+        MessageHistory of messages, oldest first.
+    """
+    global LOADED
+    record = store[section][idx]
+    if config.persistence_mode == 'sections':
+        RESIDENT[(section, idx)] = True
+        RESIDENT.move_to_end((section, idx))
+        if 'message' not in record:
+            record['message'] = MessageHistory(read_history(config.sections_dir, section, idx))
+            LOADED += len(record['message'])
+            evict_histories(store)
+    if not isinstance(record['message'], MessageHistory):
+        record['message'] = MessageHistory(record['message'])
+    return record['message']
+
+def mark_dirty(section, idx):
+    """Marks a history as changed since the last flush, so it is kept until it is saved."""
+    if config.persistence_mode == 'sections':
+        DIRTY.add((section, idx))
+        if (section, idx) not in RESIDENT:
+            RESIDENT[(section, idx)] = True
+
+def evict_histories(store, saved=False):
+    """Drops the least recently used histories until the loaded ones fit in the budget. Dirty
+    histories are skipped, as they have not been saved yet, and the most recently used history
+    is always kept.
+
+    Args:
+        dictionary: store
+        boolean: saved, True straight after a flush, when every history is saved
+    """
+    global LOADED
+    if config.persistence_mode != 'sections':
+        return
+    if saved:
+        DIRTY.clear()
+        LOADED = sum(len(store[section][idx]['message']) for section, idx in RESIDENT)
+    if LOADED <= config.history_budget:
+        return
+    newest = next(reversed(RESIDENT))
+    for section, idx in list(RESIDENT):
+        if LOADED <= config.history_budget:
+            break
+        if (section, idx) in DIRTY or (section, idx) == newest:
+            continue
+        del RESIDENT[(section, idx)]
+        LOADED -= len(store[section][idx].pop('message'))
+
+def message_position(store, section, idx, message_id):
+    """Finds the position of a message in the history of a channel or dm.
+
+    Args:
+        dictionary: store
+        string: section, 'channels' or 'dms'
+        number: idx, the channel_id or dm_id
+        number: message_id
+
+    Returns:
+        number: index of the message in the history, or None if it is not there.
+    """
+    return history(store, section, idx).position(message_id)
+
+def append_message(store, section, idx, message):
+    """Appends a message to the history of a channel or dm.
+
+    Args:
+        dictionary: store
+        string: section, 'channels' or 'dms'
+        number: idx, the channel_id or dm_id
+        dictionary: message
+    """
+    global LOADED
+    history(store, section, idx).append(message)
+    if (section, idx) in RESIDENT:
+        LOADED += 1
+
+def remove_message(store, section, idx, message_id):
+    """Removes a message from the history of a channel or dm.
+
+    Args:
+        dictionary: store
+        string: section, 'channels' or 'dms'
+        number: idx, the channel_id or dm_id
+        number: message_id
+    """
+    global LOADED
+    history(store, section, idx).remove_id(message_id)
+    if (section, idx) in RESIDENT:
+        LOADED -= 1
+
+def reset_histories():
+    global LOADED
+    RESIDENT.clear()
+    DIRTY.clear()
+    LOADED = 0
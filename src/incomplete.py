@@ -5,7 +5,13 @@ This contains the functions that are not finished but at least have some impleme
 '''
 from src.error import InputError, AccessError
 from src.other import *
-from src.tokens import decode_token
+from src.tokens import token_user_id
+from src.histories import history
+from src.message_helpers import message_location, find_message
+from src.channel_helpers import user_channels
+from src.dm_helpers import user_dms
+from src.search_helpers import candidate_messages, top_matches, ORDERS, PAGE_SIZE
+from src.notification_helpers import recent_notifications
 
 def notifications_get_v1(token):
     '''Return the user's most recent 20 notifications, ordered from most recent to least recent.
@@ -23,26 +29,33 @@ def notifications_get_v1(token):
     if check_valid_token(token) != True:
         raise AccessError(description="Invalid Login session")
 
-    # Implement function.
-    notifications = []
+    notifications = recent_notifications(token_user_id(token))
 
     return {'notifications': notifications}
 
-def search_v1(token, query_str):
+def search_v1(token, query_str, start=0, limit=PAGE_SIZE, order='newest'):
     '''Given a query string, return a collection of messages in all of the channels/DMs that
-    the user has joined that contain the query (case-insensitive). There is no expected order
-    for these messages.
+    the user has joined that contain the query (case-insensitive). The messages are ranked, newest
+    first or most reacted first, and up to limit of them are returned from the rank start. If there
+    are no more messages after them, end is -1, otherwise it is the start of the next page.
+    The messages that could contain the query are found with the trigram index in search_helpers.py,
+    and then checked. A query shorter than three characters is looked for in the user's channels
+    and DMs instead.
     
     Exceptions:
         AccessError: When token invalid
-        InputError: When length of query string is less than 1 or greater than 1000 characters
+        InputError: When length of query string is less than 1 or greater than 1000 characters,
+            start is negative, limit is less than 1 or order is not 'newest' or 'reacts'
 
     Args:
         string: token
         string: query_str
+        int: start (default 0)
+        int: limit (default 50)
+        string: order (default 'newest')
 
     Returns:
-        {messages: [{message_id, u_id, message, time_sent, reacts, is_pinned}]}
+        {messages: [{message_id, u_id, message, time_sent, reacts, is_pinned}], start, end}
     '''
     # Check valid token.
     if check_valid_token(token) != True:
@@ -52,10 +65,54 @@ def search_v1(token, query_str):
     if len(query_str) < 1 or len(query_str) > 1000:
         raise InputError(description="Invalid query string length.")
 
-    # Implement function.
-    search_result = []
+    # Check valid page.
+    if start < 0 or limit < 1:
+        raise InputError(description="Invalid start or limit.")
+    if order not in ORDERS:
+        raise InputError(description="Invalid order.")
+
+    auth_user_id = token_user_id(token)
+    store = data_store.get()
+    query = query_str.casefold()
+    message_ids = candidate_messages(query_str)
+    if message_ids is None:
+        matches = scan_messages(store, auth_user_id, query)
+    else:
+        matches = check_candidates(store, auth_user_id, query, message_ids)
+    page, end = top_matches(matches, order, start, limit)
+
+    search_result = [search_message(message, auth_user_id) for message in page]
+    return {'messages': search_result, 'start': start, 'end': end}
+
+def check_candidates(store, auth_user_id, query, message_ids):
+    ''' Goes through the candidates for a query that are in the user's channels and DMs, and
+    yields the ones that contain it.
+    '''
+    for message_id in message_ids:
+        location = message_location(message_id)
+        if location["channel_id"] != -1 and is_member(location["channel_id"], auth_user_id):
+            message = find_message(store, message_id)
+        elif location["dm_id"] != -1 and is_dm_member(location["dm_id"], auth_user_id):
+            message = find_message(store, message_id)
+        else:
+            continue
+        # Having every trigram of the query does not mean having them in order.
+        if query in message["message"].casefold():
+            yield message
+
+def scan_messages(store, auth_user_id, query):
+    ''' Looks through the messages of the user's channels and DMs for a case-folded query that is
+    too short to have trigrams, and yields the ones that contain it.
+    '''
+    for channel_id in user_channels(auth_user_id):
+        yield from (message for message in history(store, "channels", channel_id) if query in message["message"].casefold())
+    for dm_id in user_dms(auth_user_id):
+        yield from (message for message in history(store, "dms", dm_id) if query in message["message"].casefold())
 
-    return {'messages': search_result}
+def search_message(message, auth_user_id):
+    ''' Copies a message for the search results, with is_this_user_reacted set for the user. '''
+    reacts = [{**react, "is_this_user_reacted": auth_user_id in react["u_ids"]} for react in message["reacts"]]
+    return {**message, "reacts": reacts}
 
 def message_share_v1(token, og_message_id, message, channel_id, dm_id):
     '''og_message_id is the ID of the original message. channel_id is the channel that the message
@@ -106,7 +163,7 @@ def message_share_v1(token, og_message_id, message, channel_id, dm_id):
     # Check user is in the place they want to share.
     if channel_id == -1 and check_user_in_dm(token, dm_id) == False:
         raise AccessError(description="Authorised user not in the dm.")
-    if dm_id == -1 and check_channel_memebers(channel_id, decode_token(token)['auth_user_id']) == False:
+    if dm_id == -1 and check_channel_memebers(channel_id, token_user_id(token)) == False:
         raise AccessError(description="Authorised user not in the channel.")
     
     # Check og_message_id is valid. NEEDS TO BE IMPLEMENTED
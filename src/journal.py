@@ -0,0 +1,166 @@
+'''
+journal.py
+
+This contains the write-ahead journal for the data store. Rather than rewriting the whole
+store on every change, each mutation is recorded as a small operation describing what
+changed (e.g. "append this message to channel 2's history"). save_data appends the
+recorded operations to the journal file as a single batch, and load_data rebuilds the
+store by replaying the batches on top of the last snapshot.
+
+An operation is a dictionary with an 'op', a 'path' and a 'value'. The path is a list of
+keys and indices from the root of the store. A dictionary inside a path selects the list
+element whose fields match it (see store_path.py), so messages can be addressed by message_id
+even after earlier messages in the same history have been removed. When the journal is
+replayed, a message_id selector in a history is found through the history's slot map (see
+message_history.py) rather than by walking the history, so replaying a change to a message
+does not depend on how long its history is.
+
+    'set'       store[path] = value
+    'append'    store[path].append(value)
+    'remove'    store[path].remove(value)
+    'delete'    del store[path]
+'''
+
+import copy
+import json
+import os
+from src.store_path import apply_path
+from src.histories import history, message_position, append_message, remove_message, mark_dirty
+
+global PENDING_OPS, JOURNAL_SEQ
+PENDING_OPS = []
+JOURNAL_SEQ = 0
+
+def record(op, path, value=None):
+    """Records a mutation of the data store so that it is written by the next save_data.
+    The value is copied, so later changes to the same object are recorded separately.
+
+    Args:
+        string: op, one of 'set', 'append', 'remove' or 'delete'
+        list: path from the root of the store to the value being changed
+        value: the new value, appended value or removed value
+
+    Returns:
+        Empty dictionary.
+    """
+    PENDING_OPS.append({'op': op, 'path': list(path), 'value': copy.deepcopy(value)})
+    if is_history(path):
+        mark_dirty(path[0], path[1])
+    elif op == 'append' and list(path) in (['channels'], ['dms']):
+        mark_dirty(path[0], value['channel_id' if path[0] == 'channels' else 'dm_id'])
+    return {}
+
+def take_ops():
+    """Takes every operation recorded since the last call, leaving none pending.
+
+    Returns:
+        list: the pending operations, oldest first
+    """
+    global PENDING_OPS
+    ops = PENDING_OPS
+    PENDING_OPS = []
+    return ops
+
+def next_seq():
+    """Generates the sequence number of the next journal batch.
+
+    Returns:
+        number: The next batch sequence number
+    """
+    global JOURNAL_SEQ
+    JOURNAL_SEQ += 1
+    return JOURNAL_SEQ
+
+def load_journal_seq(journal_seq):
+    global JOURNAL_SEQ
+    JOURNAL_SEQ = journal_seq
+
+def is_history(path):
+    """Checks whether a path leads to the message history of a channel or dm."""
+    return len(path) >= 3 and path[0] in ('channels', 'dms') and path[2] == 'message'
+
+def apply_op(store, op):
+    """Applies a recorded operation to the store. Used when replaying the journal.
+
+    Args:
+        dictionary: store
+        dictionary: op containing 'op', 'path' and 'value'
+    """
+    node, path, value = store, op['path'], op['value']
+    if is_history(path) and len(path) == 3 and op['op'] == 'append':
+        append_message(store, path[0], path[1], value)
+        return
+    if is_history(path) and len(path) > 3 and isinstance(path[3], dict) and list(path[3]) == ['message_id']:
+        section, idx, message_id = path[0], path[1], path[3]['message_id']
+        position = message_position(store, section, idx, message_id)
+        if position is None:
+            raise KeyError(path[3])
+        if len(path) == 4 and op['op'] == 'delete':
+            remove_message(store, section, idx, message_id)
+            return
+        node, path = history(store, section, idx), [position] + path[4:]
+    apply_path(node, op['op'], path, value)
+
+def append_batch(file_name, batch, sync=False):
+    """Appends a batch of operations to the journal as a single line of json.
+
+    Args:
+        string: file_name of the journal
+        dictionary: batch containing 'seq', the trackers and 'ops'
+        boolean: sync, whether to wait for the batch to reach the disk rather than leave it in
+            the OS page cache
+    """
+    with open(file_name, 'a', encoding='utf-8') as File:
+        File.write(json.dumps(batch, default=list) + '\n')
+        if sync:
+            File.flush()
+            os.fsync(File.fileno())
+
+def read_batches(file_name):
+    """Reads every complete batch from the journal, oldest first. A line that was only
+    partly written (e.g. the server was killed mid write) ends the journal.
+
+    Args:
+        string: file_name of the journal
+
+    Returns:
+        list of batch dictionaries.
+    """
+    if not os.path.exists(file_name):
+        return []
+    batches = []
+    with open(file_name, 'r', encoding='utf-8') as File:
+        for line in File:
+            try:
+                batches.append(json.loads(line))
+            except ValueError:
+                break
+    return batches
+
+def rotate_journal(file_name, last_seq):
+    """Moves the journal aside as a segment named after its last batch, so new batches start
+    a fresh journal. Does nothing if the journal is empty.
+
+    Args:
+        string: file_name of the journal
+        number: last_seq, the sequence number of the last batch in the journal
+    """
+    if os.path.exists(file_name) and os.path.getsize(file_name) > 0:
+        os.replace(file_name, f'{file_name}.{last_seq}')
+
+def journal_segments(file_name):
+    """Finds the rotated segments of a journal, oldest first.
+
+    Args:
+        string: file_name of the journal
+
+    Returns:
+        list of (last_seq, segment file name) tuples.
+    """
+    directory = os.path.dirname(file_name) or '.'
+    prefix = os.path.basename(file_name) + '.'
+    segments = []
+    for entry in os.listdir(directory):
+        if entry.startswith(prefix) and entry[len(prefix):].isdigit():
+            segments.append((int(entry[len(prefix):]), os.path.join(directory, entry)))
+    return sorted(segments)
@@ -0,0 +1,86 @@
+'''
+member_list.py
+
+This contains MemberList, which holds the members and owners of each channel, the members of
+each dm and the active tokens in the data store. A plain list keeps the order members joined
+in, but taking a member out of it shifts every member after them. A MemberList keeps its
+members in a dict, which also remembers the order they were added in, so adding, finding and
+removing a member all take constant time.
+
+Everywhere else it behaves like the list it replaces: it is iterated, indexed and compared
+with lists the same way, and it is saved as a list, since json.dump is given default=list and
+plain_records converts it before a snapshot is written. Loading gives back plain lists, which
+load_channels, load_dms and load_data turn into MemberLists again.
+'''
+
+from src.message_history import MessageHistory
+
+class MemberList:
+    """A list of unique members, in the order they were added.
+
+    Args:
+        members (iterable): the first members
+        key (string): field of each member holding its key, e.g. 'u_id' for dm members, or None
+            if the members are their own keys, e.g. the u_ids of channel members
+    """
+    def __init__(self, members=(), key=None):
+        self.key = key
+        self.members = {self.key_of(member): member for member in members}
+
+    def key_of(self, member):
+        return member if self.key is None else member[self.key]
+
+    def __iter__(self):
+        return iter(self.members.values())
+
+    def __len__(self):
+        return len(self.members)
+
+    def __contains__(self, member):
+        return self.key_of(member) in self.members
+
+    def __getitem__(self, idx):
+        return list(self.members.values())[idx]
+
+    def __eq__(self, other):
+        if isinstance(other, (list, MemberList)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f'MemberList({list(self)!r})'
+
+    def keys(self):
+        """Lists the keys of the members, in the order they were added."""
+        return list(self.members)
+
+    def has_key(self, key):
+        return key in self.members
+
+    def append(self, member):
+        self.members[self.key_of(member)] = member
+
+    def remove(self, member):
+        """Removes a member, raising ValueError if they are not one, the same as list.remove."""
+        if member not in self:
+            raise ValueError(f'{member!r} is not a member')
+        del self.members[self.key_of(member)]
+
+    def discard_key(self, key):
+        """Removes the member with a key, if there is one."""
+        self.members.pop(key, None)
+
+def plain_records(records):
+    """Copies channel or dm records with their MemberLists and MessageHistories turned into
+    lists, for formats that only take plain values.
+
+    Args:
+        records (list): store["channels"] or store["dms"]
+
+    Returns:
+        list of shallow copies of the records
+    """
+    return [{field: list(value) if isinstance(value, (MemberList, MessageHistory)) else value for field, value in record.items()}
+        for record in records]
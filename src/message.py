@@ -9,9 +9,14 @@ from src.data_store import data_store
 from src.error import InputError, AccessError
 from src.other import check_valid_token, check_valid_channel_id, check_channel_memebers, check_valid_dm_id, check_user_in_dm, get_permission, stat_user_message_add
 from src.message_helpers import generate_message, check_valid_message_id, check_valid_message_perms, check_react_id, check_valid_owner_perms, check_pin
+from src.message_helpers import message_location, find_message
 from src.persistence import save_data
-from src.tokens import decode_token
-from threading import Timer
+from src.tokens import token_user_id
+from src.journal import record
+from src.histories import append_message, remove_message
+from src.scheduler import schedule
+from src.search_helpers import index_message, unindex_message
+from src.notification_helpers import notify_tags, notify_react
 
 import datetime, time 
 
@@ -35,8 +40,6 @@ def message_send_v1(token, channel_id, message):
         dictionary containig: 
             "message_id": the id of the message that was sent  
     """
-    store = data_store.get()
-    
 
     if not check_valid_token(token):
         raise AccessError(description="Token provided not registered")
@@ -44,28 +47,49 @@ def message_send_v1(token, channel_id, message):
     if not check_valid_channel_id(channel_id):
         raise InputError(description="Invalid channel id")
 
-    u_id = decode_token(token)["auth_user_id"]
+    u_id = token_user_id(token)
     if not check_channel_memebers(channel_id, u_id):
         raise AccessError(description="User not in channel")
 
     if len(message) < 1 or len(message) > 1000:
         raise InputError(description="Message length too long or too short")
 
-    message_id = generate_message(token, channel_id, -1)
+    message_id = send_channel_message(u_id, channel_id, message)
+    notify_tags(u_id, channel_id, -1, message)
+    save_data()
+    return {"message_id": message_id}
+
+def send_channel_message(u_id, channel_id, message):
+    """ Sends a message to a channel from a user, without checking the user's token. Used by
+        message_send_v1 once the token is checked, and by standups once they finish.
+
+    Args:
+        u_id (int): the user sending the message
+        channel_id (int): the channel the message is sent to
+        message (string): the message
+
+    Returns:
+        int: the message id of the new message
+    """
+    store = data_store.get()
+
+    message_id = generate_message(u_id, channel_id, -1)
 
     new_message = {"message_id": message_id, "u_id": u_id, "message": message, "time_sent": int( time.time()), "reacts": [], "is_pinned": False}
     new_message["reacts"].append({"react_id": 1, "u_ids": [], "is_this_user_reacted": False})
-    store["channels"][channel_id]["message"].append(new_message)
+    append_message(store, "channels", channel_id, new_message)
+    index_message(message_id, message)
+    record('append', ['channels', channel_id, 'message'], new_message)
 
     # user/s stats updated when user sends message
     dt = int( time.time())
     stat_user_message_add(u_id, dt)
     num_msg = store['workspace']['messages'][-1]['num_messages_exist']
     store['workspace']['messages'].append({'num_messages_exist': num_msg + 1, 'time_stamp': dt})
+    record('append', ['workspace', 'messages'], store['workspace']['messages'][-1])
 
     data_store.set(store)
-    save_data()
-    return {"message_id": message_id}
+    return message_id
 
 def message_edit_v1(token, message_id, message):
 
@@ -102,31 +126,24 @@ def message_edit_v1(token, message_id, message):
     if len(message) > 1000:
         raise InputError(description="Message length too long")
 
-    for store_message in store["messages"]:
-        if store_message["message_id"] != message_id:
-            continue
-        else: 
-            channel_id = store_message["channel_id"]
-            dm_id = store_message["dm_id"]
+    location = message_location(message_id)
+    channel_id = location["channel_id"]
+    dm_id = location["dm_id"]
 
-    u_id = decode_token(token)["auth_user_id"]
+    u_id = token_user_id(token)
     if channel_id != -1:
         if not check_valid_message_perms(token, message_id) and get_permission(u_id) == 2:
             raise AccessError(description="Not permitted to edit message")
 
-        for channel_message in store["channels"][channel_id]["message"]:
-            if channel_message["message_id"] != message_id:
-                continue
-            else: 
-                channel_message["message"] = message
+        find_message(store, message_id)["message"] = message
+        record('set', ['channels', channel_id, 'message', {'message_id': message_id}, 'message'], message)
     else:
         if not check_valid_message_perms(token, message_id):
             raise AccessError(description="Not permitted to edit message") 
-        for dm_message in store["dms"][dm_id]["message"]:
-            if dm_message["message_id"] != message_id:
-                continue
-            else: 
-                dm_message["message"] = message
+        find_message(store, message_id)["message"] = message
+        record('set', ['dms', dm_id, 'message', {'message_id': message_id}, 'message'], message)
+    index_message(message_id, message)
+    notify_tags(u_id, channel_id, dm_id, message)
     data_store.set(store)
     save_data()
     return {}
@@ -157,45 +174,35 @@ def message_remove_v1(token, message_id):
     if not check_valid_message_id(token, message_id):
         raise InputError(description="Invalid message id")
 
-    for store_message in store["messages"]:
-        if store_message["message_id"] != message_id:
-            continue
-        else: 
-            channel_id = store_message["channel_id"]
-            dm_id = store_message["dm_id"]
-            # -1 channel id will mean the message is deleted (does not belong to a channel)
-            
+    location = message_location(message_id)
+    channel_id = location["channel_id"]
+    dm_id = location["dm_id"]
 
 
-    u_id = decode_token(token)["auth_user_id"]
+    u_id = token_user_id(token)
     if channel_id != -1:
         if not check_valid_message_perms(token, message_id) and get_permission(u_id) == 2:
             raise AccessError(description="Not permitted to edit message")
-        for channel_message in store["channels"][channel_id]["message"]:
-            if channel_message["message_id"] != message_id:
-                continue
-            else: 
-                store["channels"][channel_id]["message"].remove(channel_message)
+        remove_message(store, "channels", channel_id, message_id)
+        record('delete', ['channels', channel_id, 'message', {'message_id': message_id}])
     else:
         if not check_valid_message_perms(token, message_id):
             raise AccessError(description="Not permitted to edit message")
-        for dm_message in store["dms"][dm_id]["message"]:
-            if dm_message["message_id"] != message_id:
-                continue
-            else: 
-                store["dms"][dm_id]["message"].remove(dm_message)
-
-    for store_message in store["messages"]:
-        if store_message["message_id"] != message_id:
-            continue
-        else: 
-            store_message["channel_id"] = -1
-            store_message["dm_id"] = -1
+        remove_message(store, "dms", dm_id, message_id)
+        record('delete', ['dms', dm_id, 'message', {'message_id': message_id}])
+    unindex_message(message_id)
+
+    # -1 channel id will mean the message is deleted (does not belong to a channel)
+    location["channel_id"] = -1
+    location["dm_id"] = -1
+    record('set', ['messages', message_id, 'channel_id'], -1)
+    record('set', ['messages', message_id, 'dm_id'], -1)
 
     # users stats updated when user sends message
     dt = int( time.time())
     num_msg = store['workspace']['messages'][-1]['num_messages_exist']
     store['workspace']['messages'].append({'num_messages_exist': num_msg - 1, 'time_stamp': dt})
+    record('append', ['workspace', 'messages'], store['workspace']['messages'][-1])
 
     data_store.set(store)
     save_data()
@@ -235,18 +242,22 @@ def message_senddm_v1(token, dm_id, message):
     if len(message) < 1 or len(message) > 1000:
         raise InputError(description="Message length too long or too short")
 
-    auth_user_id = decode_token(token)["auth_user_id"]
-    message_id = generate_message(token, -1, dm_id)
+    auth_user_id = token_user_id(token)
+    message_id = generate_message(auth_user_id, -1, dm_id)
 
     new_message = {"message_id": message_id, "u_id": auth_user_id, "message": message, "time_sent": int( time.time()), "reacts": [], "is_pinned": False}
     new_message["reacts"].append({"react_id": 1, "u_ids": [], "is_this_user_reacted": False})
-    store["dms"][dm_id]["message"].append(new_message)
+    append_message(store, "dms", dm_id, new_message)
+    index_message(message_id, message)
+    record('append', ['dms', dm_id, 'message'], new_message)
+    notify_tags(auth_user_id, -1, dm_id, message)
 
     # user/s stats updated when user sends message
     dt = int( time.time())
     stat_user_message_add(auth_user_id, dt)
     num_msg = store['workspace']['messages'][-1]['num_messages_exist']
     store['workspace']['messages'].append({'num_messages_exist': num_msg + 1, 'time_stamp': dt})
+    record('append', ['workspace', 'messages'], store['workspace']['messages'][-1])
 
 
     data_store.set(store)
@@ -284,27 +295,22 @@ def message_react_v1(token, message_id, react_id):
     if check_react_id(token, message_id):
         raise InputError(description="Already reacted")
 
-    auth_user_id = decode_token(token)["auth_user_id"]
+    auth_user_id = token_user_id(token)
 
-    channel_id = -1
-    dm_id = -1
-    for message in store["messages"]:
-        if message["message_id"] != message_id:
-            continue
-        else:
-            channel_id = message["channel_id"]
-            dm_id = message["dm_id"]
+    location = message_location(message_id)
+    channel_id = location["channel_id"]
+    dm_id = location["dm_id"]
 
     if channel_id != -1:
-        for ch_message in store["channels"][channel_id]["message"]:
-            if ch_message["message_id"] == message_id:
-                ch_message["reacts"][0]["u_ids"].append(auth_user_id)
+        find_message(store, message_id)["reacts"][0]["u_ids"].append(auth_user_id)
+        record('append', ['channels', channel_id, 'message', {'message_id': message_id}, 'reacts', {'react_id': react_id}, 'u_ids'], auth_user_id)
     else:
         # assume (correctly) that id is valid, either will be valid channel id or dm id 
-        for dm_message in store["dms"][dm_id]["message"]:
-            if dm_message["message_id"] == message_id:
-                dm_message["reacts"][0]["u_ids"].append(auth_user_id)
-    
+        find_message(store, message_id)["reacts"][0]["u_ids"].append(auth_user_id)
+        record('append', ['dms', dm_id, 'message', {'message_id': message_id}, 'reacts', {'react_id': react_id}, 'u_ids'], auth_user_id)
+    notify_react(location["auth_user_id"], auth_user_id, channel_id, dm_id)
+
+    save_data()
     return {}
 
 def message_unreact_v1(token, message_id, react_id):
@@ -339,27 +345,21 @@ def message_unreact_v1(token, message_id, react_id):
     if not check_react_id(token, message_id):
         raise InputError(description="Already reacted")
 
-    auth_user_id = decode_token(token)["auth_user_id"]
+    auth_user_id = token_user_id(token)
 
-    channel_id = -1
-    dm_id = -1
-    for message in store["messages"]:
-        if message["message_id"] != message_id:
-            continue
-        else:
-            channel_id = message["channel_id"]
-            dm_id = message["dm_id"]
+    location = message_location(message_id)
+    channel_id = location["channel_id"]
+    dm_id = location["dm_id"]
 
     if channel_id != -1:
-        for ch_message in store["channels"][channel_id]["message"]:
-            if ch_message["message_id"] == message_id:
-                ch_message["reacts"][0]["u_ids"].remove(auth_user_id)
+        find_message(store, message_id)["reacts"][0]["u_ids"].remove(auth_user_id)
+        record('remove', ['channels', channel_id, 'message', {'message_id': message_id}, 'reacts', {'react_id': react_id}, 'u_ids'], auth_user_id)
     else:
         # assume (correctly) that id is valid, either will be valid channel id or dm id 
-        for dm_message in store["dms"][dm_id]["message"]:
-            if dm_message["message_id"] == message_id:
-                dm_message["reacts"][0]["u_ids"].remove(auth_user_id)
+        find_message(store, message_id)["reacts"][0]["u_ids"].remove(auth_user_id)
+        record('remove', ['dms', dm_id, 'message', {'message_id': message_id}, 'reacts', {'react_id': react_id}, 'u_ids'], auth_user_id)
 
+    save_data()
     return {}
 
 def message_pin_v1(token, message_id):
@@ -383,7 +383,7 @@ def message_pin_v1(token, message_id):
     if not check_valid_message_id(token, message_id):
         raise InputError(description="Invalid message id")
 
-    if not check_valid_owner_perms(token, message_id) and get_permission(decode_token(token)["auth_user_id"]) == 2:
+    if not check_valid_owner_perms(token, message_id) and get_permission(token_user_id(token)) == 2:
         raise AccessError(description="User does not have owner perms")
 
     if check_pin(message_id):
@@ -391,25 +391,19 @@ def message_pin_v1(token, message_id):
 
     store = data_store.get()
 
-    channel_id = -1
-    dm_id = -1
-    for message in store["messages"]:
-        if message["message_id"] != message_id:
-            continue
-        else:
-            channel_id = message["channel_id"]
-            dm_id = message["dm_id"]
+    location = message_location(message_id)
+    channel_id = location["channel_id"]
+    dm_id = location["dm_id"]
 
 
     if channel_id != -1:
-        for ch_message in store["channels"][channel_id]["message"]:
-            if ch_message["message_id"] == message_id:
-                ch_message["is_pinned"] = True
+        find_message(store, message_id)["is_pinned"] = True
+        record('set', ['channels', channel_id, 'message', {'message_id': message_id}, 'is_pinned'], True)
     else:
-        for dm_message in store["dms"][dm_id]["message"]:
-            if dm_message["message_id"] == message_id:
-                dm_message["is_pinned"] = True
+        find_message(store, message_id)["is_pinned"] = True
+        record('set', ['dms', dm_id, 'message', {'message_id': message_id}, 'is_pinned'], True)
 
+    save_data()
     return {}
 
 
@@ -435,7 +429,7 @@ def message_unpin_v1(token, message_id):
     if not check_valid_message_id(token, message_id):
         raise InputError(description="Invalid message id")
 
-    if not check_valid_owner_perms(token, message_id) and get_permission(decode_token(token)["auth_user_id"]) == 2:
+    if not check_valid_owner_perms(token, message_id) and get_permission(token_user_id(token)) == 2:
         raise AccessError(description="User does not have owner perms")
 
     if not check_pin(message_id):
@@ -443,25 +437,19 @@ def message_unpin_v1(token, message_id):
 
     store = data_store.get()
 
-    channel_id = -1
-    dm_id = -1
-    for message in store["messages"]:
-        if message["message_id"] != message_id:
-            continue
-        else:
-            channel_id = message["channel_id"]
-            dm_id = message["dm_id"]
+    location = message_location(message_id)
+    channel_id = location["channel_id"]
+    dm_id = location["dm_id"]
 
 
     if channel_id != -1:
-        for ch_message in store["channels"][channel_id]["message"]:
-            if ch_message["message_id"] == message_id:
-                ch_message["is_pinned"] = False
+        find_message(store, message_id)["is_pinned"] = False
+        record('set', ['channels', channel_id, 'message', {'message_id': message_id}, 'is_pinned'], False)
     else:
-        for dm_message in store["dms"][dm_id]["message"]:
-            if dm_message["message_id"] == message_id:
-                dm_message["is_pinned"] = False
+        find_message(store, message_id)["is_pinned"] = False
+        record('set', ['dms', dm_id, 'message', {'message_id': message_id}, 'is_pinned'], False)
 
+    save_data()
     return {}
 
 def message_sendlater_v1(token, channel_id, message, time_sent):
@@ -491,7 +479,7 @@ def message_sendlater_v1(token, channel_id, message, time_sent):
     if not check_valid_channel_id(channel_id):
         raise InputError(description="Invalid channel id")
 
-    u_id = decode_token(token)["auth_user_id"]
+    u_id = token_user_id(token)
     if not check_channel_memebers(channel_id, u_id):
         raise AccessError(description="User not in channel")
 
@@ -505,9 +493,11 @@ def message_sendlater_v1(token, channel_id, message, time_sent):
 
     wait_time = time_sent - current_time
 
-    message_id = generate_message(token, -1, -1)
+    message_id = generate_message(u_id, -1, -1)
+    schedule_message(message_id, channel_id, -1, message, time_sent)
+    save_data()
 
-    Timer(wait_time, message_sendlater_helper, [token, message_id, message, time_sent, channel_id, -1]).start()
+    schedule(wait_time, message_sendlater_helper, [message_id])
 
     return {"message_id": message_id}
 
@@ -551,40 +541,106 @@ def message_sendlaterdm_v1(token, dm_id, message, time_sent):
 
     wait_time = time_sent - current_time
     
-    message_id = generate_message(token, -1, -1)
+    message_id = generate_message(token_user_id(token), -1, -1)
+    schedule_message(message_id, -1, dm_id, message, time_sent)
+    save_data()
 
-    Timer(wait_time, message_sendlater_helper, [token, message_id, message, time_sent, -1, dm_id]).start()
+    schedule(wait_time, message_sendlater_helper, [message_id])
 
     return {"message_id": message_id}
 
-def message_sendlater_helper(token, message_id, message, time_sent, channel_id, dm_id):
+def schedule_message(message_id, channel_id, dm_id, message, time_sent):
+    """ Saves a message to be sent later with its entry in store["messages"], so it is still sent
+        if the server restarts before then.
+
+    Args:
+        message_id (int): the id given to the message when it was scheduled
+        channel_id (int): the channel the message is sent to, or -1
+        dm_id (int): the dm the message is sent to, or -1
+        message (string): the message
+        time_sent (int): the time when the message is sent
+    """
+    scheduled = {"channel_id": channel_id, "dm_id": dm_id, "message": message, "time_sent": time_sent}
+    message_location(message_id)["scheduled"] = scheduled
+    record('set', ['messages', message_id, 'scheduled'], scheduled)
+
+def message_sendlater_helper(message_id):
+    """ Sends a scheduled message once its time comes. Does nothing if the message is no
+        longer scheduled, e.g. the data store was cleared.
+
+    Args:
+        message_id (int): the id given to the message when it was scheduled
+    """
+    with data_store.lock:
+        if deliver_scheduled(message_id):
+            save_data()
+        return {}
+
+def deliver_scheduled(message_id):
+    """ Moves a scheduled message into its channel or dm.
+
+    Returns:
+        boolean: True if the message was scheduled
+    """
     store = data_store.get()
+    location = message_location(message_id)
+    if location is None or "scheduled" not in location:
+        return False
+    scheduled = location.pop("scheduled")
+    record('delete', ['messages', message_id, 'scheduled'])
+    channel_id, dm_id = scheduled["channel_id"], scheduled["dm_id"]
+    message, time_sent = scheduled["message"], scheduled["time_sent"]
 
     if dm_id != -1 and store["dms"][dm_id]["dm_id"] == -1:
-        data_store.set(store)
-        save_data()
-        return {}
+        return True
 
-    u_id = decode_token(token)['auth_user_id']
+    u_id = location["auth_user_id"]
 
-    store['messages'][message_id]['channel_id'] = channel_id
-    store['messages'][message_id]['dm_id'] = dm_id
+    location['channel_id'] = channel_id
+    location['dm_id'] = dm_id
+    record('set', ['messages', message_id, 'channel_id'], channel_id)
+    record('set', ['messages', message_id, 'dm_id'], dm_id)
 
     if channel_id != -1:
         new_message = {"message_id": message_id, "u_id": u_id, "message": message, "time_sent": time_sent, "reacts": [], "is_pinned": False}
         new_message["reacts"].append({"react_id": 1, "u_ids": [], "is_this_user_reacted": False})
-        store["channels"][channel_id]["message"].append(new_message)
+        append_message(store, "channels", channel_id, new_message)
+        record('append', ['channels', channel_id, 'message'], new_message)
 
     else: 
         new_message = {"message_id": message_id, "u_id": u_id, "message": message, "time_sent": time_sent, "reacts": [], "is_pinned": False}
         new_message["reacts"].append({"react_id": 1, "u_ids": [], "is_this_user_reacted": False})
-        store["dms"][dm_id]["message"].append(new_message)
+        append_message(store, "dms", dm_id, new_message)
+        record('append', ['dms', dm_id, 'message'], new_message)
+    index_message(message_id, message)
+    notify_tags(u_id, channel_id, dm_id, message)
 
     stat_user_message_add(u_id, time_sent)
     num_msg = store['workspace']['messages'][-1]['num_messages_exist']
     store['workspace']['messages'].append({'num_messages_exist': num_msg + 1, 'time_stamp': time_sent})
+    record('append', ['workspace', 'messages'], store['workspace']['messages'][-1])
 
     data_store.set(store)
-    save_data()
+    return True
+
+def rearm_scheduled():
+    """ Schedules the messages that were waiting to be sent when the data store was saved.
+        Messages whose time has passed while the server was down are all sent straight away,
+        in the order they were due, with a single save.
 
-    return {}
\ No newline at end of file
+    Returns:
+        number: how many overdue messages were sent
+    """
+    with data_store.lock:
+        store = data_store.get()
+        pending = [entry for entry in store["messages"] if "scheduled" in entry]
+        pending.sort(key=lambda entry: entry["scheduled"]["time_sent"])
+        now = time.time()
+        overdue = [entry["message_id"] for entry in pending if entry["scheduled"]["time_sent"] <= now]
+        for message_id in overdue:
+            deliver_scheduled(message_id)
+        if overdue:
+            save_data()
+        for entry in pending[len(overdue):]:
+            schedule(entry["scheduled"]["time_sent"] - now, message_sendlater_helper, [entry["message_id"]])
+        return len(overdue)
\ No newline at end of file
@@ -4,14 +4,24 @@
     There will be a global message tracker, a function that generates a message and appropriately adds it to store["messages"] 
     and a function that resets the message tracker for when clear is called. 
     There are also error checking functions specific to the message feature. 
+
+    MESSAGE_INDEX maps each message_id to its entry in store["messages"], so finding where a
+    message was sent does not scan every message ever sent. USER_MESSAGES maps each u_id to the
+    message_ids of the messages they sent, so removing a user only looks at their messages.
 """
 
 from src.data_store import data_store
-from src.tokens import decode_token
+from src.tokens import token_user_id
+from src.journal import record
+from src.histories import history
+from src.channel_helpers import is_member, is_owner
+from src.dm_helpers import is_dm_member
 
 
-global MESSAGE_TRACKER
+global MESSAGE_TRACKER, MESSAGE_INDEX, USER_MESSAGES
 MESSAGE_TRACKER = 0
+MESSAGE_INDEX = {}
+USER_MESSAGES = {}
 
 def generate_new_message_id():
     """Generates a new sequential message ID
@@ -26,13 +36,14 @@ def generate_new_message_id():
     return message_id
 
 
-def generate_message(token, channel_id, dm_id):
+def generate_message(auth_user_id, channel_id, dm_id):
     """Creates a new message inside datastore. The actual message does not get saved inside store["messages"]. Instead it saves
     a dictionary containing keys message_id, auth_user_id and channel_id. The actual message will be saved inside store["channels"][channel_id]["messages"]
 
     Args: 
-        token (string): token of user creating the message
+        auth_user_id (int): the user creating the message
         channel_id (int): channel_id of the channel the messasge is being sent to
+        dm_id (int): dm_id of the dm the messasge is being sent to
 
     Returns:
         int: The message ID of the new message
@@ -40,10 +51,12 @@ def generate_message(token, channel_id, dm_id):
 
     store = data_store.get()
 
-    auth_user_id = decode_token(token)["auth_user_id"]
-
     message_id = generate_new_message_id()
-    store["messages"].append({"message_id": message_id, "auth_user_id": auth_user_id, "channel_id": channel_id, "dm_id": dm_id})
+    new_entry = {"message_id": message_id, "auth_user_id": auth_user_id, "channel_id": channel_id, "dm_id": dm_id}
+    store["messages"].append(new_entry)
+    MESSAGE_INDEX[message_id] = new_entry
+    USER_MESSAGES.setdefault(auth_user_id, []).append(message_id)
+    record('append', ['messages'], new_entry)
     data_store.set(store)
 
     return message_id
@@ -56,8 +69,66 @@ def reset_messages():
     """
     global MESSAGE_TRACKER
     MESSAGE_TRACKER = 0
+    MESSAGE_INDEX.clear()
+    USER_MESSAGES.clear()
     return {}
 
+def load_messages(messages):
+    """Rebuilds the message indexes from the store["messages"] of a loaded data store.
+
+    Args:
+        messages (list): store["messages"]
+    """
+    MESSAGE_INDEX.clear()
+    USER_MESSAGES.clear()
+    for entry in messages:
+        MESSAGE_INDEX[entry["message_id"]] = entry
+        USER_MESSAGES.setdefault(entry["auth_user_id"], []).append(entry["message_id"])
+
+def user_message_ids(u_id):
+    """Lists the message_ids of every message a user sent or scheduled, including removed ones.
+
+    Returns:
+        list of message_ids, oldest first
+    """
+    return USER_MESSAGES.get(u_id, [])
+
+def message_location(message_id):
+    """ Finds where a message was sent in constant time. The entry is the one in store["messages"],
+        so it always reflects the message being removed or a send later message being delivered.
+
+    Args:
+        message_id (int): allows the message to be uniquely identified
+
+    Returns:
+        dictionary containing message_id, auth_user_id, channel_id and dm_id (both -1 if the message was
+        removed or not yet sent), or None if there is no such message id
+    """
+    if not isinstance(message_id, int):
+        return None
+    return MESSAGE_INDEX.get(message_id)
+
+def find_message(store, message_id):
+    """ Finds a message inside the history of the channel or dm it was sent to.
+
+    Args:
+        store (dictionary): the data store
+        message_id (int): allows the message to be uniquely identified
+
+    Returns:
+        dictionary: the message, or None if it is not in a channel or dm
+    """
+    location = message_location(message_id)
+    if location is None:
+        return None
+    if location["channel_id"] != -1:
+        section, idx = "channels", location["channel_id"]
+    elif location["dm_id"] != -1:
+        section, idx = "dms", location["dm_id"]
+    else:
+        return None
+    return history(store, section, idx).get(message_id)
+
 def check_valid_message_id(token, message_id):    
     """ Checks whether the message id refers to a valid message inside a channel the user has joined
 
@@ -69,31 +140,18 @@ def check_valid_message_id(token, message_id):
         boolean: True if the message id is valid 
     """
 
-    store = data_store.get()
-
-    auth_user_id = decode_token(token)["auth_user_id"]
-
-    channel_id = -1
-    dm_id = -1
-    for message in store["messages"]:
-        if message["message_id"] != message_id:
-            continue
-        else:
-            channel_id = message["channel_id"]
-            dm_id = message["dm_id"]
-
+    auth_user_id = token_user_id(token)
 
-    if channel_id == -1 and dm_id == -1:
+    location = message_location(message_id)
+    if location is None or (location["channel_id"] == -1 and location["dm_id"] == -1):
         return False
+    channel_id = location["channel_id"]
+    dm_id = location["dm_id"]
     
-    if channel_id != -1 and auth_user_id in store["channels"][channel_id]["members"]:
+    if channel_id != -1 and is_member(channel_id, auth_user_id):
+        return True
+    elif dm_id != -1 and is_dm_member(dm_id, auth_user_id):
         return True
-    elif dm_id != -1:
-        for member in store["dms"][dm_id]["members"]:
-            if member["u_id"] != auth_user_id:
-                continue
-            else: 
-                return True
     else: 
         return False
 
@@ -110,19 +168,17 @@ def check_valid_message_perms(token, message_id):
     """
     store = data_store.get()
 
-    auth_user_id = decode_token(token)["auth_user_id"]
-
-    channel_id = -1
-    dm_id = -1
-    for message in store["messages"]:
-        if message["message_id"] == message_id:
-            if message["auth_user_id"] == auth_user_id:
-                return True
-            else: 
-                channel_id = message["channel_id"]
-                dm_id = message["dm_id"]
+    auth_user_id = token_user_id(token)
+
+    location = message_location(message_id)
+    if location is None:
+        return False
+    if location["auth_user_id"] == auth_user_id:
+        return True
+    channel_id = location["channel_id"]
+    dm_id = location["dm_id"]
     
-    if channel_id != -1 and auth_user_id in store["channels"][channel_id]["owners"]:
+    if channel_id != -1 and is_owner(channel_id, auth_user_id):
         return True
     elif dm_id != -1 and auth_user_id == store["dms"][dm_id]["owners"]["u_id"]:
         return True
@@ -141,18 +197,15 @@ def check_valid_owner_perms(token, message_id):
     """
     store = data_store.get()
 
-    auth_user_id = decode_token(token)["auth_user_id"]
+    auth_user_id = token_user_id(token)
 
-    channel_id = -1
-    dm_id = -1
-    for message in store["messages"]:
-        if message["message_id"] != message_id:
-            continue
-        else: 
-            channel_id = message["channel_id"]
-            dm_id = message["dm_id"]
+    location = message_location(message_id)
+    if location is None:
+        return False
+    channel_id = location["channel_id"]
+    dm_id = location["dm_id"]
     
-    if channel_id != -1 and auth_user_id in store["channels"][channel_id]["owners"]:
+    if channel_id != -1 and is_owner(channel_id, auth_user_id):
         return True
     elif dm_id != -1 and auth_user_id == store["dms"][dm_id]["owners"]["u_id"]:
         return True
@@ -179,30 +232,10 @@ def check_react_id(token, message_id):
 
     store = data_store.get()
 
-    auth_user_id = decode_token(token)["auth_user_id"]
-
-    channel_id = -1
-    dm_id = -1
-    for message in store["messages"]:
-        if message["message_id"] != message_id:
-            continue
-        else:
-            channel_id = message["channel_id"]
-            dm_id = message["dm_id"]
-
+    auth_user_id = token_user_id(token)
 
-    if channel_id != -1:
-        for ch_message in store["channels"][channel_id]["message"]:
-            if ch_message["message_id"] == message_id:
-                if auth_user_id in ch_message["reacts"][0]["u_ids"]:
-                    return True 
-    else:
-        for dm_message in store["dms"][dm_id]["message"]:
-            if dm_message["message_id"] == message_id:
-                if auth_user_id in dm_message["reacts"][0]["u_ids"]:
-                    return True 
-
-    return False
+    message = find_message(store, message_id)
+    return message is not None and auth_user_id in message["reacts"][0]["u_ids"]
 
 def check_pin(message_id):    
     """ Checks whether the the message is pinned or not
@@ -218,21 +251,5 @@ def check_pin(message_id):
 
     store = data_store.get()
 
-    channel_id = -1
-    dm_id = -1
-    for message in store["messages"]:
-        if message["message_id"] != message_id:
-            continue
-        else:
-            channel_id = message["channel_id"]
-            dm_id = message["dm_id"]
-
-
-    if channel_id != -1:
-        for ch_message in store["channels"][channel_id]["message"]:
-            if ch_message["message_id"] == message_id:
-                return ch_message["is_pinned"]
-    else:
-        for dm_message in store["dms"][dm_id]["message"]:
-            if dm_message["message_id"] == message_id:
-                return dm_message["is_pinned"]
+    message = find_message(store, message_id)
+    return message is not None and message["is_pinned"]
@@ -0,0 +1,137 @@
+'''
+message_history.py
+
+This contains MessageHistory, which holds the messages of a channel or dm, oldest first.
+Removing a message from a plain list shifts every message after it, so in a long history a
+removal takes time in the length of the history. A MessageHistory gives every message a slot
+when it is appended, and a removed message leaves a tombstone (None) in its slot rather than
+being taken out. Once there are more tombstones than messages they are all dropped at once,
+so each removal costs O(log n) plus its share of that compaction.
+
+slots maps each message_id to its slot, so a message is found by id in constant time. The
+position of a message, counting only the messages that are left, is found with a Fenwick tree
+of which slots are alive, so finding a position and indexing by position take O(log n).
+
+Everywhere else it behaves like the list it replaces: it is iterated, indexed and compared
+with lists the same way, and it is saved as a list, since json.dump is given default=list and
+plain_records converts it before a snapshot is written. Loading gives back plain lists, which
+history() turns into MessageHistories again.
+'''
+
+class MessageHistory:
+    """The messages of a channel or dm, oldest first.
+
+    Args:
+        messages (iterable): the first messages
+    """
+    def __init__(self, messages=()):
+        self.rebuild([message for message in messages if message is not None])
+
+    def rebuild(self, messages):
+        """Starts again from a list of messages, with no tombstones."""
+        self.items = messages
+        self.slots = {message['message_id']: slot for slot, message in enumerate(messages)}
+        self.dead = 0
+        # tree[i] counts the live slots in (i - lowbit(i), i], for i from 1.
+        self.tree = [0] * (len(messages) + 1)
+        for i in range(1, len(self.tree)):
+            self.tree[i] += 1
+            parent = i + (i & -i)
+            if parent < len(self.tree):
+                self.tree[parent] += self.tree[i]
+
+    def count_before(self, slot):
+        """Counts the live slots before a slot."""
+        count = 0
+        while slot > 0:
+            count += self.tree[slot]
+            slot -= slot & -slot
+        return count
+
+    def slot_at(self, position):
+        """Finds the slot of the live message at a position."""
+        if self.dead == 0:
+            return position
+        slot, remaining = 0, position + 1
+        step = 1 << (len(self.tree) - 1).bit_length()
+        while step:
+            if slot + step < len(self.tree) and self.tree[slot + step] < remaining:
+                slot += step
+                remaining -= self.tree[slot]
+            step >>= 1
+        return slot
+
+    def position_of(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('message history index out of range')
+        return idx
+
+    def __len__(self):
+        return len(self.items) - self.dead
+
+    def __iter__(self):
+        return (message for message in self.items if message is not None)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        return self.items[self.slot_at(self.position_of(idx))]
+
+    def __setitem__(self, idx, message):
+        slot = self.slot_at(self.position_of(idx))
+        del self.slots[self.items[slot]['message_id']]
+        self.items[slot] = message
+        self.slots[message['message_id']] = slot
+
+    def __eq__(self, other):
+        if isinstance(other, (list, MessageHistory)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f'MessageHistory({list(self)!r})'
+
+    def get(self, message_id):
+        """Finds a message by its message_id, or None if it is not in the history."""
+        slot = self.slots.get(message_id)
+        return None if slot is None else self.items[slot]
+
+    def position(self, message_id):
+        """Finds the position of a message, or None if it is not in the history."""
+        slot = self.slots.get(message_id)
+        if slot is None:
+            return None
+        return slot if self.dead == 0 else self.count_before(slot)
+
+    def append(self, message):
+        slot = len(self.items)
+        self.items.append(message)
+        self.slots[message['message_id']] = slot
+        i = slot + 1
+        self.tree.append(1 + self.count_before(i - 1) - self.count_before(i - (i & -i)))
+
+    def remove_id(self, message_id):
+        """Removes the message with a message_id, raising KeyError if it is not in the history."""
+        self.kill(self.slots.pop(message_id))
+
+    def pop(self, idx=-1):
+        slot = self.slot_at(self.position_of(idx))
+        message = self.items[slot]
+        del self.slots[message['message_id']]
+        self.kill(slot)
+        return message
+
+    def kill(self, slot):
+        """Leaves a tombstone in a slot, dropping every tombstone once they outnumber the messages."""
+        self.items[slot] = None
+        self.dead += 1
+        i = slot + 1
+        while i < len(self.tree):
+            self.tree[i] -= 1
+            i += i & -i
+        if self.dead > 64 + len(self):
+            self.rebuild([message for message in self.items if message is not None])
@@ -0,0 +1,120 @@
+"""
+    This module contains the notifications behind notifications_get_v1, and the tag matching that
+    decides who a sent or edited message notifies.
+
+    Each user's notifications are kept in store["users"][u_id - 1]["notifications"], oldest
+    first, so they are saved with the data store, and NOTIFICATIONS holds the same notifications
+    for each u_id in a deque of at most NOTIFICATION_LIMIT, so getting them does not look at the
+    user's messages, reacts or invites. A notification is added when it happens, by
+    channel_invite_v1, dm_create_v1, message_react_v1 and when a user is tagged in a message that
+    is sent or edited, and once a user has NOTIFICATION_LIMIT notifications the oldest is dropped.
+"""
+
+import re
+from collections import deque
+from src.data_store import data_store
+from src.journal import record
+from src.user_helpers import user_by_handle
+from src.channel_helpers import is_member
+from src.dm_helpers import is_dm_member
+
+global NOTIFICATIONS
+NOTIFICATIONS = {}
+
+NOTIFICATION_LIMIT = 20
+
+# A tag is an @ followed by a handle, which is only letters and digits.
+TAG = re.compile(r'@([a-zA-Z0-9]+)')
+
+def notify(u_id, channel_id, dm_id, notification_message):
+    """Adds a notification for a user, dropping their oldest if they have NOTIFICATION_LIMIT of them.
+
+    Args:
+        u_id (int): the user being notified
+        channel_id (int): the channel it happened in, or -1
+        dm_id (int): the dm it happened in, or -1
+        notification_message (string): what happened
+    """
+    store = data_store.get()
+    user = store["users"][u_id - 1]
+    if "notifications" not in user:
+        # Users saved before notifications were added.
+        user["notifications"] = []
+        record('set', ['users', u_id - 1, 'notifications'], [])
+    notification = {"channel_id": channel_id, "dm_id": dm_id, "notification_message": notification_message}
+    NOTIFICATIONS.setdefault(u_id, deque(maxlen=NOTIFICATION_LIMIT)).append(notification)
+    user["notifications"].append(notification)
+    record('append', ['users', u_id - 1, 'notifications'], notification)
+    if len(user["notifications"]) > NOTIFICATION_LIMIT:
+        del user["notifications"][0]
+        record('delete', ['users', u_id - 1, 'notifications', 0])
+
+def recent_notifications(u_id):
+    """Gets a user's notifications, newest first.
+
+    Returns:
+        list of notifications
+    """
+    return list(reversed(NOTIFICATIONS.get(u_id, ())))
+
+def place_name(channel_id, dm_id):
+    """Gets the name of the channel or dm a notification is about."""
+    store = data_store.get()
+    if channel_id != -1:
+        return store["channels"][channel_id]["name"]
+    return store["dms"][dm_id]["name"]
+
+def sender_handle(u_id):
+    """Gets the handle of the user who caused a notification."""
+    return data_store.get()["users"][u_id - 1]["handle"]
+
+def notify_added(u_id, auth_user_id, channel_id, dm_id):
+    """Notifies a user that they were added to a channel or dm."""
+    notify(u_id, channel_id, dm_id, f"{sender_handle(auth_user_id)} added you to {place_name(channel_id, dm_id)}")
+
+def notify_react(u_id, auth_user_id, channel_id, dm_id):
+    """Notifies the sender of a message that it was reacted to, if they are still in its channel or dm."""
+    if (channel_id != -1 and is_member(channel_id, u_id)) or (dm_id != -1 and is_dm_member(dm_id, u_id)):
+        notify(u_id, channel_id, dm_id, f"{sender_handle(auth_user_id)} reacted to your message in {place_name(channel_id, dm_id)}")
+
+def notify_tags(auth_user_id, channel_id, dm_id, message):
+    """Notifies each user tagged in a message once, if they are in its channel or dm.
+
+    Args:
+        auth_user_id (int): the user who sent or edited the message
+        channel_id (int): the channel of the message, or -1
+        dm_id (int): the dm of the message, or -1
+        message (string): the message
+    """
+    tagged = []
+    for handle in TAG.findall(message):
+        user = user_by_handle(handle)
+        if user is None or user["id"] in tagged:
+            continue
+        if (channel_id != -1 and is_member(channel_id, user["id"])) or (dm_id != -1 and is_dm_member(dm_id, user["id"])):
+            tagged.append(user["id"])
+    if not tagged:
+        return
+    text = f"{sender_handle(auth_user_id)} tagged you in {place_name(channel_id, dm_id)}: {message[:20]}"
+    for u_id in tagged:
+        notify(u_id, channel_id, dm_id, text)
+
+def reset_notifications():
+    """Resets the notifications, for when data store is reset.
+
+    Returns:
+        Empty dictionary.
+    """
+    NOTIFICATIONS.clear()
+    return {}
+
+def load_notifications(users):
+    """Rebuilds the notifications from the users of a loaded data store.
+
+    Args:
+        users (list): store["users"]
+    """
+    reset_notifications()
+    for user in users:
+        if user.get("notifications"):
+            NOTIFICATIONS[user["id"]] = deque(user["notifications"], maxlen=NOTIFICATION_LIMIT)
@@ -8,10 +8,20 @@ There are also additional helper functions that are included in this file.
 
 '''
 from src.data_store import data_store
-from src.tokens import reset_sessions, decode_token
+from src.tokens import reset_sessions, token_user_id, is_active_token
 from src.message_helpers import reset_messages
+from src.histories import reset_histories
+from src.user_helpers import reset_users
+from src.channel_helpers import reset_channels, is_member, is_owner
+from src.dm_helpers import reset_dms, is_dm_member
+from src.scheduler import reset_scheduler
+from src.stats_helpers import reset_rollups, num_joined, update_utilizer
+from src.search_helpers import reset_search
+from src.notification_helpers import reset_notifications
 import hashlib
 from src.persistence import save_data
+from src.journal import record
+from src.member_list import MemberList
 
 def clear_v1():
     """Resets the data store to its empty state. Resets session and message tracker.
@@ -24,7 +34,8 @@ def clear_v1():
     store = data_store.get()
     store['users'] = []
     store['channels'] = []
-    store['tokens'] = []
+    store['tokens'] = MemberList()
+    store['sessions'] = {}
     store['messages'] = []
     store['dms'] = []
     store['workspace'] = {
@@ -33,9 +44,19 @@ def clear_v1():
         'messages': [],
         'num_users': 0,
     }
+    for section in ['users', 'channels', 'tokens', 'sessions', 'messages', 'dms', 'workspace']:
+        record('set', [section], store[section])
     data_store.set(store)
     reset_sessions()
     reset_messages()
+    reset_histories()
+    reset_users()
+    reset_channels()
+    reset_dms()
+    reset_scheduler()
+    reset_rollups()
+    reset_search()
+    reset_notifications()
     save_data()
     return {}
 
@@ -70,13 +91,7 @@ def check_valid_token(token):
     Returns:
         boolean
     '''
-    store = data_store.get()
-    for stored_token in store['tokens']:
-        if stored_token != token:
-            continue
-        else:
-            return True
-    return False
+    return is_active_token(token)
 
 def check_valid_channel_id(channel_id):
     ''' Checks if the channel_id exists. If exists return True, else False.
@@ -107,14 +122,7 @@ def check_channel_memebers(channel_id, u_ID):
     Returns:
         boolean
     '''
-    store = data_store.get()
-    members = store["channels"][channel_id]["members"]
-    for member in members:
-        if u_ID != member:
-            continue
-        else:
-            return True
-    return False
+    return is_member(channel_id, u_ID)
 
 def check_channel_owners(channel_id, u_ID):
     '''
@@ -127,14 +135,7 @@ def check_channel_owners(channel_id, u_ID):
     Returns:
         boolean
     '''
-    store = data_store.get()
-    owners = store["channels"][channel_id]["owners"]
-    for owner in owners:
-        if u_ID != owner:
-            continue
-        else:
-            return True
-    return False
+    return is_owner(channel_id, u_ID)
 
 def get_permission(u_id):
     ''' Given a valid user id, return that user's global permissions. 
@@ -166,59 +167,67 @@ def check_valid_dm_id(dm_id):
     return False
 
 def check_user_in_dm(token, dm_id):
-    payload = decode_token(token)
-    auth_user_id = payload['auth_user_id']
+    auth_user_id = token_user_id(token)
 
-    store = data_store.get()
-    dms = store['dms'][dm_id]
-    for users in dms["members"]:
-        if users["u_id"] != auth_user_id:
-            continue
-        else:
-            return True
-    return False
+    return is_dm_member(dm_id, auth_user_id)
 
 def stat_user_channel_add(auth_user_id, dt):
     ''' Update a user's stats when they join a channel. '''
     store = data_store.get()
+    joined = num_joined(store['users'][auth_user_id - 1])
     num_ch = store['users'][auth_user_id - 1]['stats']['channels'][-1]['num_channels_joined']
-    store['users'][auth_user_id - 1]['stats']['channels'].append({
+    point = {
         'num_channels_joined': num_ch + 1,
         'time_stamp': dt,
-    })
+    }
+    store['users'][auth_user_id - 1]['stats']['channels'].append(point)
+    update_utilizer(auth_user_id, joined, joined + 1)
+    record('append', ['users', auth_user_id - 1, 'stats', 'channels'], point)
     data_store.set(store)
     return {}
 
 def stat_user_channel_remove(auth_user_id, dt):
     ''' Update a user's stats when they leave a channel. '''
     store = data_store.get()
+    joined = num_joined(store['users'][auth_user_id - 1])
     num_ch = store['users'][auth_user_id - 1]['stats']['channels'][-1]['num_channels_joined']
-    store['users'][auth_user_id - 1]['stats']['channels'].append({
+    point = {
         'num_channels_joined': num_ch - 1,
         'time_stamp': dt,
-    })
+    }
+    store['users'][auth_user_id - 1]['stats']['channels'].append(point)
+    update_utilizer(auth_user_id, joined, joined - 1)
+    record('append', ['users', auth_user_id - 1, 'stats', 'channels'], point)
     data_store.set(store)
     return {}
 
 def stat_user_dm_add(auth_user_id, dt):
     ''' Update a user's stats when they join a dm. '''
     store = data_store.get()
+    joined = num_joined(store['users'][auth_user_id - 1])
     num_dm = store['users'][auth_user_id - 1]['stats']['dms'][-1]['num_dms_joined']
-    store['users'][auth_user_id - 1]['stats']['dms'].append({
+    point = {
         'num_dms_joined': num_dm + 1,
         'time_stamp': dt,
-    })
+    }
+    store['users'][auth_user_id - 1]['stats']['dms'].append(point)
+    update_utilizer(auth_user_id, joined, joined + 1)
+    record('append', ['users', auth_user_id - 1, 'stats', 'dms'], point)
     data_store.set(store)
     return {}
 
 def stat_user_dm_remove(auth_user_id, dt):
     ''' Update a user's stats when they leave a dm'''
     store = data_store.get()
+    joined = num_joined(store['users'][auth_user_id - 1])
     num_dm = store['users'][auth_user_id - 1]['stats']['dms'][-1]['num_dms_joined']
-    store['users'][auth_user_id - 1]['stats']['dms'].append({
+    point = {
         'num_dms_joined': num_dm - 1,
         'time_stamp': dt,
-    })
+    }
+    store['users'][auth_user_id - 1]['stats']['dms'].append(point)
+    update_utilizer(auth_user_id, joined, joined - 1)
+    record('append', ['users', auth_user_id - 1, 'stats', 'dms'], point)
     data_store.set(store)
     return {}
 
@@ -227,9 +236,11 @@ def stat_user_message_add(auth_user_id, dt):
     ''' Update a user's stats when they send a message'''
     store = data_store.get()
     num_msg = store['users'][auth_user_id - 1]['stats']['messages'][-1]['num_messages_sent']
-    store['users'][auth_user_id - 1]['stats']['messages'].append({
+    point = {
         'num_messages_sent': num_msg + 1,
         'time_stamp': dt,
-    })
+    }
+    store['users'][auth_user_id - 1]['stats']['messages'].append(point)
+    record('append', ['users', auth_user_id - 1, 'stats', 'messages'], point)
     data_store.set(store)
     return {}
\ No newline at end of file
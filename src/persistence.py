@@ -1,36 +1,420 @@
-''' 
+'''
     persistence.py
 
     This contains the functions that will allow the data to persist, even after the server is restarted.
     Essentially, data will also be saved inside a file (as well as in memory).
 
-    Contains a function that loads and saves the data. 
+    Contains a function that loads and saves the data.
+    In 'journal' mode (see config.py) save_data only appends the operations recorded since the
+    last save to the journal, and load_data replays them on top of the last full snapshot.
+    In 'snapshot' mode save_data rewrites the full snapshot every time.
+    In 'sections' mode save_data writes only the records that changed to their files, mostly by
+    appending (see section_store.py), and message histories are loaded lazily (see histories.py).
+    The first time the server starts in 'sections' mode, the json data is copied across.
+
+    Snapshots are written as json or, for faster loading, in the binary format in snapshot_format.py.
+
+    The compactor thread started by the server writes a fresh snapshot whenever the journal
+    grows too large or too old, so a restart only replays the journal written since then.
+    The snapshot is written from a copy of the store, so requests can carry on while it is
+    dumped. COPIES keeps the copy from the last compaction, and the operations flushed since
+    then tell which users, messages, channels, dms and history messages changed, so only those
+    are copied again while the store is locked.
+
+    The durability policy in config.py decides when saved changes reach the disk. 'always'
+    writes them inside save_data, and syncs the journal before it returns. 'interval' leaves them to the writer thread, which writes
+    every change saved in the last flush_interval seconds as one batch. 'shutdown' only writes
+    them when the server is stopped.
 '''
 
 
 from src.data_store import data_store
 from json import dump, load
-from src.tokens import SESSION_TRACKER, load_session_tracker
-from src.message_helpers import MESSAGE_TRACKER, load_message_tracker
+import os
+import pickle
+import time
+from threading import Thread, Event, Lock
+from src import config
+from src.tokens import load_session_tracker, load_tokens
+from src.message_helpers import load_message_tracker, load_messages
+from src.journal import take_ops, next_seq, append_batch, read_batches, apply_op, load_journal_seq
+from src.journal import rotate_journal, journal_segments
+from src.snapshot_format import dump_snapshot, load_snapshot, is_binary
+from src.section_store import dirty_files, write_files, write_all, read_files
+from src.histories import evict_histories, reset_histories, message_position
+from src.user_helpers import load_users
+from src.channel_helpers import load_channels
+from src.member_list import MemberList, plain_records
+from src.dm_helpers import load_dms
+from src.stats_helpers import load_stats
+from src.search_helpers import load_search
+from src.notification_helpers import load_notifications
+import src.journal
+import src.tokens
+import src.message_helpers
+
+global LAST_SNAPSHOT, SNAPSHOT_SEQ, PENDING_SAVES, COPIES, CHANGED, CHANGED_MESSAGES
+LAST_SNAPSHOT = time.time()
+SNAPSHOT_SEQ = 0
+PENDING_SAVES = 0
+FLUSH_WANTED = Event()
+COMPACTING = Lock()
+
+# section or (section, idx) of a history -> {'source': the list copied, 'copy': its copy}
+COPIES = {}
+# section -> indices of the records changed since the last copy, or None if the whole section was replaced
+CHANGED = {}
+# (section, idx) of a history -> message_ids changed in place since the last copy, or None if
+# messages were removed or the history was replaced. Appended messages are found by length.
+CHANGED_MESSAGES = {}
+
+# The field each top level list is indexed by, and the id of its first record.
+RECORD_IDS = {'users': ('id', 1), 'messages': ('message_id', 0), 'channels': ('channel_id', 0), 'dms': ('dm_id', 0)}
 
 def save_data():
-    
-    store = data_store.get()
-    data_structure = {
-        "data_store": store, 
-        "session_tracker": SESSION_TRACKER, 
-        "message_tracker": MESSAGE_TRACKER,
+    ''' Saves every change made to the data store since the last save. When the changes are
+    written to disk depends on the durability policy.
+    '''
+    global PENDING_SAVES
+    with data_store.lock:
+        PENDING_SAVES += 1
+        if config.durability == 'always':
+            flush_data()
+        elif PENDING_SAVES >= config.flush_changes:
+            FLUSH_WANTED.set()
+
+def flush_data():
+    ''' Writes every change saved since the last flush to disk. '''
+    global PENDING_SAVES
+    with data_store.lock:
+        ops = take_ops()
+        if PENDING_SAVES == 0 and not ops:
+            return
+        PENDING_SAVES = 0
+        if config.persistence_mode == 'journal':
+            note_changes(ops)
+            if ops:
+                append_batch(config.journal_file, {
+                    "seq": next_seq(),
+                    "session_tracker": src.tokens.SESSION_TRACKER,
+                    "message_tracker": src.message_helpers.MESSAGE_TRACKER,
+                    "ops": ops,
+                }, sync=config.durability == 'always')
+        elif config.persistence_mode == 'sections':
+            write_files(config.sections_dir, data_store.get(), dirty_files(ops), {
+                "session_tracker": src.tokens.SESSION_TRACKER,
+                "message_tracker": src.message_helpers.MESSAGE_TRACKER,
+            })
+            evict_histories(data_store.get(), saved=True)
+        else:
+            write_snapshot(snapshot_of(data_store.get()))
+
+def run_writer():
+    ''' Flushes every flush_interval seconds, or sooner once flush_changes saves are waiting. '''
+    while True:
+        FLUSH_WANTED.wait(config.flush_interval)
+        FLUSH_WANTED.clear()
+        flush_data()
+
+def start_writer():
+    ''' Starts the writer in a background thread, if the durability policy uses it. '''
+    if config.durability == 'interval':
+        Thread(target=run_writer, daemon=True).start()
+
+def snapshot_of(store):
+    ''' Bundles the store with the trackers and the last journal batch it includes. '''
+    return {
+        "data_store": store,
+        "session_tracker": src.tokens.SESSION_TRACKER,
+        "message_tracker": src.message_helpers.MESSAGE_TRACKER,
+        "journal_seq": src.journal.JOURNAL_SEQ,
     }
 
-    with open("persisted_data.json", 'w') as File:
-        dump(data_structure, File)
+def write_snapshot(data):
+    ''' Writes a snapshot to a temporary file before moving it into place, so a crash never
+    leaves a half written snapshot. The snapshot it replaces is kept as a fallback.
+    '''
+    global LAST_SNAPSHOT, SNAPSHOT_SEQ
+    store = data["data_store"]
+    data = dict(data, data_store=dict(store, tokens=list(store["tokens"]), channels=plain_records(store["channels"]), dms=plain_records(store["dms"])))
+    temp_file = config.data_file + '.tmp'
+    text = config.snapshot_format == 'json'
+    with open(temp_file, 'w' if text else 'wb', encoding='utf-8' if text else None) as File:
+        if text:
+            dump(data, File)
+        else:
+            dump_snapshot(data, File)
+        File.flush()
+        os.fsync(File.fileno())
+    if os.path.exists(config.data_file):
+        os.replace(config.data_file, config.data_file + '.prev')
+    os.replace(temp_file, config.data_file)
+    LAST_SNAPSHOT = time.time()
+    SNAPSHOT_SEQ = data["journal_seq"]
 
-def load_data():
+def copy_of(value):
+    ''' A pickle round trip copies much faster than copy.deepcopy. '''
+    return pickle.loads(pickle.dumps(value))
+
+def copy_user(user):
+    ''' Copies a user. Stat points are never changed once appended (a folded series is a new
+    list), so they are shared.
+    '''
+    copy = copy_of({key: value for key, value in user.items() if key != 'stats'})
+    copy['stats'] = {series: list(points) for series, points in user['stats'].items()}
+    return copy
+
+def copy_record(record):
+    ''' Copies a channel or dm without its history, which is copied by copy_history. '''
+    return copy_of({key: value for key, value in record.items() if key != 'message'})
+
+def mark_changed(section, idx):
+    changed = CHANGED.setdefault(section, set())
+    if changed is not None:
+        changed.add(idx)
+
+def mark_history(section, idx, message_id):
+    if message_id is None:
+        CHANGED_MESSAGES[(section, idx)] = None
+        return
+    changed = CHANGED_MESSAGES.setdefault((section, idx), set())
+    if changed is not None:
+        changed.add(message_id)
+
+def note_changes(ops):
+    ''' Notes which records and history messages a batch of operations changed, so the next
+    compaction copies them again.
+    '''
+    for op in ops:
+        path = op['path']
+        section = path[0]
+        if section not in RECORD_IDS:
+            # tokens, sessions and workspace are copied whole every time.
+            continue
+        if len(path) == 1:
+            if op['op'] != 'append':
+                CHANGED[section] = None
+                continue
+            field, first_id = RECORD_IDS[section]
+            idx = op['value'][field] - first_id
+            mark_changed(section, idx)
+            if section in ('channels', 'dms'):
+                mark_history(section, idx, None)
+        elif section in ('channels', 'dms') and len(path) > 2 and path[2] == 'message':
+            if len(path) == 3 and op['op'] == 'append':
+                CHANGED_MESSAGES.setdefault((section, path[1]), set())
+            elif len(path) > 4:
+                mark_history(section, path[1], path[3]['message_id'])
+            else:
+                # A message was removed, or the history was replaced.
+                mark_history(section, path[1], None)
+        else:
+            mark_changed(section, path[1])
+
+def copy_records(section, records, copy):
+    ''' Copies a top level list, reusing the copies of records that have not changed. '''
+    cache = COPIES.get(section)
+    changed = CHANGED.pop(section, set())
+    if cache is None or cache['source'] is not records or changed is None:
+        cache = COPIES[section] = {'source': records, 'copy': [copy(record) for record in records]}
+        return cache['copy']
+    copies = cache['copy']
+    for idx in changed:
+        if idx < len(copies):
+            copies[idx] = copy(records[idx])
+    copies.extend(copy(record) for record in records[len(copies):])
+    return copies
 
-    with open('persisted_data.json', 'r') as File:
-        data = load(File)
-        store = data["data_store"]
-        data_store.set(store)
-        load_session_tracker(data["session_tracker"])
-        load_message_tracker(data["message_tracker"])
+def copy_history(store, section, idx):
+    ''' Copies a history, reusing the copies of messages that have not changed. '''
+    messages = store[section][idx]['message']
+    cache = COPIES.get((section, idx))
+    changed = CHANGED_MESSAGES.pop((section, idx), set())
+    if cache is None or cache['source'] is not messages or changed is None or len(cache['copy']) > len(messages):
+        cache = COPIES[(section, idx)] = {'source': messages, 'copy': copy_of(list(messages))}
+        return cache['copy']
+    copies = cache['copy']
+    if len(copies) < len(messages):
+        copies.extend(copy_of(messages[len(copies):]))
+    for message_id in changed:
+        position = message_position(store, section, idx, message_id)
+        if position is not None:
+            copies[position] = copy_of(messages[position])
+    return copies
+
+def copy_store(store):
+    ''' Copies the store for a snapshot, only copying again what changed since the last copy.
+    The copy is shared with the next one, so it must not be changed.
+    '''
+    if CHANGED.get('channels', ()) is None or CHANGED.get('dms', ()) is None:
+        for key in [key for key in COPIES if isinstance(key, tuple)]:
+            del COPIES[key]
+    copy = {
+        'users': copy_records('users', store['users'], copy_user),
+        'messages': copy_records('messages', store['messages'], copy_of),
+        'tokens': list(store['tokens']),
+        # Times are replaced, never changed, so the dict of them can be shared.
+        'sessions': dict(store['sessions']),
+        'workspace': {key: list(value) if isinstance(value, list) else value for key, value in store['workspace'].items()},
+    }
+    for section in ['channels', 'dms']:
+        copy[section] = copy_records(section, store[section], copy_record)
+        for idx, record in enumerate(copy[section]):
+            record['message'] = copy_history(store, section, idx)
+    return copy
+
+def reset_copies():
+    ''' Forgets the copy kept for compaction, for when the store is loaded. '''
+    COPIES.clear()
+    CHANGED.clear()
+    CHANGED_MESSAGES.clear()
+
+def compact():
+    ''' Writes a fresh snapshot and deletes the journal segments that are no longer needed.
+    The store is only locked while the records that changed since the last compaction are
+    copied, and the journal rotated. The snapshot is written after the lock is released.
+    '''
+    with COMPACTING:
+        with data_store.lock:
+            flush_data()
+            data = snapshot_of(copy_store(data_store.get()))
+            rotate_journal(config.journal_file, data["journal_seq"])
+
+        # Segments after the previous snapshot are kept, in case the new one cannot be read.
+        previous_seq = SNAPSHOT_SEQ
+        write_snapshot(data)
+        for last_seq, segment in journal_segments(config.journal_file):
+            if last_seq <= previous_seq:
+                os.remove(segment)
+
+def compaction_due():
+    ''' Checks whether the journal has grown past the size or age limits in config.py. '''
+    if config.persistence_mode != 'journal' or not os.path.exists(config.journal_file):
+        return False
+    size = os.path.getsize(config.journal_file)
+    if size >= config.compaction_size:
+        return True
+    return size > 0 and time.time() - LAST_SNAPSHOT >= config.compaction_age
+
+def run_compactor():
+    ''' Checks the journal every compaction_interval seconds and compacts it when due. '''
+    while True:
+        time.sleep(config.compaction_interval)
+        try:
+            if compaction_due():
+                compact()
+        except OSError:
+            # e.g. the disk is full, try again next time.
+            continue
+
+def start_compactor():
+    ''' Starts the compactor in a background thread. The store is copied once first, before
+    the server takes requests, so no compaction has to copy all of it while requests wait.
+    '''
+    if config.persistence_mode == 'journal':
+        with data_store.lock:
+            copy_store(data_store.get())
+    Thread(target=run_compactor, daemon=True).start()
+
+def empty_store():
+    return {
+        'users': [],
+        'channels': [],
+        'tokens': [],
+        'sessions': {},
+        'messages': [],
+        'dms': [],
+        'workspace': {
+            'channels': [],
+            'dms': [],
+            'messages': [],
+            'num_users': 0,
+        },
+    }
+
+def read_snapshot():
+    ''' Reads the newest snapshot that is valid, falling back to the one before it. The store
+    only starts empty if neither snapshot exists, since replaying the journal onto an empty
+    store when a snapshot could not be read would quietly lose everything in the snapshot.
+
+    Raises:
+        ValueError: a snapshot exists, but neither it nor the one before it can be read
+    '''
+    found = False
+    for file_name in [config.data_file, config.data_file + '.prev']:
+        if not os.path.exists(file_name):
+            continue
+        found = True
+        try:
+            if is_binary(file_name):
+                data = load_snapshot(file_name)
+            else:
+                with open(file_name, 'r', encoding='utf-8') as File:
+                    data = load(File)
+        except (OSError, ValueError):
+            continue
+        if isinstance(data, dict) and "data_store" in data:
+            return data
+    if found:
+        raise ValueError(f"Cannot read the snapshot {config.data_file} or the one before it")
+    return {
+        "data_store": empty_store(),
+        "session_tracker": 0,
+        "message_tracker": 0,
+    }
+
+def replay_journal():
+    ''' Reads the newest snapshot and replays any journal batches written after it. '''
+    global SNAPSHOT_SEQ
+    data = read_snapshot()
+    # Snapshots written before session times were saved have no sessions.
+    data["data_store"].setdefault("sessions", {})
+    # So that replaying a logout does not search every token.
+    data["data_store"]["tokens"] = MemberList(data["data_store"]["tokens"])
+    # The loaded histories are those of the store being replayed, not of the store in memory.
+    reset_histories()
+    journal_seq = SNAPSHOT_SEQ = data.get("journal_seq", 0)
+
+    # A segment whose last batch is already in the snapshot is not read at all.
+    journal_files = [segment for last_seq, segment in journal_segments(config.journal_file) if last_seq > journal_seq]
+    for file_name in journal_files + [config.journal_file]:
+        for batch in read_batches(file_name):
+            if batch["seq"] <= journal_seq:
+                continue
+            for op in batch["ops"]:
+                apply_op(data["data_store"], op)
+            data["session_tracker"] = batch["session_tracker"]
+            data["message_tracker"] = batch["message_tracker"]
+            journal_seq = batch["seq"]
+    data["journal_seq"] = journal_seq
+    return data
+
+def load_data():
+    ''' Loads the saved data store, from the section files in 'sections' mode, or otherwise
+    from the snapshot and journal.
+    '''
+    data = None
+    if config.persistence_mode == 'sections':
+        data = read_files(config.sections_dir)
+    if data is None:
+        data = replay_journal()
+        if config.persistence_mode == 'sections':
+            write_all(config.sections_dir, data)
+            data = read_files(config.sections_dir)
 
+    # Tokens are kept in a MemberList, so ending a session does not search every token.
+    data["data_store"]["tokens"] = MemberList(data["data_store"]["tokens"])
+    data_store.set(data["data_store"])
+    reset_histories()
+    reset_copies()
+    load_session_tracker(data["session_tracker"])
+    load_tokens(data["data_store"]["tokens"], data["data_store"]["sessions"])
+    load_message_tracker(data["message_tracker"])
+    load_messages(data["data_store"]["messages"])
+    load_users(data["data_store"]["users"])
+    load_channels(data["data_store"]["channels"])
+    load_dms(data["data_store"]["dms"])
+    load_stats(data["data_store"]["users"])
+    load_search()
+    load_notifications(data["data_store"]["users"])
+    load_journal_seq(data.get("journal_seq", 0))
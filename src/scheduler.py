@@ -0,0 +1,135 @@
+'''
+scheduler.py
+
+This runs functions at a later time, for message_sendlater_v1, message_sendlaterdm_v1 and
+standup_start_v1. Every job waits in one min-heap ordered by the time it is due, and a single
+dispatcher thread runs each job when it is due, so pending jobs cost a heap entry each rather
+than a thread each.
+
+Jobs run one at a time on the dispatcher thread, so they take data_store.lock themselves, as
+they would from a Timer. A cancelled job stays in the heap until it reaches the top, or until
+cancelled jobs make up most of the heap, when the heap is rebuilt without them.
+
+'''
+import heapq
+import time
+from threading import Condition, Thread
+
+global JOBS, PENDING, NEXT_JOB_ID, DISPATCHER, STATS
+JOBS = []
+PENDING = {}
+NEXT_JOB_ID = 0
+DISPATCHER = None
+CONDITION = Condition()
+STATS = {'dispatched': 0, 'cancelled': 0, 'failed': 0, 'last_lag': 0.0, 'max_lag': 0.0}
+
+def schedule(delay, function, args=()):
+    ''' Runs function(*args) on the dispatcher thread in delay seconds.
+
+    Args:
+        float: delay, in seconds
+        function: the job
+        tuple: args for the job
+
+    Returns:
+        int: job_id, to cancel the job with
+    '''
+    global NEXT_JOB_ID
+    with CONDITION:
+        start_dispatcher()
+        job_id = NEXT_JOB_ID
+        NEXT_JOB_ID += 1
+        # [due, job_id, function, args], function is set to None when the job is cancelled.
+        job = [time.time() + delay, job_id, function, tuple(args)]
+        PENDING[job_id] = job
+        heapq.heappush(JOBS, job)
+        CONDITION.notify()
+    return job_id
+
+def cancel(job_id):
+    ''' Stops a job that has not run yet from running.
+
+    Args:
+        int: job_id
+
+    Returns:
+        boolean: True if the job was pending
+    '''
+    with CONDITION:
+        job = PENDING.pop(job_id, None)
+        if job is None:
+            return False
+        job[2] = None
+        job[3] = ()
+        STATS['cancelled'] += 1
+        if len(JOBS) > 64 and len(PENDING) < len(JOBS) // 2:
+            JOBS[:] = [job for job in JOBS if job[2] is not None]
+            heapq.heapify(JOBS)
+        CONDITION.notify()
+    return True
+
+def next_due_job():
+    ''' Waits until the earliest pending job is due, then takes it off the heap. '''
+    with CONDITION:
+        while True:
+            while JOBS and JOBS[0][2] is None:
+                heapq.heappop(JOBS)
+            if not JOBS:
+                CONDITION.wait()
+                continue
+            wait = JOBS[0][0] - time.time()
+            if wait > 0:
+                CONDITION.wait(wait)
+                continue
+            job = heapq.heappop(JOBS)
+            del PENDING[job[1]]
+            return job
+
+def run_dispatcher():
+    ''' Runs each job when it is due, one after another. '''
+    while True:
+        due, _, function, args = next_due_job()
+        lag = time.time() - due
+        STATS['last_lag'] = lag
+        STATS['max_lag'] = max(STATS['max_lag'], lag)
+        try:
+            function(*args)
+            STATS['dispatched'] += 1
+        except Exception:
+            # e.g. the data store was cleared before the job ran, the next job still runs.
+            STATS['failed'] += 1
+
+def start_dispatcher():
+    ''' Starts the dispatcher thread the first time a job is scheduled. '''
+    global DISPATCHER
+    if DISPATCHER is None:
+        DISPATCHER = Thread(target=run_dispatcher, daemon=True)
+        DISPATCHER.start()
+
+def scheduler_stats():
+    ''' Reports on the jobs waiting and the jobs run.
+
+    Returns:
+        dictionary containing:
+            'queue_depth': number of pending jobs
+            'dispatched', 'cancelled', 'failed': number of jobs
+            'last_lag', 'max_lag': seconds jobs ran after they were due
+    '''
+    with CONDITION:
+        return {'queue_depth': len(PENDING), **STATS}
+
+def reset_scheduler():
+    ''' Cancels every pending job and resets the stats, for when data store is reset.
+
+    Returns:
+        Empty dictionary.
+    '''
+    with CONDITION:
+        for job in PENDING.values():
+            job[2] = None
+            job[3] = ()
+        PENDING.clear()
+        JOBS.clear()
+        STATS.update(dispatched=0, cancelled=0, failed=0, last_lag=0.0, max_lag=0.0)
+        CONDITION.notify()
+    return {}
@@ -0,0 +1,176 @@
+"""
+    This module contains the trigram index and paging behind search_v1.
+
+    search_v1 matches any part of a message, case-insensitively, so the index is of trigrams:
+    every run of three characters of the case-folded text, so 'Deploy' has the trigrams 'dep',
+    'epl', 'plo' and 'loy'. POSTINGS maps each trigram to the set of message_ids of the messages
+    it appears in, and MESSAGE_GRAMS maps each message_id to its trigrams, as a tuple since it is
+    only iterated and a tuple is much smaller than a set, so a message can be taken out of the
+    index without looking at its text again. A message can only contain the query if it has every
+    trigram of the query, so intersecting the postings of the query's trigrams, smallest first,
+    narrows the search down to a few candidates, which search_v1 then checks against the text
+    itself. Queries shorter than three characters have no trigrams, and are looked for in the
+    user's channels and dms instead.
+
+    search_v1 returns a page of the matches at a time, in one of the ORDERS. Only the matches on
+    the page and before it are kept, in a heap of at most start + limit messages, so a common
+    query does not build, sort or return every message it matches.
+
+    Messages are indexed as they are sent, delivered later, edited or removed. The index is not
+    saved with the data store. After a load it is built the first time it is used, from the
+    channel and dm histories, so that in 'sections' persistence mode the histories are not all
+    paged in at start up.
+"""
+
+import heapq
+import sys
+from src.data_store import data_store
+from src.histories import history
+
+global POSTINGS, MESSAGE_GRAMS, BUILT
+POSTINGS = {}
+MESSAGE_GRAMS = {}
+BUILT = True
+
+GRAM = 3
+
+# Number of search results on a page, unless a limit is given.
+PAGE_SIZE = 50
+
+def num_reacts(message):
+    """Counts the reacts of every kind on a message."""
+    return sum(len(react["u_ids"]) for react in message["reacts"])
+
+# Sort key of each order of search results, largest first. Ties go to the newest message.
+ORDERS = {
+    'newest': lambda message: (message["time_sent"], message["message_id"]),
+    'reacts': lambda message: (num_reacts(message), message["time_sent"], message["message_id"]),
+}
+
+def grams_of(text):
+    """Splits text into the trigrams of its case-folded text.
+
+    Returns:
+        set of strings, empty if the text is shorter than three characters
+    """
+    text = text.casefold()
+    return {text[i:i + GRAM] for i in range(len(text) - GRAM + 1)}
+
+def index_message(message_id, text):
+    """Adds a message to the index, replacing its trigrams if it is already in it.
+
+    Args:
+        message_id (int): the message
+        text (string): the message's text
+    """
+    if not BUILT:
+        return
+    unindex_message(message_id)
+    grams = tuple(grams_of(text))
+    MESSAGE_GRAMS[message_id] = grams
+    for gram in grams:
+        POSTINGS.setdefault(gram, set()).add(message_id)
+
+def unindex_message(message_id):
+    """Takes a message out of the index, if it is in it."""
+    for gram in MESSAGE_GRAMS.pop(message_id, ()):
+        postings = POSTINGS[gram]
+        postings.discard(message_id)
+        if not postings:
+            del POSTINGS[gram]
+
+def build_index():
+    """Indexes every message in the channel and dm histories, the first time the index is used
+    after a load.
+    """
+    global BUILT
+    if BUILT:
+        return
+    BUILT = True
+    store = data_store.get()
+    for section in ["channels", "dms"]:
+        for idx in range(len(store[section])):
+            for message in history(store, section, idx):
+                index_message(message["message_id"], message["message"])
+
+def candidate_messages(query_str):
+    """Finds the messages that have every trigram of a query, which includes every message that
+    contains the query.
+
+    Args:
+        query_str (string): the query
+
+    Returns:
+        set of message_ids, or None if the query is shorter than three characters
+    """
+    build_index()
+    grams = grams_of(query_str)
+    if not grams:
+        return None
+    postings = sorted((POSTINGS.get(gram, set()) for gram in grams), key=len)
+    return postings[0].intersection(*postings[1:])
+
+def top_matches(matches, order, start, limit):
+    """Ranks matches and takes one page of them, keeping only the top start + limit in a heap.
+
+    Args:
+        matches (iterable): messages matching a query
+        order (string): one of ORDERS
+        start (int): the rank of the first message on the page
+        limit (int): the most messages on the page
+
+    Returns:
+        tuple of the messages on the page, and the rank after the last of them, or -1 if there are
+        no more matches after the page
+    """
+    ranked = heapq.nlargest(start + limit + 1, matches, key=ORDERS[order])
+    if len(ranked) > start + limit:
+        return ranked[start:start + limit], start + limit
+    return ranked[start:], -1
+
+def index_stats():
+    """Reports on the size of the index. Bytes are as counted by sys.getsizeof, for the dictionaries,
+    sets and trigram strings, and not the message_ids, which are shared with the rest of the data store.
+
+    Returns:
+        dictionary containing:
+            'messages': number of messages indexed
+            'grams': number of distinct trigrams
+            'postings': number of (trigram, message_id) pairs
+            'postings_bytes', 'message_grams_bytes', 'total_bytes': memory used
+    """
+    postings_bytes = sys.getsizeof(POSTINGS)
+    for gram, message_ids in POSTINGS.items():
+        postings_bytes += sys.getsizeof(gram) + sys.getsizeof(message_ids)
+    message_grams_bytes = sys.getsizeof(MESSAGE_GRAMS)
+    for grams in MESSAGE_GRAMS.values():
+        message_grams_bytes += sys.getsizeof(grams)
+    return {
+        'messages': len(MESSAGE_GRAMS),
+        'grams': len(POSTINGS),
+        'postings': sum(len(message_ids) for message_ids in POSTINGS.values()),
+        'postings_bytes': postings_bytes,
+        'message_grams_bytes': message_grams_bytes,
+        'total_bytes': postings_bytes + message_grams_bytes,
+    }
+
+def reset_search():
+    """Resets the search index, for when data store is reset.
+
+    Returns:
+        Empty dictionary.
+    """
+    global BUILT
+    POSTINGS.clear()
+    MESSAGE_GRAMS.clear()
+    BUILT = True
+    return {}
+
+def load_search():
+    """Empties the search index after a load, so it is built from the loaded histories when it is
+    next used.
+    """
+    global BUILT
+    POSTINGS.clear()
+    MESSAGE_GRAMS.clear()
+    BUILT = False
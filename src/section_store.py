@@ -0,0 +1,452 @@
+'''
+section_store.py
+
+This contains the section store, used when config.persistence_mode is 'sections'. The data
+store is split across files in config.sections_dir, so that a change only writes the files of
+the records it touched:
+
+    meta.json                   trackers, workspace num_users and the last flush seq
+    users/0.json  ...           one file per user, without their stats
+    user_stats/0.jsonl  ...     each user's stats points, appended as [seq, series, point]
+    tokens.jsonl                tokens appended and removed, as [seq, 'append' or 'remove', token]
+    sessions.jsonl              session times set and deleted, as [seq, 'set' or 'delete', token, times]
+    messages/0.jsonl  ...       the store['messages'] entries of SEGMENT_SIZE message_ids each,
+                                appended as [seq, entry] every time an entry changes
+    workspace_stats.jsonl       the workspace stats points, appended as [seq, series, point]
+    channels/0.json  ...        one file per channel and dm, without their messages
+    dms/0.json  ...
+    channel_messages/0.jsonl  ...   one segment per channel and dm message history, with each
+    dm_messages/0.jsonl  ...        change appended as [seq, op, path from the history, value]
+
+Histories are not read by read_files. histories.py pages each one in on first access.
+
+The operations recorded by journal.py tell which records were modified since the last flush.
+e.g. a user_setname_v1 call rewrites that user's file, and a message_send_v1 call appends a
+line each to the channel's history, the message entry segment, the sender's stats and the
+workspace stats.
+
+Every flush has a seq, saved in meta.json, which is replaced last. Lines are appended with the
+seq of their flush. A flush that did not finish can only have appended lines at the end of each
+file, so when the store is read, the lines after the seq in meta.json are cut off each .jsonl
+file before anything else is appended. A flush that fails while the server is running cuts its
+own lines off, and only if that fails too is its seq kept in the lost list in meta.json, so its
+lines are still ignored after later flushes. A .jsonl file is rewritten whole when its section is replaced, e.g. by clear_v1, or when
+most of its lines have been superseded by later ones.
+'''
+
+import json
+import os
+from src.store_path import apply_path
+
+SECTIONS = ['users', 'tokens', 'sessions', 'messages', 'workspace']
+RECORDS = ['channels', 'dms']
+HISTORIES = {'channels': 'channel_messages', 'dms': 'dm_messages'}
+SEGMENT_SIZE = 1000
+
+global SEQ, LOST, LINES
+SEQ = 0
+# seqs of flushes that did not finish
+LOST = set()
+# file name -> number of lines in the .jsonl file
+LINES = {}
+
+def dirty_files(ops):
+    """Works out which files hold the values changed by a batch of operations.
+
+    Args:
+        list: ops recorded by journal.record
+
+    Returns:
+        dictionary of
+            'files': set of files to rewrite. A section name on its own means every file of
+                that section.
+            'lines': list of (file, line) to append, in the order they were recorded.
+            'messages': set of message_ids whose store['messages'] entry changed.
+    """
+    dirty = {'files': set(), 'lines': [], 'messages': set()}
+    files = dirty['files']
+    for op in ops:
+        path = op['path']
+        section = path[0]
+        if len(path) == 1 and op['op'] == 'set':
+            files.add(section)
+        elif section == 'users':
+            if len(path) == 1:
+                idx = op['value']['id'] - 1
+                files.update([('users', idx), ('user_stats', idx)])
+            elif len(path) == 4 and path[2] == 'stats' and op['op'] == 'append':
+                dirty['lines'].append((('user_stats', path[1]), [path[3], op['value']]))
+            elif len(path) > 2 and path[2] == 'stats':
+                files.update([('users', path[1]), ('user_stats', path[1])])
+            else:
+                files.add(('users', path[1]))
+        elif section == 'tokens':
+            dirty['lines'].append(('tokens', [op['op'], op['value']]))
+        elif section == 'sessions':
+            dirty['lines'].append(('sessions', [op['op'], path[1], op['value']]))
+        elif section == 'messages':
+            dirty['messages'].add(op['value']['message_id'] if len(path) == 1 else path[1])
+        elif section == 'workspace':
+            if len(path) == 2 and op['op'] == 'append':
+                dirty['lines'].append(('workspace', [path[1], op['value']]))
+            elif path[1:] != ['num_users']:
+                # num_users is saved in meta.json, which every flush rewrites.
+                files.add('workspace')
+        elif len(path) > 2 and path[2] == 'message':
+            if (len(path) == 3 and op['op'] == 'append') or (len(path) > 3 and isinstance(path[3], dict)):
+                dirty['lines'].append(((HISTORIES[section], path[1]), [op['op'], path[3:], op['value']]))
+            else:
+                files.add((HISTORIES[section], path[1]))
+        elif len(path) > 1:
+            files.add((section, path[1]))
+        else:
+            key = 'channel_id' if section == 'channels' else 'dm_id'
+            files.add((section, op['value'][key]))
+            files.add((HISTORIES[section], op['value'][key]))
+    return dirty
+
+def file_of(directory, key):
+    if isinstance(key, tuple):
+        extension = 'json' if key[0] in ['users'] + RECORDS else 'jsonl'
+        return os.path.join(directory, key[0], f'{key[1]}.{extension}')
+    if key == 'workspace':
+        return os.path.join(directory, 'workspace_stats.jsonl')
+    extension = 'jsonl' if key in ['tokens', 'sessions'] else 'json'
+    return os.path.join(directory, f'{key}.{extension}')
+
+def user_file(user):
+    return {field: value for field, value in user.items() if field != 'stats'}
+
+def stats_lines(stats):
+    return [[series, point] for series, points in stats.items() for point in points]
+
+def contents_of(store, key):
+    """Finds the value saved in a file, or None if it is a history that is not loaded. A
+    record is saved without its history and a user without their stats. The contents of a
+    .jsonl file are a list of its lines.
+    """
+    if key == 'tokens':
+        return [['append', token] for token in store['tokens']]
+    if key == 'sessions':
+        return [['set', token, times] for token, times in store['sessions'].items()]
+    if key == 'workspace':
+        return stats_lines({series: points for series, points in store['workspace'].items() if series != 'num_users'})
+    if key[0] == 'users':
+        return user_file(store['users'][key[1]])
+    if key[0] == 'user_stats':
+        return stats_lines(store['users'][key[1]]['stats'])
+    if key[0] == 'messages':
+        return [[entry] for entry in store['messages'][key[1] * SEGMENT_SIZE:(key[1] + 1) * SEGMENT_SIZE]]
+    for section, history in HISTORIES.items():
+        if key[0] == history:
+            messages = store[section][key[1]].get('message')
+            return None if messages is None else [['append', [], message] for message in messages]
+    return {field: value for field, value in store[key[0]][key[1]].items() if field != 'message'}
+
+def files_of_section(store, section):
+    """Lists every file that makes up a section, for when the whole section is rewritten."""
+    if section == 'users':
+        return [(name, idx) for idx in range(len(store['users'])) for name in ['users', 'user_stats']]
+    if section == 'messages':
+        return [('messages', k) for k in range(-(-len(store['messages']) // SEGMENT_SIZE))]
+    if section in RECORDS:
+        return [(name, idx) for idx in range(len(store[section])) for name in [section, HISTORIES[section]]]
+    return [section]
+
+def section_of(key):
+    if not isinstance(key, tuple):
+        return key
+    return {'user_stats': 'users', 'channel_messages': 'channels', 'dm_messages': 'dms'}.get(key[0], key[0])
+
+def live_lines(store, key):
+    """Counts the lines a .jsonl file would have if it were rewritten, or None if its lines are
+    never superseded (or its history is not loaded).
+    """
+    if key in ['tokens', 'sessions']:
+        return len(store[key])
+    if not isinstance(key, tuple):
+        return None
+    if key[0] == 'messages':
+        return min(len(store['messages']) - key[1] * SEGMENT_SIZE, SEGMENT_SIZE)
+    for section, history in HISTORIES.items():
+        if key[0] == history and 'message' in store[section][key[1]]:
+            return len(store[section][key[1]]['message'])
+    return None
+
+def append_lines(file_name, lines):
+    with open(file_name, 'ab+') as File:
+        File.seek(0, os.SEEK_END)
+        if File.tell() > 0:
+            # A line left half written by a flush that did not finish is ended first.
+            File.seek(-1, os.SEEK_END)
+            if File.read(1) != b'\n':
+                File.write(b'\n')
+        File.write(''.join(json.dumps([SEQ] + line, default=list) + '\n' for line in lines).encode())
+        File.flush()
+        os.fsync(File.fileno())
+    LINES[file_name] = LINES.get(file_name, 0) + len(lines)
+
+def write_files(directory, store, dirty, meta):
+    """Writes the changes to the files that hold them. Rewritten files are written and synced
+    under a temporary name before any is moved into place, so a failed write leaves the
+    previous files intact. Appended lines only count once meta.json is replaced.
+
+    Args:
+        string: directory of the section store
+        dictionary: store, the current data store
+        dictionary: dirty files, as returned by dirty_files
+        dictionary: meta values to save alongside, e.g. the trackers
+    """
+    global SEQ
+    for section in ['users', 'user_stats', 'messages'] + RECORDS + list(HISTORIES.values()):
+        os.makedirs(os.path.join(directory, section), exist_ok=True)
+    SEQ += 1
+    # Until meta.json is replaced, this flush counts as lost.
+    LOST.add(SEQ)
+
+    keys = set()
+    for key in dirty['files']:
+        if key in SECTIONS or key in RECORDS:
+            keys.update(files_of_section(store, key))
+        else:
+            keys.add(key)
+
+    appends = {}
+    for key, line in dirty['lines']:
+        if key not in keys and section_of(key) not in dirty['files']:
+            appends.setdefault(key, []).append(line)
+    if 'messages' not in dirty['files']:
+        for message_id in sorted(dirty['messages']):
+            key = ('messages', message_id // SEGMENT_SIZE)
+            if key not in keys:
+                appends.setdefault(key, []).append([store['messages'][message_id]])
+    for key in list(appends):
+        live = live_lines(store, key)
+        if live is not None and LINES.get(file_of(directory, key), 0) + len(appends[key]) > 2 * live + 64:
+            # Most of the lines are superseded, so the file is rewritten instead.
+            keys.add(key)
+            del appends[key]
+    if set(SECTIONS + RECORDS) <= dirty['files']:
+        # Every file is rewritten, so no lines of the lost flushes are left.
+        LOST.intersection_update({SEQ})
+
+    contents = {'meta': dict(meta, seq=SEQ, lost=sorted(LOST - {SEQ}), num_users=store['workspace']['num_users'])}
+    for key in keys:
+        contents[key] = contents_of(store, key)
+
+    written = []
+    for key, value in contents.items():
+        if value is None:
+            continue
+        file_name = file_of(directory, key)
+        with open(file_name + '.tmp', 'w', encoding='utf-8') as File:
+            if file_name.endswith('.jsonl'):
+                # A rewritten file is already part of the last complete flush.
+                for line in value:
+                    File.write(json.dumps([0] + line, default=list) + '\n')
+                LINES[file_name] = len(value)
+            else:
+                json.dump(value, File, default=list)
+            File.flush()
+            os.fsync(File.fileno())
+        written.append(file_name)
+    try:
+        for key, lines in appends.items():
+            append_lines(file_of(directory, key), lines)
+        # meta.json is moved last, as it marks the store as complete.
+        for file_name in sorted(written, key=lambda name: name.endswith('meta.json')):
+            os.replace(file_name + '.tmp', file_name)
+    except OSError:
+        # Once the lines of this flush are cut off again, its seq need not be kept as lost.
+        for key in appends:
+            drop_unfinished(file_of(directory, key), SEQ - 1)
+        LOST.discard(SEQ)
+        raise
+    LOST.discard(SEQ)
+
+    for section in ['users', 'messages'] + RECORDS:
+        if section in dirty['files']:
+            remove_leftovers(directory, store, section)
+
+def remove_leftovers(directory, store, section):
+    """Removes the files of records that are no longer in a section that was rewritten."""
+    kept = set(files_of_section(store, section))
+    for name in {'users': ['users', 'user_stats'], 'messages': ['messages']}.get(section, [section, HISTORIES.get(section)]):
+        for idx in record_indices(directory, name):
+            if (name, idx) not in kept:
+                os.remove(file_of(directory, (name, idx)))
+
+def record_indices(directory, section):
+    entries = os.listdir(os.path.join(directory, section))
+    return sorted(int(entry.split('.')[0]) for entry in entries if entry.endswith(('.json', '.jsonl')))
+
+def write_all(directory, data):
+    """Writes every file of the section store from a full copy of the data store.
+
+    Args:
+        string: directory of the section store
+        dictionary: data containing 'data_store' and the trackers
+    """
+    meta = {key: value for key, value in data.items() if key != 'data_store'}
+    write_files(directory, data['data_store'], {'files': set(SECTIONS + RECORDS), 'lines': [], 'messages': set()}, meta)
+
+def flush_of(line):
+    try:
+        return json.loads(line)[0]
+    except ValueError:
+        return float('inf')
+
+def drop_unfinished(file_name, seq):
+    """Cuts off the lines at the end of a .jsonl file that were appended after flush seq,
+    along with a line that was only partly written. Only the end of the file is read, a block
+    at a time, until a whole line from flush seq or earlier is found.
+    """
+    if not os.path.exists(file_name):
+        return
+    with open(file_name, 'rb+') as File:
+        size = end = pos = File.seek(0, os.SEEK_END)
+        tail = b''
+        cut = 0
+        while end > 0:
+            start = tail.rfind(b'\n', 0, len(tail) - 1) + 1
+            if start == 0 and pos > 0:
+                # The last line starts before the part read so far.
+                step = min(4096, pos)
+                pos -= step
+                File.seek(pos)
+                tail = File.read(step) + tail
+                continue
+            line = tail[start:]
+            if line.endswith(b'\n') and flush_of(line) <= seq:
+                break
+            tail = tail[:start]
+            end -= len(line)
+            cut += 1
+        if end < size:
+            File.truncate(end)
+            File.flush()
+            os.fsync(File.fileno())
+            if file_name in LINES:
+                LINES[file_name] -= cut
+
+def jsonl_files(directory):
+    """Lists every .jsonl file of the section store."""
+    files = [file_of(directory, key) for key in ['tokens', 'sessions', 'workspace']]
+    for name in ['user_stats', 'messages'] + list(HISTORIES.values()):
+        if os.path.isdir(os.path.join(directory, name)):
+            files += [file_of(directory, (name, idx)) for idx in record_indices(directory, name)]
+    return files
+
+def read_lines(file_name):
+    """Reads the lines of a .jsonl file written by the flushes that finished. Lines that were
+    only partly written, or were written by a flush that did not finish, are skipped.
+
+    Returns:
+        list of lines, without their seq.
+    """
+    lines = []
+    if not os.path.exists(file_name):
+        return lines
+    count = 0
+    with open(file_name, 'r', encoding='utf-8') as File:
+        for text in File:
+            count += 1
+            try:
+                line = json.loads(text)
+            except ValueError:
+                continue
+            if text.endswith('\n') and line[0] <= SEQ and line[0] not in LOST:
+                lines.append(line[1:])
+    LINES[file_name] = count
+    return lines
+
+def read_stats(file_name, series):
+    stats = {name: [] for name in series}
+    for name, point in read_lines(file_name):
+        stats.setdefault(name, []).append(point)
+    return stats
+
+def read_files(directory):
+    """Reassembles the data store from the section store.
+
+    Args:
+        string: directory of the section store
+
+    Returns:
+        dictionary containing 'data_store' and the trackers, or None if nothing has been
+        saved to the directory yet.
+    """
+    global SEQ, LOST
+    if not os.path.exists(file_of(directory, 'meta')):
+        return None
+    with open(file_of(directory, 'meta'), 'r', encoding='utf-8') as File:
+        meta = json.load(File)
+    SEQ = meta['seq']
+    LOST = set(meta['lost'])
+    LINES.clear()
+    # If the last flush did not finish, it may have appended lines already.
+    for file_name in jsonl_files(directory):
+        drop_unfinished(file_name, SEQ)
+    data = {key: value for key, value in meta.items() if key not in ['seq', 'lost', 'num_users']}
+
+    store = {}
+    store['users'] = []
+    for idx in record_indices(directory, 'users'):
+        with open(file_of(directory, ('users', idx)), 'r', encoding='utf-8') as File:
+            user = json.load(File)
+        user['stats'] = read_stats(file_of(directory, ('user_stats', idx)), ['channels', 'dms', 'messages'])
+        store['users'].append(user)
+
+    for section in RECORDS:
+        store[section] = []
+        for idx in record_indices(directory, section):
+            with open(file_of(directory, (section, idx)), 'r', encoding='utf-8') as File:
+                store[section].append(json.load(File))
+
+    tokens = {}
+    for op, token in read_lines(file_of(directory, 'tokens')):
+        if op == 'append':
+            tokens[token] = True
+        else:
+            tokens.pop(token, None)
+    store['tokens'] = list(tokens)
+
+    store['sessions'] = {}
+    for op, token, times in read_lines(file_of(directory, 'sessions')):
+        if op == 'set':
+            store['sessions'][token] = times
+        else:
+            store['sessions'].pop(token, None)
+
+    entries = {}
+    for k in record_indices(directory, 'messages'):
+        for entry, in read_lines(file_of(directory, ('messages', k))):
+            entries[entry['message_id']] = entry
+    store['messages'] = [entries[message_id] for message_id in sorted(entries)]
+
+    store['workspace'] = read_stats(file_of(directory, 'workspace'), ['channels', 'dms', 'messages'])
+    store['workspace']['num_users'] = meta['num_users']
+
+    data['data_store'] = {section: store[section] for section in ['users', 'channels', 'tokens', 'sessions', 'messages', 'dms', 'workspace']}
+    return data
+
+def read_history(directory, section, idx):
+    """Reads the message history of a channel or dm from its segment file.
+
+    Args:
+        string: directory of the section store
+        string: section, 'channels' or 'dms'
+        number: idx of the channel or dm
+
+    Returns:
+        list of messages.
+    """
+    messages = {}
+    for op, path, value in read_lines(file_of(directory, (HISTORIES[section], idx))):
+        if not path:
+            messages[value['message_id']] = value
+        elif len(path) == 1 and op == 'delete':
+            del messages[path[0]['message_id']]
+        else:
+            apply_path(messages[path[0]['message_id']], op, path[1:], value)
+    return list(messages.values())
@@ -7,9 +7,11 @@ This file contains all the http wraps of the iteration 2 functions for Seams.
 import sys
 import signal
 from json import dumps
-from flask import Flask, request, send_from_directory
+from flask import Flask, request, send_from_directory, g
 from flask_cors import CORS
 from src import config
+from src.data_store import data_store
+from src.tokens import open_auth_context, close_auth_context
 from src.other import clear_v1
 from src.auth import *
 from src.channels import *
@@ -20,10 +22,14 @@ from src.persistence import *
 from src.dms import *
 from src.standup import *
 from src.incomplete import *
+from src.sessions import start_sweeper
+from src.stats_sweeper import start_stats_sweeper
+from src.search_helpers import PAGE_SIZE
 
 
 def quit_gracefully(*args):
-    '''For coverage'''
+    '''Writes any changes still waiting to be saved, then exits.'''
+    flush_data()
     exit(0)
 
 def defaultHandler(err):
@@ -43,6 +49,33 @@ CORS(APP)
 APP.config['TRAP_HTTP_EXCEPTIONS'] = True
 APP.register_error_handler(Exception, defaultHandler)
 
+def request_token():
+    ''' The token a request was sent with, from its query string or json body. '''
+    if request.method == 'GET':
+        return request.args.get('token')
+    data = request.get_json(silent=True)
+    return data.get('token') if isinstance(data, dict) else None
+
+# Routes that wait on another host. Their functions lock the data store only while they use
+# it, so a slow host does not hold up every other request.
+UNLOCKED_ROUTES = {'user_profile_uploadphoto_iter3', 'passwordreset_request'}
+
+@APP.before_request
+def lock_data_store():
+    ''' Requests change the data store one at a time. The request's token is resolved
+    once here, so the functions it calls do not decode it again. '''
+    if request.endpoint in UNLOCKED_ROUTES:
+        return
+    data_store.lock.acquire()
+    g.locked = True
+    open_auth_context(request_token())
+
+@APP.teardown_request
+def unlock_data_store(err):
+    if g.pop('locked', False):
+        close_auth_context()
+        data_store.lock.release()
+
 #### NO NEED TO MODIFY ABOVE THIS POINT, EXCEPT IMPORTS
 
 @APP.route('/clear/v1', methods=['DELETE'])
@@ -517,6 +550,12 @@ def send_js(path):
     ''' Function for serving the profile images. '''
     return send_from_directory('', path)
 
+def stats_range():
+    ''' The resolution and time range asked for in a stats request's query string. '''
+    since = request.args.get("since", type=int)
+    until = request.args.get("until", type=int)
+    return request.args.get("resolution"), since, until
+
 @APP.route("/user/stats/v1", methods = ["GET"])
 def user_stats_iter3():
     ''' Wrap around user_stats_v1 to support HTTP.
@@ -524,6 +563,8 @@ def user_stats_iter3():
 
     Args:
         string: token
+        string: resolution (optional)
+        integer: since, until (optional)
 
     Returns:
         {
@@ -536,7 +577,7 @@ def user_stats_iter3():
         }
     '''
     token = request.args.get("token")
-    return dumps(user_stats_v1(token))
+    return dumps(user_stats_v1(token, *stats_range()))
 
 @APP.route("/users/stats/v1", methods = ["GET"])
 def users_stats_iter3():
@@ -545,6 +586,8 @@ def users_stats_iter3():
 
     Args:
         string: token
+        string: resolution (optional)
+        integer: since, until (optional)
 
     Returns:
         {
@@ -557,7 +600,7 @@ def users_stats_iter3():
         }
     '''
     token = request.args.get("token")
-    return dumps(users_stats_v1(token))
+    return dumps(users_stats_v1(token, *stats_range()))
 
 @APP.route("/standup/start/v1", methods=["POST"])
 def standup_start():
@@ -661,13 +704,18 @@ def search_iter3():
     Args:
         string: token
         string: query_str
+        integer: start, limit (optional)
+        string: order, 'newest' or 'reacts' (optional)
 
     Returns:
-        {messages: [{message_id, u_id, message, time_sent, reacts, is_pinned}]}
+        {messages: [{message_id, u_id, message, time_sent, reacts, is_pinned}], start, end}
     '''
     token = request.args.get("token")
     query_str = request.args.get("query_str")
-    return dumps(search_v1(token, query_str))
+    start = request.args.get("start", 0, type=int)
+    limit = request.args.get("limit", PAGE_SIZE, type=int)
+    order = request.args.get("order", "newest")
+    return dumps(search_v1(token, query_str, start, limit, order))
 
 @APP.route("/message/share/v1", methods = ["POST"])
 def message_share():
@@ -692,4 +740,10 @@ def message_share():
 if __name__ == "__main__":
     signal.signal(signal.SIGINT, quit_gracefully) # For coverage
     load_data()
+    rearm_scheduled()
+    rearm_standups()
+    start_compactor()
+    start_writer()
+    start_sweeper()
+    start_stats_sweeper()
     APP.run(port=config.port) # Do not edit this port
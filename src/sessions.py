@@ -0,0 +1,37 @@
+'''
+sessions.py
+
+This contains the session sweeper. Expired sessions already fail the token check (see
+tokens.py), and the sweeper removes their tokens from the data store in the background,
+so store['tokens'] does not keep growing with sessions nobody logged out of.
+
+'''
+import time
+from threading import Thread
+from src import config
+from src.data_store import data_store
+from src.tokens import expired_tokens, remove_tokens
+from src.persistence import save_data
+
+def sweep_sessions():
+    ''' Removes the tokens of every expired session.
+
+    Returns:
+        number: how many sessions were removed
+    '''
+    with data_store.lock:
+        tokens = expired_tokens(time.time())
+        if tokens:
+            remove_tokens(tokens)
+            save_data()
+    return len(tokens)
+
+def run_sweeper():
+    ''' Sweeps the sessions every session_sweep_interval seconds. '''
+    while True:
+        time.sleep(config.session_sweep_interval)
+        sweep_sessions()
+
+def start_sweeper():
+    ''' Starts the sweeper in a background thread. '''
+    Thread(target=run_sweeper, daemon=True).start()
@@ -0,0 +1,155 @@
+'''
+snapshot_format.py
+
+This contains the binary snapshot format, used when config.snapshot_format is 'binary'.
+Decoding json builds every dict and string one token at a time, which dominates start up
+for a large store. The binary format stores each section of the store with marshal, which
+is decoded in C with far less overhead per object.
+
+    header          MAGIC, format version, marshal version, section count, table checksum
+    section table   for each section: name, offset, length and checksum
+    sections        the marshalled value of each section
+
+Each section is one top level key of the data store ('users', 'channels', ...), plus 'meta'
+holding the trackers. Since the table records where every section starts, read_sections can
+load a subset of sections without decoding the rest of the file.
+
+Run as a script to convert an existing json snapshot:
+    python3 -m src.snapshot_format persisted_data.json persisted_data.snap
+'''
+
+import json
+import marshal
+import struct
+import sys
+import zlib
+
+MAGIC = b'SEAMSNAP'
+VERSION = 1
+HEADER = struct.Struct('<8sHHHI')
+ENTRY = struct.Struct('<QQI')
+
+def is_binary(file_name):
+    """Checks whether a snapshot file is in the binary format.
+
+    Args:
+        string: file_name of the snapshot
+
+    Returns:
+        boolean
+    """
+    with open(file_name, 'rb') as File:
+        return File.read(len(MAGIC)) == MAGIC
+
+def dump_snapshot(data, File):
+    """Writes a snapshot in the binary format.
+
+    Args:
+        dictionary: data containing 'data_store' and the trackers
+        file: File opened for binary writing
+    """
+    sections = dict(data['data_store'])
+    sections['meta'] = {key: value for key, value in data.items() if key != 'data_store'}
+    blobs = [(name.encode(), marshal.dumps(value)) for name, value in sections.items()]
+
+    table = b''
+    offset = HEADER.size + sum(1 + len(name) + ENTRY.size for name, _ in blobs)
+    for name, blob in blobs:
+        table += bytes([len(name)]) + name + ENTRY.pack(offset, len(blob), zlib.crc32(blob))
+        offset += len(blob)
+
+    File.write(HEADER.pack(MAGIC, VERSION, marshal.version, len(blobs), zlib.crc32(table)))
+    File.write(table)
+    for _, blob in blobs:
+        File.write(blob)
+
+def read_table(File):
+    """Reads and checks the header and section table.
+
+    Raises:
+        ValueError: not a binary snapshot, written by an incompatible version, or corrupt
+
+    Returns:
+        dictionary mapping each section name to its (offset, length, checksum).
+    """
+    header = File.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise ValueError('snapshot is truncated')
+    magic, version, marshal_version, count, checksum = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError('not a binary snapshot')
+    if version != VERSION or marshal_version != marshal.version:
+        raise ValueError('snapshot was written by an incompatible version')
+
+    table = b''
+    entries = {}
+    for _ in range(count):
+        size = File.read(1)
+        if not size:
+            raise ValueError('snapshot is truncated')
+        name = File.read(size[0])
+        entry = File.read(ENTRY.size)
+        if len(entry) < ENTRY.size:
+            raise ValueError('snapshot is truncated')
+        table += size + name + entry
+        entries[name.decode()] = ENTRY.unpack(entry)
+    if zlib.crc32(table) != checksum:
+        raise ValueError('snapshot section table is corrupt')
+    return entries
+
+def read_sections(file_name, names=None):
+    """Reads sections of a binary snapshot, checking each against its checksum.
+
+    Args:
+        string: file_name of the snapshot
+        list: names of the sections to read, or None for every section
+
+    Raises:
+        ValueError: the snapshot or one of the requested sections is corrupt
+
+    Returns:
+        dictionary mapping each section name to its value.
+    """
+    sections = {}
+    with open(file_name, 'rb') as File:
+        entries = read_table(File)
+        for name, (offset, length, checksum) in entries.items():
+            if names is not None and name not in names:
+                continue
+            File.seek(offset)
+            blob = File.read(length)
+            if len(blob) < length or zlib.crc32(blob) != checksum:
+                raise ValueError(f'snapshot section {name} is corrupt')
+            sections[name] = marshal.loads(blob)
+    return sections
+
+def load_snapshot(file_name):
+    """Reads a whole binary snapshot.
+
+    Args:
+        string: file_name of the snapshot
+
+    Returns:
+        dictionary in the same shape as a json snapshot.
+    """
+    sections = read_sections(file_name)
+    data = sections.pop('meta')
+    data['data_store'] = sections
+    return data
+
+def convert_json(json_file, binary_file):
+    """Converts a json snapshot to the binary format.
+
+    Args:
+        string: json_file to read
+        string: binary_file to write
+    """
+    with open(json_file, 'r', encoding='utf-8') as File:
+        data = json.load(File)
+    with open(binary_file, 'wb') as File:
+        dump_snapshot(data, File)
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit('usage: python3 -m src.snapshot_format <json file> <binary file>')
+    convert_json(sys.argv[1], sys.argv[2])
@@ -3,15 +3,20 @@ standup.py
 
 This contains functions for standup. These include standup_start, standup_active 
 and standup_send
+
+Standups finish on the shared scheduler (see scheduler.py). The user who started a standup is
+saved with it, and the summary is sent as them once it finishes, so it is still sent if they
+have logged out in the meantime.
 '''
 from datetime import datetime, timedelta
-from threading import Timer
 from src.data_store import data_store
 from src.error import InputError, AccessError
 from src.other import *
 from src.tokens import *
-from src.message import message_send_v1
+from src.message import send_channel_message
 from src.persistence import save_data
+from src.journal import record
+from src.scheduler import schedule
 
 def standup_start_v1(token, channel_id, length):
     '''
@@ -44,8 +49,7 @@ def standup_start_v1(token, channel_id, length):
     if check_valid_channel_id(channel_id) != True:
         raise InputError(description="Channel ID does not exist")
 
-    payload = decode_token(token)
-    auth_user_id = payload['auth_user_id']
+    auth_user_id = token_user_id(token)
     if check_channel_memebers(channel_id, auth_user_id) != True:
         raise AccessError(description="You are not in the channel")
 
@@ -57,14 +61,17 @@ def standup_start_v1(token, channel_id, length):
         raise InputError(description="An active standup is running")
 
     standup['is_active'] = True
-    # standup['user'] = auth_user_id
+    standup['user'] = auth_user_id
     finish_time = (datetime.now() + timedelta(seconds=length)).timestamp()
     standup['time_finish'] = finish_time
+    record('set', ['channels', channel_id, 'standup', 'is_active'], True)
+    record('set', ['channels', channel_id, 'standup', 'user'], auth_user_id)
+    record('set', ['channels', channel_id, 'standup', 'time_finish'], finish_time)
     
     data_store.set(store)
     save_data()
 
-    Timer(length, standup_msg_queue, [token, channel_id]).start()
+    schedule(length, standup_msg_queue, [channel_id])
 
     return {'time_finish': finish_time}
 
@@ -96,8 +103,7 @@ def standup_active_v1(token, channel_id):
     if check_valid_channel_id(channel_id) != True:
         raise InputError(description="Channel ID does not exist")
 
-    payload = decode_token(token)
-    auth_user_id = payload['auth_user_id']
+    auth_user_id = token_user_id(token)
     if check_channel_memebers(channel_id, auth_user_id) != True:
         raise AccessError(description="You are not in the channel")
 
@@ -143,8 +149,7 @@ def standup_send_v1(token, channel_id, message):
     if check_valid_channel_id(channel_id) != True:
         raise InputError(description="Channel ID does not exist")
 
-    payload = decode_token(token)
-    auth_user_id = payload['auth_user_id']
+    auth_user_id = token_user_id(token)
     if check_channel_memebers(channel_id, auth_user_id) != True:
         raise AccessError(description="You are not in the channel")
 
@@ -155,43 +160,65 @@ def standup_send_v1(token, channel_id, message):
     if standup['is_active'] == False or standup == None:
         raise InputError(description="Standup is not active")
 
-    handle = store["users"][auth_user_id - 1]["handle"]
+    handle = token_user(token)["handle"]
     messages = {
         'handle': handle,
         'message': message,
     }
     queue = standup['msgqueue']
     queue.append(messages)
+    record('append', ['channels', channel_id, 'standup', 'msgqueue'], messages)
 
     data_store.set(store)
     save_data()
 
     return {}
 
-def standup_msg_queue(token, channel_id):
+def standup_msg_queue(channel_id):
     '''
     Supplement function for standup_start_v1
 
-    Given token and channel ID, send out messages that are send from standup_send_v1
-    after standup is finished
+    Given channel ID, send out messages that are send from standup_send_v1
+    after standup is finished, as the user who started the standup
 
     Exceptions:
-        *Assume token and channel_id is checked in standup_start_v1
+        *Assume channel_id is checked in standup_start_v1
 
     Args:
-        string: token
         int: channel_id
 
     Return:
-        None (See message_send_v1)
+        None
     '''
-    store = data_store.get()
-
-    standup = store['channels'][channel_id]['standup']
-    standup['is_active'] = False
-    standups = ""
-    for messages in standup["msgqueue"]:
-        standups += messages['handle'] + ": " + messages['message'] + "\n"
-    standups.rstrip()
-
-    message_send_v1(token, channel_id, standups)
\ No newline at end of file
+    with data_store.lock:
+        store = data_store.get()
+
+        standup = store['channels'][channel_id]['standup']
+        if not standup['is_active']:
+            return
+        standup['is_active'] = False
+        record('set', ['channels', channel_id, 'standup', 'is_active'], False)
+
+        # Each line is added to the summary once, rather than copying it on every +=.
+        standups = ''.join(f"{messages['handle']}: {messages['message']}\n" for messages in standup['msgqueue'])
+        standup['msgqueue'] = []
+        record('set', ['channels', channel_id, 'standup', 'msgqueue'], [])
+
+        # A summary longer than a message can be is dropped, as message_send_v1 would refuse it.
+        if standups and len(standups) <= 1000 and standup.get('user') is not None:
+            send_channel_message(standup["user"], channel_id, standups)
+        data_store.set(store)
+        save_data()
+
+def rearm_standups():
+    '''
+    Schedules the end of the standups that were running when the data store was saved.
+    Standups that should have finished while the server was down finish straight away.
+    '''
+    with data_store.lock:
+        store = data_store.get()
+        now = datetime.now().timestamp()
+        for channel in store['channels']:
+            standup = channel['standup']
+            if standup['is_active']:
+                schedule(max(standup['time_finish'] - now, 0), standup_msg_queue, [channel['channel_id']])
@@ -0,0 +1,207 @@
+"""
+    This module contains the rollups behind the resolution and time range of user_stats_v1 and
+    users_stats_v1, and the folding that keeps the stats series in the data store short.
+
+    Every change to a count appends a point to a series, so a series would otherwise be as long
+    as the history behind it. The stats sweeper (see stats_sweeper.py) folds each series with
+    fold_series once it has doubled in length since it was last folded: the last
+    config.stats_raw_points points under an hour old are kept as they are, and older points are
+    folded into per minute buckets while under an hour old, per hour buckets while under a day
+    old and per day buckets after that. FOLDED holds the length of each series after it was last
+    folded. Without a resolution, a response is folded the same way, so it stays small between
+    sweeps; 'raw' gives the points in the data store as they are.
+
+    For each series, ROLLUPS keeps the points at a per minute, per hour and per day resolution.
+    Each bucket holds the last point in it, which is the value the series had at the end of that
+    minute, hour or day. A rollup only looks at the points added since it was last used, so it is
+    kept up to date without changing the functions that add the points. Points are added in time
+    order, so a range is found by binary search.
+
+    UTILIZERS holds the u_ids of the users who are in at least one channel or dm, for the
+    utilization rate. A user is only added or taken out when their channels and dms joined go
+    from or to none, in the stat functions of other.py, or when they are removed, so
+    users_stats_v1 does not look at every user.
+"""
+
+import time
+from src import config
+from src.error import InputError
+
+global ROLLUPS, UTILIZERS, FOLDED
+ROLLUPS = {}
+UTILIZERS = set()
+FOLDED = {}
+
+# Width of a bucket in seconds, for each resolution.
+RESOLUTIONS = {
+    'minute': 60,
+    'hour': 60 * 60,
+    'day': 24 * 60 * 60,
+}
+
+def bucket_width(age):
+    """Width of the bucket a point of this age in seconds is folded into."""
+    if age < RESOLUTIONS['hour']:
+        return RESOLUTIONS['minute']
+    if age < RESOLUTIONS['day']:
+        return RESOLUTIONS['hour']
+    return RESOLUTIONS['day']
+
+def fold_series(points, now):
+    """Folds the older points of a series into buckets, keeping the last point in each. The
+    last point of the series is always kept.
+
+    Args:
+        points (list): the series, in time order
+        now (float): the time the ages of the points are measured from
+
+    Returns:
+        list of points
+    """
+    raw_from = len(points) - config.stats_raw_points
+    folded = []
+    last_bucket = None
+    for idx, point in enumerate(points):
+        age = now - point['time_stamp']
+        bucket = None
+        if idx < raw_from or age >= RESOLUTIONS['hour']:
+            width = bucket_width(age)
+            bucket = (width, point['time_stamp'] // width)
+        if bucket is not None and bucket == last_bucket:
+            folded[-1] = point
+        else:
+            folded.append(point)
+        last_bucket = bucket
+    return folded
+
+def fold_due(key, points, now):
+    """Folds a series if it has doubled in length since it was last folded.
+
+    Args:
+        key (tuple): identifies the series, see rollup
+        points (list): the series in the data store
+        now (float): the time the ages of the points are measured from
+
+    Returns:
+        the folded list of points, or None if the series is not due or nothing was folded
+    """
+    if len(points) <= 2 * FOLDED.get(key, config.stats_raw_points):
+        return None
+    folded = fold_series(points, now)
+    FOLDED[key] = len(folded)
+    return folded if len(folded) < len(points) else None
+
+def rollup(key, points):
+    """Brings the rollup of a series up to date with its points.
+
+    Args:
+        key (tuple): identifies the series, e.g. ('workspace', 'messages') or (u_id, 'messages')
+        points (list): the series in the data store
+
+    Returns:
+        dictionary: the points of the series at each resolution
+    """
+    entry = ROLLUPS.get(key)
+    # A series that was replaced, e.g. by a clear or a load, is rolled up again from the start.
+    if entry is None or entry['points'] is not points or entry['seen'] > len(points):
+        entry = {'points': points, 'seen': 0, **{resolution: [] for resolution in RESOLUTIONS}}
+        ROLLUPS[key] = entry
+    for point in points[entry['seen']:]:
+        for resolution, width in RESOLUTIONS.items():
+            buckets = entry[resolution]
+            if buckets and buckets[-1]['time_stamp'] // width == point['time_stamp'] // width:
+                buckets[-1] = point
+            else:
+                buckets.append(point)
+    entry['seen'] = len(points)
+    return entry
+
+def first_after(points, time_stamp):
+    """Finds the index of the first point at or after time_stamp."""
+    low, high = 0, len(points)
+    while low < high:
+        middle = (low + high) // 2
+        if points[middle]['time_stamp'] < time_stamp:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+def query_series(key, points, resolution=None, since=None, until=None):
+    """Gets the points of a series at a resolution, between two times.
+
+    Exceptions:
+        InputError if the resolution is not 'raw', 'minute', 'hour' or 'day', or since is after until.
+
+    Args:
+        key (tuple): identifies the series, see rollup
+        points (list): the series in the data store
+        resolution (string): None for the folded series, 'raw' for the points as they are,
+            or one of RESOLUTIONS
+        since (int): earliest time_stamp to include, or None
+        until (int): latest time_stamp to include, or None
+
+    Returns:
+        list of points
+    """
+    if resolution not in (None, 'raw') and resolution not in RESOLUTIONS:
+        raise InputError(description="Invalid resolution")
+    if since is not None and until is not None and since > until:
+        raise InputError(description="Invalid time range")
+
+    if resolution in RESOLUTIONS:
+        points = rollup(key, points)[resolution]
+    elif resolution is None:
+        points = fold_series(points, time.time())
+    start = 0 if since is None else first_after(points, since)
+    end = len(points) if until is None else first_after(points, until + 1)
+    if start == 0 and end == len(points):
+        return points
+    return points[start:end]
+
+def num_joined(user):
+    """Counts the channels and dms a user is in, from the ends of their stats."""
+    stats = user['stats']
+    return stats['channels'][-1]['num_channels_joined'] + stats['dms'][-1]['num_dms_joined']
+
+def update_utilizer(u_id, joined_before, joined_after):
+    """Adds or takes out a user from UTILIZERS when their channels and dms joined cross zero.
+
+    Args:
+        u_id (int): the user
+        joined_before (int): channels and dms joined before the change
+        joined_after (int): channels and dms joined after the change
+    """
+    if joined_before == 0 and joined_after > 0:
+        UTILIZERS.add(u_id)
+    elif joined_before > 0 and joined_after == 0:
+        UTILIZERS.discard(u_id)
+
+def remove_utilizer(u_id):
+    """Takes out a user who has been removed from Seams."""
+    UTILIZERS.discard(u_id)
+
+def num_utilizers():
+    """Counts the users in at least one channel or dm, in constant time."""
+    return len(UTILIZERS)
+
+def reset_rollups():
+    """Resets the rollups, FOLDED and UTILIZERS, for when data store is reset.
+
+    Returns:
+        Empty dictionary.
+    """
+    ROLLUPS.clear()
+    FOLDED.clear()
+    UTILIZERS.clear()
+    return {}
+
+def load_stats(users):
+    """Rebuilds UTILIZERS from the users of a loaded data store. The rollups are started again
+    the first time they are used.
+
+    Args:
+        users (list): store["users"]
+    """
+    reset_rollups()
+    UTILIZERS.update(user['id'] for user in users if not user['removed'] and num_joined(user) > 0)
@@ -0,0 +1,53 @@
+'''
+stats_sweeper.py
+
+This contains the stats sweeper. Every change to a count appends a point to a stats series,
+and the sweeper folds the older points of each series into buckets in the background (see
+fold_series in stats_helpers.py), so the series in the data store do not keep growing with
+the history behind them.
+
+'''
+import time
+from threading import Thread
+from src import config
+from src.data_store import data_store
+from src.journal import record
+from src.stats_helpers import fold_due
+from src.persistence import save_data
+
+def sweep_stats():
+    ''' Folds every stats series that has doubled in length since it was last folded.
+
+    Returns:
+        number: how many series were folded
+    '''
+    folded = 0
+    with data_store.lock:
+        store = data_store.get()
+        now = time.time()
+        for user in store['users']:
+            for series, points in user['stats'].items():
+                points = fold_due((user['id'], series), points, now)
+                if points is not None:
+                    user['stats'][series] = points
+                    record('set', ['users', user['id'] - 1, 'stats', series], points)
+                    folded += 1
+        for series in ['channels', 'dms', 'messages']:
+            points = fold_due(('workspace', series), store['workspace'][series], now)
+            if points is not None:
+                store['workspace'][series] = points
+                record('set', ['workspace', series], points)
+                folded += 1
+        if folded:
+            save_data()
+    return folded
+
+def run_stats_sweeper():
+    ''' Sweeps the stats every stats_sweep_interval seconds. '''
+    while True:
+        time.sleep(config.stats_sweep_interval)
+        sweep_stats()
+
+def start_stats_sweeper():
+    ''' Starts the stats sweeper in a background thread. '''
+    Thread(target=run_stats_sweeper, daemon=True).start()
@@ -0,0 +1,59 @@
+'''
+store_path.py
+
+This contains the paths used by the operations recorded in journal.py. A path is a list of
+keys and indices from a value in the data store, and a dictionary inside a path selects the
+list element whose fields match it. journal.py replays operations on the store through
+apply_path, and section_store.py replays the lines of a history segment on its messages
+through it too, so both read the same paths the same way.
+'''
+
+def resolve(store, path):
+    """Follows a path from the root of the store and returns the value it refers to.
+
+    Args:
+        dictionary: store
+        list: path of keys, indices and selector dictionaries
+
+    Returns:
+        The value at the end of the path.
+    """
+    node = store
+    for key in path:
+        node = node[locate(node, key)]
+    return node
+
+def locate(node, key):
+    """Turns a path element into an index or key of node. Selector dictionaries are matched
+    against the elements of node, which must then be a list.
+
+    Raises:
+        KeyError: no element of node matches the selector
+    """
+    if not isinstance(key, dict):
+        return key
+    for idx, item in enumerate(node):
+        if all(item.get(field) == value for field, value in key.items()):
+            return idx
+    raise KeyError(key)
+
+def apply_path(node, op, path, value):
+    """Applies an operation to the value a path leads to from node.
+
+    Args:
+        node: the store, or the value inside it that the path starts from
+        string: op, one of 'set', 'append', 'remove' or 'delete'
+        list: path from node
+        value: the new value, appended value or removed value
+    """
+    if op == 'append':
+        resolve(node, path).append(value)
+    elif op == 'remove':
+        resolve(node, path).remove(value)
+    else:
+        parent = resolve(node, path[:-1])
+        key = locate(parent, path[-1])
+        if op == 'set':
+            parent[key] = value
+        else:
+            del parent[key]
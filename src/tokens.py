@@ -5,12 +5,45 @@ This is a helper file for making and decoding tokens. There is a generate sessio
 generate token, a decode token, reset sessions and current sessions function.
 These are used in auth login and register to create new tokens, and to clear the datastore.
 
+Every active token has a session in SESSIONS, keyed by its session_id, holding the user it
+belongs to, when it was issued and when it was last used. TOKEN_INDEX maps the token to its
+session, so checking a token does not scan store['tokens'], and USER_SESSIONS maps each user
+to their sessions, so logging a user out everywhere only looks at that user's sessions.
+store['tokens'] is a MemberList (see member_list.py), which keeps the order tokens were issued
+in and removes a token in constant time.
+Tokens are only added and removed through the functions below so these stay consistent.
+
+A session expires session_idle_timeout seconds after it was last used, or session_lifetime
+seconds after it was issued (see config.py). Expired tokens stop being active straight away,
+and are removed by the sweeper in sessions.py. The times are saved with the data store in
+store['sessions'], keyed by token, so a restart does not extend any session. So that read
+requests do not each write the store, last_seen is only saved once it has moved on by
+session_seen_interval seconds, and a restored session may end up to that much early.
+
+decode_token keeps the payloads of recently decoded tokens in TOKEN_CACHE, so a request that
+checks the same token several times only verifies it once. A token's payload is dropped from
+the cache when its session ends, and TOKEN_CACHE_STATS counts cache hits and misses.
+
+The server resolves the token of each HTTP request once, before dispatching it, into
+AUTH_CONTEXT. token_user_id and token_user answer from it for that token, and only decode
+tokens the request did not send.
+
 '''
 import jwt
+import time
+from collections import OrderedDict
 from src.data_store import data_store
+from src.journal import record
+from src import config
 
-global SESSION_TRACKER
+global SESSION_TRACKER, SESSIONS, TOKEN_INDEX, USER_SESSIONS, TOKEN_CACHE, TOKEN_CACHE_STATS, AUTH_CONTEXT
 SESSION_TRACKER = 0
+SESSIONS = {}
+TOKEN_INDEX = {}
+USER_SESSIONS = {}
+TOKEN_CACHE = OrderedDict()
+TOKEN_CACHE_STATS = {'hits': 0, 'misses': 0}
+AUTH_CONTEXT = {}
 SECRET = 'H13BBADGER'
 
 def generate_new_session_id():
@@ -46,10 +79,127 @@ def generate_token(user_id):
     token = jwt.encode(payload, SECRET, algorithm='HS256')
 
     store['tokens'].append(token)
+    now = time.time()
+    save_session(add_session(token, session_id, user_id, now, now))
+    record('append', ['tokens'], token)
     data_store.set(store)
 
     return token
 
+def add_session(token, session_id, user_id, issued_at, last_seen):
+    """Adds the session of a token to the indexes.
+
+    Returns:
+        dictionary: the session
+    """
+    session = {'token': token, 'u_id': user_id, 'issued_at': issued_at, 'last_seen': last_seen, 'saved_seen': last_seen}
+    SESSIONS[session_id] = session
+    TOKEN_INDEX[token] = session_id
+    USER_SESSIONS.setdefault(user_id, {})[session_id] = session
+    return session
+
+def save_session(session):
+    """Saves the times of a session in store['sessions']."""
+    times = {'issued_at': session['issued_at'], 'last_seen': session['last_seen']}
+    data_store.get()['sessions'][session['token']] = times
+    session['saved_seen'] = session['last_seen']
+    record('set', ['sessions', session['token']], times)
+
+def forget_session(token):
+    """Takes the session of a token out of the indexes and the token cache."""
+    session_id = TOKEN_INDEX.pop(token)
+    session = SESSIONS.pop(session_id)
+    del USER_SESSIONS[session['u_id']][session_id]
+    sessions = data_store.get()['sessions']
+    if token in sessions:
+        del sessions[token]
+        record('delete', ['sessions', token])
+    TOKEN_CACHE.pop(token, None)
+    if AUTH_CONTEXT.get('token') == token:
+        AUTH_CONTEXT.clear()
+
+def remove_token(token):
+    """Removes an active token, ending its session.
+
+    Args:
+        string: token
+    """
+    store = data_store.get()
+    store['tokens'].remove(token)
+    forget_session(token)
+    record('remove', ['tokens'], token)
+    data_store.set(store)
+
+def remove_tokens(tokens):
+    """Removes several active tokens, ending their sessions.
+
+    Args:
+        list: tokens
+    """
+    if not tokens:
+        return
+    store = data_store.get()
+    for token in tokens:
+        store['tokens'].remove(token)
+        forget_session(token)
+        record('remove', ['tokens'], token)
+    data_store.set(store)
+
+def revoke_user_sessions(user_id):
+    """Ends every session of a user, logging them out everywhere.
+
+    Args:
+        number: user_id
+
+    Returns:
+        number: how many sessions were ended
+    """
+    tokens = user_tokens(user_id)
+    remove_tokens(tokens)
+    return len(tokens)
+
+def session_expired(session, now):
+    """Checks if a session has been idle, or open, for too long.
+
+    Returns:
+        boolean
+    """
+    return (now - session['last_seen'] >= config.session_idle_timeout
+        or now - session['issued_at'] >= config.session_lifetime)
+
+def expired_tokens(now):
+    """Finds the tokens of every expired session.
+
+    Returns:
+        list of tokens.
+    """
+    return [session['token'] for session in SESSIONS.values() if session_expired(session, now)]
+
+def is_active_token(token):
+    """Checks if the token belongs to a session that has not ended or expired, in constant time.
+
+    Args:
+        string: token
+
+    Returns:
+        boolean
+    """
+    # A request may send something other than a string, which is never a valid token.
+    if not isinstance(token, str) or token not in TOKEN_INDEX:
+        return False
+    return not session_expired(SESSIONS[TOKEN_INDEX[token]], time.time())
+
+def user_tokens(user_id):
+    """Finds every active token of a user.
+
+    Args:
+        number: user_id
+
+    Returns:
+        list of tokens, oldest first.
+    """
+    return [session['token'] for session in USER_SESSIONS.get(user_id, {}).values()]
+
 
 def decode_token(token):
     """Decodes a token string into an object of the data
@@ -60,8 +210,74 @@ def decode_token(token):
     Returns:
         Object: An object storing the body of the token encoded string
     """
+    payload = TOKEN_CACHE.get(token) if isinstance(token, str) else None
+    if payload is not None:
+        TOKEN_CACHE.move_to_end(token)
+        TOKEN_CACHE_STATS['hits'] += 1
+        return dict(payload)
+
+    TOKEN_CACHE_STATS['misses'] += 1
+    payload = jwt.decode(token, SECRET, algorithms=['HS256'])
+    TOKEN_CACHE[token] = payload
+    if len(TOKEN_CACHE) > config.token_cache_size:
+        TOKEN_CACHE.popitem(last=False)
+    return dict(payload)
+
+def token_cache_stats():
+    """Counts how often decode_token found the token in its cache.
+
+    Returns:
+        dictionary containing hits, misses and size (the number of cached tokens)
+    """
+    return {**TOKEN_CACHE_STATS, 'size': len(TOKEN_CACHE)}
+
+def open_auth_context(token):
+    """Resolves the token of a request to its user, once, before the request is dispatched.
+    Nothing is resolved if the token is not active, so the request fails its token check as usual.
+
+    Args:
+        string: token sent with the request, or None
+    """
+    AUTH_CONTEXT.clear()
+    if is_active_token(token):
+        session = SESSIONS[TOKEN_INDEX[token]]
+        session['last_seen'] = time.time()
+        if session['last_seen'] - session['saved_seen'] >= config.session_seen_interval:
+            save_session(session)
+        user_id = session['u_id']
+        AUTH_CONTEXT.update(token=token, auth_user_id=user_id, user=data_store.get()['users'][user_id - 1])
+
+def close_auth_context():
+    """Forgets the token of a request once it has been handled."""
+    AUTH_CONTEXT.clear()
+
+def token_user_id(token):
+    """Finds the auth_user_id of a token, from the request's auth context if it is the token
+    the request was sent with.
+
+    Args:
+        string: token
+
+    Returns:
+        number: auth_user_id
+    """
+    if AUTH_CONTEXT and AUTH_CONTEXT['token'] == token:
+        return AUTH_CONTEXT['auth_user_id']
+    return decode_token(token)['auth_user_id']
 
-    return jwt.decode(token, SECRET, algorithms=['HS256'])
+def token_user(token):
+    """Finds the user of a token in store['users'], from the request's auth context if it is
+    the token the request was sent with.
+
+    Args:
+        string: token
+
+    Returns:
+        dictionary: the user
+    """
+    if AUTH_CONTEXT and AUTH_CONTEXT['token'] == token:
+        return AUTH_CONTEXT['user']
+    return data_store.get()['users'][token_user_id(token) - 1]
 
 def reset_sessions():
     """Resets the global sessions, for when data store is reset.
@@ -71,9 +287,33 @@ def reset_sessions():
     """
     global SESSION_TRACKER
     SESSION_TRACKER = 0
+    SESSIONS.clear()
+    TOKEN_INDEX.clear()
+    USER_SESSIONS.clear()
+    TOKEN_CACHE.clear()
+    TOKEN_CACHE_STATS.update(hits=0, misses=0)
+    AUTH_CONTEXT.clear()
     return {}
 
 
 def load_session_tracker(session_tracker):
     global SESSION_TRACKER
     SESSION_TRACKER = session_tracker
+
+def load_tokens(tokens, sessions):
+    """Rebuilds the sessions from the tokens in a loaded data store and their saved times.
+
+    Args:
+        list: tokens
+        dictionary: sessions, the times of each token
+    """
+    SESSIONS.clear()
+    TOKEN_INDEX.clear()
+    USER_SESSIONS.clear()
+    TOKEN_CACHE.clear()
+    now = time.time()
+    for token in tokens:
+        payload = decode_token(token)
+        # Tokens saved before their times were count as issued now.
+        times = sessions.get(token, {'issued_at': now, 'last_seen': now})
+        add_session(token, payload['session_id'], payload['auth_user_id'], times['issued_at'], times['last_seen'])
@@ -7,11 +7,19 @@ This file also contains the two admin_user functions. These are the user remove
 userpermission change functions, that remove users or change their global permissions.
 
 '''
+from src import config
 from src.data_store import data_store
 from src.error import InputError, AccessError
 from src.other import *
-from src.tokens import decode_token
+from src.tokens import token_user_id, revoke_user_sessions
 from src.persistence import save_data
+from src.journal import record
+from src.message_helpers import user_message_ids, message_location, find_message
+from src.user_helpers import user_by_email, user_by_handle, set_email, set_handle, remove_user
+from src.channel_helpers import user_channels, remove_member
+from src.dm_helpers import user_dms, remove_dm_member
+from src.stats_helpers import query_series, num_utilizers, remove_utilizer
+from src.search_helpers import index_message
 import re
 import urllib.request
 from urllib.error import HTTPError, URLError
@@ -115,9 +123,11 @@ def user_setname_v1(token, name_first, name_last):
     
     # Change the user's names.
     store = data_store.get()
-    auth_id = decode_token(token)['auth_user_id']
+    auth_id = token_user_id(token)
     store['users'][auth_id - 1]['first_name'] = name_first
     store['users'][auth_id - 1]['last_name'] = name_last
+    record('set', ['users', auth_id - 1, 'first_name'], name_first)
+    record('set', ['users', auth_id - 1, 'last_name'], name_last)
     data_store.set(store)
     save_data()
     return {}
@@ -147,13 +157,14 @@ def user_setemail_v1(token, email):
 
     # Check for duplicate email.
     store = data_store.get()
-    auth_id = decode_token(token)['auth_user_id']
-    for user in store['users']:
-        if user['email'] == email and user['id'] != auth_id and user['removed'] == False:
-            raise InputError(description="Email already in use")
+    auth_id = token_user_id(token)
+    owner = user_by_email(email)
+    if owner is not None and owner['id'] != auth_id:
+        raise InputError(description="Email already in use")
             
     # Change the user's email.
-    store['users'][auth_id - 1]['email'] = email
+    set_email(store['users'][auth_id - 1], email)
+    record('set', ['users', auth_id - 1, 'email'], email)
     data_store.set(store)
     save_data()
     return {}
@@ -187,13 +198,14 @@ def user_sethandle_v1(token, handle_str):
  
     # Check for duplicate handles.
     store = data_store.get()
-    auth_id = decode_token(token)['auth_user_id']
-    for user in store['users']:
-        if user['handle'] == handle_str and user['id'] != auth_id and user['removed'] == False:
-            raise InputError(description="Handle is already in use")
+    auth_id = token_user_id(token)
+    owner = user_by_handle(handle_str)
+    if owner is not None and owner['id'] != auth_id:
+        raise InputError(description="Handle is already in use")
     
     # Change the user's handle.
-    store['users'][auth_id - 1]['handle'] = handle_str
+    set_handle(store['users'][auth_id - 1], handle_str)
+    record('set', ['users', auth_id - 1, 'handle'], handle_str)
     data_store.set(store)
     save_data()
     return {}
@@ -222,7 +234,7 @@ def admin_user_remove_v1(token, u_id):
         raise AccessError(description="Invalid token")
     
     # Check the auth user is a global owner.
-    if get_permission(decode_token(token)['auth_user_id']) == 2:
+    if get_permission(token_user_id(token)) == 2:
         raise AccessError(description="Auth user is not a global owner")
 
     # Check u_id is valid.
@@ -239,48 +251,40 @@ def admin_user_remove_v1(token, u_id):
         raise InputError(description="Cannot remove only global owner")
 
     # Remove u_id tokens.
-    for u_token in store['tokens']:
-        if decode_token(u_token)['auth_user_id'] != u_id:
-            continue
-        else:
-            store['tokens'].remove(u_token)
+    revoke_user_sessions(u_id)
         
     # Remove u_id from channels.
-    for channel in store['channels']:
-        if u_id in channel['owners']:
-            channel['owners'].remove(u_id)
-        if u_id in channel['members']:
-            channel['members'].remove(u_id)
+    for channel_id in user_channels(u_id):
+        remove_member(channel_id, u_id)
     
     # Replace all content of message sent by user by "Removed user"
-    for store_message in store['messages']:
-        if store_message["auth_user_id"] == u_id and store_message["channel_id"] != -1:
-            for channel_message in store["channels"][store_message["channel_id"]]["message"]:
-                if channel_message["message_id"] != store_message["message_id"]:
-                    continue 
-                else:
-                    channel_message["message"] = "Removed user"
-        if store_message["auth_user_id"] == u_id and store_message["dm_id"] != -1:
-            for dm_message in store["dms"][store_message["dm_id"]]["message"]:
-                if dm_message["message_id"] != store_message["message_id"]:
-                    continue
-                else:
-                    dm_message["message"] = "Removed user"
+    for message_id in user_message_ids(u_id):
+        message = find_message(store, message_id)
+        if message is None:
+            # Removed, or not sent yet.
+            continue
+        location = message_location(message_id)
+        section, idx = ("channels", location["channel_id"]) if location["channel_id"] != -1 else ("dms", location["dm_id"])
+        message["message"] = "Removed user"
+        index_message(message_id, "Removed user")
+        record('set', [section, idx, 'message', {'message_id': message_id}, 'message'], "Removed user")
 
 
     # Remove from dms.
-    for dm in store['dms']:
-        for member in dm['members']:
-            if u_id != member['u_id']:
-                continue
-            else:
-                dm['members'].remove(member)
+    for dm_id in user_dms(u_id):
+        remove_dm_member(dm_id, u_id)
     
     # Change the user's removed status.
     store['users'][u_id - 1]['first_name'] = 'Removed'
     store['users'][u_id - 1]['last_name'] = 'user'
     store['users'][u_id - 1]['removed'] = True
+    remove_user(store['users'][u_id - 1])
+    remove_utilizer(u_id)
     store['workspace']['num_users'] = store['workspace']['num_users'] - 1
+    record('set', ['users', u_id - 1, 'first_name'], 'Removed')
+    record('set', ['users', u_id - 1, 'last_name'], 'user')
+    record('set', ['users', u_id - 1, 'removed'], True)
+    record('set', ['workspace', 'num_users'], store['workspace']['num_users'])
     data_store.set(store)
     save_data()
     return {}
@@ -306,7 +310,7 @@ def admin_userpermission_change_v1(token, u_id, permission_id):
         raise AccessError(description="Invalid token")
 
     # Check the auth user is a global owner.
-    if get_permission(decode_token(token)['auth_user_id']) == 2:
+    if get_permission(token_user_id(token)) == 2:
         raise AccessError(description="Auth user is not a global owner")
 
     # Check u_id is valid.
@@ -331,6 +335,7 @@ def admin_userpermission_change_v1(token, u_id, permission_id):
         raise InputError(description="User already has that permission level")
 
     store['users'][u_id - 1]['global_permission'] = permission_id
+    record('set', ['users', u_id - 1, 'global_permission'], permission_id)
     data_store.set(store)
     save_data()
     return {}
@@ -355,17 +360,22 @@ def user_profile_uploadphoto_v1(token, img_url, x_start, y_start, x_end, y_end):
     Returns:
         empty dictionary
     '''
-    # Check if token is valid.
-    if not check_valid_token(token):
-        raise AccessError(description="Invalid token")
-    
+    # The data store is only locked while it is used, not while the image is downloaded.
+    with data_store.lock:
+        # Check if token is valid.
+        if not check_valid_token(token):
+            raise AccessError(description="Invalid token")
+        u_id = token_user_id(token)
+
     # Check HTTP status code and get image.
-    u_id = decode_token(token)['auth_user_id']
     file_path = 'static/' + str(u_id) + '.jpg'
     try:
-        urllib.request.urlretrieve(img_url, file_path)
-    except (HTTPError, URLError) as error_message:
+        with urllib.request.urlopen(img_url, timeout=config.network_timeout) as response:
+            image = response.read()
+    except (HTTPError, URLError, TimeoutError) as error_message:
         raise InputError(description="img_url incorrect HTTP status") from error_message
+    with open(file_path, 'wb') as File:
+        File.write(image)
     
     image_object = Image.open(file_path)
 
@@ -382,20 +392,28 @@ def user_profile_uploadphoto_v1(token, img_url, x_start, y_start, x_end, y_end):
     cropped = image_object.crop((x_start, y_start, x_end, y_end))
     cropped.save(file_path)
 
-    store = data_store.get()
-    store['users'][u_id - 1]['profile_img_url'] = file_path
-    data_store.set(store)
-    save_data()
+    with data_store.lock:
+        store = data_store.get()
+        store['users'][u_id - 1]['profile_img_url'] = file_path
+        record('set', ['users', u_id - 1, 'profile_img_url'], file_path)
+        data_store.set(store)
+        save_data()
     return {}
 
-def user_stats_v1(token):
+def user_stats_v1(token, resolution=None, since=None, until=None):
     ''' Fetches the required statistics about this user's use of UNSW Seams.
+    The series can be narrowed to a time range, and given per minute, hour or day
+    (the value at the end of each). By default the recent changes are given as they are
+    and older ones per minute, hour or day, depending on their age.
 
     Exceptions:
         AccessError: if token is invalid.
+        InputError: if the resolution or time range is invalid.
 
     Args:
         string: token
+        string: resolution, 'raw' (every stored point), 'minute', 'hour' or 'day' (optional)
+        integer: since, until, the time range (both optional)
 
     Returns:
         {
@@ -412,7 +430,7 @@ def user_stats_v1(token):
         raise AccessError(description="Invalid token")
 
     # Get the user's stat information.
-    u_id = decode_token(token)['auth_user_id']
+    u_id = token_user_id(token)
     store = data_store.get()
     stat_info = store['users'][u_id - 1]['stats']
     
@@ -425,23 +443,34 @@ def user_stats_v1(token):
     if denominator != 0:
         involvement = min((chans + dms + msgs)/(denominator), 1)
 
+    series = {
+        series: query_series((u_id, series), stat_info[series], resolution, since, until)
+        for series in ['channels', 'dms', 'messages']
+    }
+
     return {
         'user_stats': {
-            'channels_joined': stat_info['channels'],
-            'dms_joined': stat_info['dms'],
-            'messages_sent': stat_info['messages'],
+            'channels_joined': series['channels'],
+            'dms_joined': series['dms'],
+            'messages_sent': series['messages'],
             'involvement_rate': involvement,
         }
     }
 
-def users_stats_v1(token):
+def users_stats_v1(token, resolution=None, since=None, until=None):
     '''Fetches the required statistics about the use of UNSW Seams.
+    The series can be narrowed to a time range, and given per minute, hour or day
+    (the value at the end of each). By default the recent changes are given as they are
+    and older ones per minute, hour or day, depending on their age.
     
     Exceptions:
         AccessError: if token is invalid.
+        InputError: if the resolution or time range is invalid.
 
     Args:
         string: token
+        string: resolution, 'raw' (every stored point), 'minute', 'hour' or 'day' (optional)
+        integer: since, until, the time range (both optional)
 
     Returns:
         {
@@ -457,23 +486,21 @@ def users_stats_v1(token):
     if not check_valid_token(token):
         raise AccessError(description="Invalid token")
 
+    # Users in at least one channel or dm are counted as they join and leave, see stats_helpers.py.
     store = data_store.get()
-    num_utilizers = 0
-    for user in store['users']:
-        joined_ch = bool(user['stats']['channels'][-1]['num_channels_joined'] > 0)
-        joined_dm = bool(user['stats']['dms'][-1]['num_dms_joined'] > 0)
-        joined = bool(joined_ch or joined_dm)
-        if user['removed'] == False and joined:
-            num_utilizers += 1
-
     denominator = store['workspace']['num_users']
-    utilization = (num_utilizers)/(denominator)
+    utilization = num_utilizers()/(denominator)
+
+    series = {
+        series: query_series(('workspace', series), store['workspace'][series], resolution, since, until)
+        for series in ['channels', 'dms', 'messages']
+    }
 
     return {
         'workspace_stats': {
-            'channels_exist': store['workspace']['channels'],
-            'dms_exist': store['workspace']['dms'],
-            'messages_exist': store['workspace']['messages'],
+            'channels_exist': series['channels'],
+            'dms_exist': series['dms'],
+            'messages_exist': series['messages'],
             'utilization_rate': utilization,
         }
     }
@@ -0,0 +1,136 @@
+"""
+    This module contains the email and handle indexes behind registering, logging in and
+    updating a user's profile.
+    EMAILS and HANDLES map the email and handle of every user that has not been removed to that
+    user, so registering, logging in and changing an email or handle do not scan every user.
+
+    NEXT_SUFFIX remembers, for each base handle that has been taken, the lowest number that might
+    still be free to add to it. Every handle from base0 up to that number is taken, so generating
+    a handle for a common name does not try every earlier suffix again.
+"""
+
+global EMAILS, HANDLES, NEXT_SUFFIX
+EMAILS = {}
+HANDLES = {}
+NEXT_SUFFIX = {}
+
+def user_by_email(email):
+    """Finds the user with an email, ignoring removed users.
+
+    Args:
+        email (string): email to look up
+
+    Returns:
+        dictionary: the user, or None if no user has that email
+    """
+    return EMAILS.get(email)
+
+def user_by_handle(handle):
+    """Finds the user with a handle, ignoring removed users.
+
+    Args:
+        handle (string): handle to look up
+
+    Returns:
+        dictionary: the user, or None if no user has that handle
+    """
+    return HANDLES.get(handle)
+
+def generate_handle(handle):
+    """Picks the handle for a new user. If the base handle is taken, the numbers 0, 1, 2, ... are
+    added to it until a handle that is free is found.
+
+    Args:
+        handle (string): the base handle, made from the user's names
+
+    Returns:
+        string: the first free handle
+    """
+    if handle not in HANDLES:
+        return handle
+    suffix = NEXT_SUFFIX.get(handle, 0)
+    while handle + str(suffix) in HANDLES:
+        suffix += 1
+    NEXT_SUFFIX[handle] = suffix
+    return handle + str(suffix)
+
+def release_handle(handle):
+    """Lowers the next suffix of any base handle that the freed handle was generated from.
+    """
+    for end in range(len(handle) - 1, -1, -1):
+        base, suffix = handle[:end], handle[end:]
+        if not suffix.isdecimal():
+            break
+        if str(int(suffix)) == suffix and base in NEXT_SUFFIX:
+            NEXT_SUFFIX[base] = min(NEXT_SUFFIX[base], int(suffix))
+
+def add_user(user):
+    """Adds a new user to the indexes.
+
+    Args:
+        user (dictionary): the user in store['users']
+    """
+    if user['removed']:
+        return
+    EMAILS[user['email']] = user
+    HANDLES[user['handle']] = user
+
+def remove_user(user):
+    """Takes a removed user out of the indexes, so their email and handle can be reused.
+
+    Args:
+        user (dictionary): the user in store['users']
+    """
+    if EMAILS.get(user['email']) is user:
+        del EMAILS[user['email']]
+    if HANDLES.get(user['handle']) is user:
+        del HANDLES[user['handle']]
+        release_handle(user['handle'])
+
+def set_email(user, email):
+    """Changes a user's email, keeping the index up to date.
+
+    Args:
+        user (dictionary): the user in store['users']
+        email (string): the new email
+    """
+    if EMAILS.get(user['email']) is user:
+        del EMAILS[user['email']]
+    user['email'] = email
+    EMAILS[email] = user
+
+def set_handle(user, handle):
+    """Changes a user's handle, keeping the index up to date.
+
+    Args:
+        user (dictionary): the user in store['users']
+        handle (string): the new handle
+    """
+    old_handle = user['handle']
+    if HANDLES.get(old_handle) is user:
+        del HANDLES[old_handle]
+    user['handle'] = handle
+    HANDLES[handle] = user
+    if old_handle != handle:
+        release_handle(old_handle)
+
+def reset_users():
+    """Resets the user indexes, for when data store is reset.
+
+    Returns:
+        Empty dictionary.
+    """
+    EMAILS.clear()
+    HANDLES.clear()
+    NEXT_SUFFIX.clear()
+    return {}
+
+def load_users(users):
+    """Rebuilds the user indexes from the users of a loaded data store.
+
+    Args:
+        users (list): store['users']
+    """
+    reset_users()
+    for user in users:
+        add_user(user)
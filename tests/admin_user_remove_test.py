@@ -194,6 +194,24 @@ def test_messages_after_user_removal_correct_format_dm(clear, new_user, new_user
     assert response.json()["messages"][1]["message"] == "Removed user"
     
 
+def test_messages_after_user_removal_others_unchanged(clear, new_user, new_user2):
+    ''' Test only the removed user's messages change, and their removed messages stay removed. '''
+    chan_create_data = {'token': new_user['token'], 'name': 'Apple', 'is_public': True}
+    c_id = requests.post(f"{BASE_URL}/channels/create/v2", json = chan_create_data).json()['channel_id']
+    requests.post(f"{BASE_URL}/channel/join/v2", json = {'token': new_user2['token'], 'channel_id': c_id})
+
+    for token, message in [(new_user["token"], "mine"), (new_user2["token"], "theirs"), (new_user2["token"], "gone")]:
+        json_body = {"token": token, "channel_id": c_id, "message": message}
+        m_id = requests.post(f"{BASE_URL}/message/send/v1", json = json_body).json()["message_id"]
+    requests.delete(f"{BASE_URL}/message/remove/v1", json = {"token": new_user2["token"], "message_id": m_id})
+
+    json_data = {'token': new_user['token'], 'u_id': new_user2['auth_user_id']}
+    assert requests.delete(f"{BASE_URL}/admin/user/remove/v1", json = json_data).status_code == 200
+
+    token_1 = new_user["token"]
+    response = requests.get(f"{BASE_URL}/channel/messages/v2?token={token_1}&channel_id={c_id}&start=0")
+    assert [message["message"] for message in response.json()["messages"]] == ["Removed user", "mine"]
+
 def test_removed_profile_still_fetchable_with_user_profile(clear, new_user, new_user2):
     ''' Test user profile is fetchable but is now 'Removed user'. '''
     json_data = {'token': new_user['token'], 'u_id': new_user2['auth_user_id']}
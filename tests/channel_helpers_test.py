@@ -0,0 +1,81 @@
+'''
+Tests for the channel membership indexes.
+
+'''
+import pytest
+from src.other import clear_v1
+from src.auth import auth_register_v1
+from src.channels import channels_create_v1, channels_list_v1
+from src.channel import channel_join_v1, channel_leave_v1, channel_addowner_v1, channel_removeowner_v1
+from src.user import admin_user_remove_v1
+from src.channel_helpers import is_member, is_owner, user_channels, load_channels
+from src.data_store import initial_object
+
+@pytest.fixture
+def clear():
+    clear_v1()
+    yield
+    clear_v1()
+
+def test_indexes_follow_membership(clear):
+    ''' Test joining, leaving and changing owners keeps the lists and indexes the same. '''
+    owner = auth_register_v1('owner@email.com', 'password', 'first', 'owner')
+    user = auth_register_v1('valid@email.com', 'password', 'john', 'smith')
+    c_id = channels_create_v1(owner['token'], 'apple', True)['channel_id']
+    channel_join_v1(user['token'], c_id)
+    channel_addowner_v1(owner['token'], c_id, user['auth_user_id'])
+    assert is_member(c_id, user['auth_user_id']) and is_owner(c_id, user['auth_user_id'])
+    assert user_channels(user['auth_user_id']) == [c_id]
+    channel_removeowner_v1(owner['token'], c_id, user['auth_user_id'])
+    assert not is_owner(c_id, user['auth_user_id'])
+    channel_addowner_v1(owner['token'], c_id, user['auth_user_id'])
+    channel_leave_v1(user['token'], c_id)
+    assert not is_member(c_id, user['auth_user_id']) and not is_owner(c_id, user['auth_user_id'])
+    assert initial_object['channels'][c_id]['members'] == [owner['auth_user_id']]
+    assert initial_object['channels'][c_id]['owners'] == [owner['auth_user_id']]
+    assert user_channels(user['auth_user_id']) == []
+
+def test_list_in_creation_order(clear):
+    ''' Test a user's channels are listed in the order the channels were created. '''
+    owner = auth_register_v1('owner@email.com', 'password', 'first', 'owner')
+    user = auth_register_v1('valid@email.com', 'password', 'john', 'smith')
+    ids = [channels_create_v1(owner['token'], f'channel{i}', True)['channel_id'] for i in range(4)]
+    for c_id in reversed(ids[1:]):
+        channel_join_v1(user['token'], c_id)
+    listed = channels_list_v1(user['token'])['channels']
+    assert [channel['channel_id'] for channel in listed] == ids[1:]
+
+def test_removed_user(clear):
+    ''' Test removing a user takes them out of each of their channels. '''
+    owner = auth_register_v1('owner@email.com', 'password', 'first', 'owner')
+    user = auth_register_v1('valid@email.com', 'password', 'john', 'smith')
+    ids = [channels_create_v1(user['token'], f'channel{i}', True)['channel_id'] for i in range(3)]
+    channel_join_v1(owner['token'], ids[0])
+    admin_user_remove_v1(owner['token'], user['auth_user_id'])
+    assert user_channels(user['auth_user_id']) == []
+    assert initial_object['channels'][ids[0]]['members'] == [owner['auth_user_id']]
+    assert all(initial_object['channels'][c_id]['owners'] == [] for c_id in ids)
+
+def test_load_channels(clear):
+    ''' Test the indexes are rebuilt from loaded channels. '''
+    owner = auth_register_v1('owner@email.com', 'password', 'first', 'owner')
+    c_id = channels_create_v1(owner['token'], 'apple', True)['channel_id']
+    load_channels([])
+    assert not is_member(c_id, owner['auth_user_id'])
+    load_channels(initial_object['channels'])
+    assert is_owner(c_id, owner['auth_user_id'])
+    assert user_channels(owner['auth_user_id']) == [c_id]
+
+def test_leave_keeps_join_order(clear):
+    ''' Test members leaving from the middle leaves the rest in the order they joined. '''
+    owner = auth_register_v1('owner@email.com', 'password', 'first', 'owner')
+    users = [auth_register_v1(f'valid{i}@email.com', 'password', 'john', 'smith') for i in range(4)]
+    c_id = channels_create_v1(owner['token'], 'apple', True)['channel_id']
+    for user in users:
+        channel_join_v1(user['token'], c_id)
+    channel_leave_v1(users[1]['token'], c_id)
+    channel_leave_v1(users[2]['token'], c_id)
+    channel_join_v1(users[1]['token'], c_id)
+    expected = [owner['auth_user_id'], users[0]['auth_user_id'], users[3]['auth_user_id'], users[1]['auth_user_id']]
+    assert initial_object['channels'][c_id]['members'] == expected
+    assert list(initial_object['channels'][c_id]['members']) == expected
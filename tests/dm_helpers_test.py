@@ -0,0 +1,64 @@
+'''
+Tests for the dm membership indexes.
+
+'''
+import pytest
+from src.other import clear_v1
+from src.auth import auth_register_v1
+from src.dms import dm_create_v1, dm_list_v1, dm_leave_v1, dm_remove_v1, dm_details_v1
+from src.user import admin_user_remove_v1, user_sethandle_v1
+from src.dm_helpers import is_dm_member, user_dms, load_dms
+from src.data_store import initial_object
+
+@pytest.fixture
+def clear():
+    clear_v1()
+    yield
+    clear_v1()
+
+@pytest.fixture
+def users(clear):
+    return [auth_register_v1(f'valid{i}@email.com', 'password', 'john', f'smith{i}') for i in range(3)]
+
+def test_indexes_follow_membership(users):
+    ''' Test leaving and removing dms keeps the lists and indexes the same. '''
+    ids = [user['auth_user_id'] for user in users]
+    dm_id = dm_create_v1(users[0]['token'], ids[1:])['dm_id']
+    assert all(is_dm_member(dm_id, u_id) for u_id in ids)
+    dm_leave_v1(users[1]['token'], dm_id)
+    assert not is_dm_member(dm_id, ids[1])
+    assert initial_object['dms'][dm_id]['members'] == [{'u_id': ids[0]}, {'u_id': ids[2]}]
+    assert user_dms(ids[1]) == []
+    dm_remove_v1(users[0]['token'], dm_id)
+    assert user_dms(ids[0]) == [] and user_dms(ids[2]) == []
+
+def test_list_in_creation_order(users):
+    ''' Test a user's dms are listed in the order the dms were created. '''
+    ids = [dm_create_v1(users[0]['token'], [users[i % 2 + 1]['auth_user_id']])['dm_id'] for i in range(4)]
+    listed = dm_list_v1(users[1]['token'])['dms']
+    assert [dm['dm_id'] for dm in listed] == ids[::2]
+
+def test_profiles_read_from_users(users):
+    ''' Test dm details show a member's current handle rather than the one they had when added. '''
+    dm_id = dm_create_v1(users[0]['token'], [users[1]['auth_user_id']])['dm_id']
+    user_sethandle_v1(users[1]['token'], 'newhandle')
+    members = dm_details_v1(users[0]['token'], dm_id)['members']
+    assert [member['handle_str'] for member in members] == ['johnsmith0', 'newhandle']
+
+def test_removed_user(users):
+    ''' Test removing a user takes them out of each of their dms. '''
+    ids = [dm_create_v1(users[1]['token'], [users[i]['auth_user_id']])['dm_id'] for i in (0, 2)]
+    admin_user_remove_v1(users[0]['token'], users[1]['auth_user_id'])
+    assert user_dms(users[1]['auth_user_id']) == []
+    assert [dm['members'] for dm in initial_object['dms']] == [[{'u_id': users[0]['auth_user_id']}], [{'u_id': users[2]['auth_user_id']}]]
+    assert user_dms(users[2]['auth_user_id']) == [ids[1]]
+
+def test_load_dms(users):
+    ''' Test the indexes are rebuilt from loaded dms, including dms saved with whole profiles. '''
+    dm_id = dm_create_v1(users[0]['token'], [users[1]['auth_user_id']])['dm_id']
+    load_dms([])
+    assert not is_dm_member(dm_id, users[1]['auth_user_id'])
+    initial_object['dms'][dm_id]['members'][1]['handle_str'] = 'johnsmith1'
+    load_dms(initial_object['dms'])
+    assert is_dm_member(dm_id, users[1]['auth_user_id'])
+    assert user_dms(users[0]['auth_user_id']) == [dm_id]
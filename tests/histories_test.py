@@ -0,0 +1,70 @@
+'''
+Tests for finding and removing messages in channel and dm histories.
+
+'''
+import pytest
+from src.data_store import initial_object
+from src.other import clear_v1
+from src.histories import history, message_position, append_message, remove_message
+
+def message(message_id):
+    return {"message_id": message_id, "u_id": 1, "message": str(message_id), "time_sent": 0,
+        "reacts": [{"react_id": 1, "u_ids": [], "is_this_user_reacted": False}], "is_pinned": False}
+
+@pytest.fixture
+def store():
+    clear_v1()
+    initial_object['channels'].append({'channel_id': 0, 'name': 'apple', 'is_public': True,
+        'owners': [1], 'members': [1], 'message': []})
+    yield initial_object
+    clear_v1()
+
+def test_positions(store):
+    ''' Test messages are found at their position, and missing ones are not found. '''
+    for message_id in range(10):
+        append_message(store, 'channels', 0, message(message_id))
+    assert [message_position(store, 'channels', 0, m_id) for m_id in range(10)] == list(range(10))
+    assert message_position(store, 'channels', 0, 10) is None
+
+def test_remove(store):
+    ''' Test removing messages keeps the rest in order and findable. '''
+    for message_id in range(1000):
+        append_message(store, 'channels', 0, message(message_id))
+    removed = set(range(0, 1000, 3))
+    for message_id in sorted(removed, reverse=True):
+        remove_message(store, 'channels', 0, message_id)
+    kept = [m_id for m_id in range(1000) if m_id not in removed]
+    assert [m['message_id'] for m in history(store, 'channels', 0)] == kept
+    for position, message_id in enumerate(kept):
+        assert message_position(store, 'channels', 0, message_id) == position
+    for message_id in removed:
+        assert message_position(store, 'channels', 0, message_id) is None
+    append_message(store, 'channels', 0, message(1000))
+    assert message_position(store, 'channels', 0, 1000) == len(kept)
+
+def test_changed_directly(store):
+    ''' Test the slot map is rebuilt if the history is changed without the helpers. '''
+    for message_id in range(5):
+        append_message(store, 'channels', 0, message(message_id))
+    assert message_position(store, 'channels', 0, 4) == 4
+    store['channels'][0]['message'].pop(0)
+    assert message_position(store, 'channels', 0, 4) == 3
+    store['channels'][0]['message'][0] = message(7)
+    assert message_position(store, 'channels', 0, 1) is None
+    assert message_position(store, 'channels', 0, 7) == 0
+
+def test_tombstones_compacted(store):
+    ''' Test removed messages leave tombstones that are dropped together once they outnumber the rest. '''
+    for message_id in range(1000):
+        append_message(store, 'channels', 0, message(message_id))
+    messages = history(store, 'channels', 0)
+    for message_id in range(400):
+        remove_message(store, 'channels', 0, message_id)
+    assert len(messages.items) == 1000 and messages.dead == 400
+    for message_id in range(400, 700):
+        remove_message(store, 'channels', 0, message_id)
+    assert messages.dead <= 64 + len(messages)
+    assert [m['message_id'] for m in messages] == list(range(700, 1000))
+    assert messages[0]['message_id'] == 700 and messages[-1]['message_id'] == 999
+    assert message_position(store, 'channels', 0, 850) == 150
+    assert store['channels'][0]['message'] == [message(m_id) for m_id in range(700, 1000)]
@@ -0,0 +1,52 @@
+'''
+This file contains tests for the message index in message_helpers.
+
+'''
+
+import pytest
+from src.message import message_send_v1, message_remove_v1, message_senddm_v1
+from src.message_helpers import message_location, find_message, load_messages
+from src.other import clear_v1
+from src.auth import auth_register_v1
+from src.channels import channels_create_v1
+from src.dms import dm_create_v1
+from src.data_store import initial_object
+
+@pytest.fixture
+def clear():
+    clear_v1()
+
+@pytest.fixture
+def user():
+    return auth_register_v1("valid@email.com", "password", "namefirst", "namelast")
+
+def test_location(clear, user):
+    ''' Test the index finds where each message was sent. '''
+    c_id = channels_create_v1(user['token'], "channel", True)['channel_id']
+    dm_id = dm_create_v1(user['token'], [])['dm_id']
+    m_id1 = message_send_v1(user['token'], c_id, "Hello")['message_id']
+    m_id2 = message_senddm_v1(user['token'], dm_id, "World")['message_id']
+    assert message_location(m_id1) == {"message_id": m_id1, "auth_user_id": user['auth_user_id'], "channel_id": c_id, "dm_id": -1}
+    assert message_location(m_id2)["dm_id"] == dm_id
+    assert find_message(initial_object, m_id2)["message"] == "World"
+    assert message_location(100) is None
+    assert message_location("0") is None
+
+def test_removed(clear, user):
+    ''' Test a removed message can no longer be found. '''
+    c_id = channels_create_v1(user['token'], "channel", True)['channel_id']
+    m_id = message_send_v1(user['token'], c_id, "Hello")['message_id']
+    message_remove_v1(user['token'], m_id)
+    assert message_location(m_id)["channel_id"] == -1
+    assert find_message(initial_object, m_id) is None
+
+def test_clear_and_load(clear, user):
+    ''' Test the index is emptied by clear and rebuilt on load. '''
+    c_id = channels_create_v1(user['token'], "channel", True)['channel_id']
+    m_id = message_send_v1(user['token'], c_id, "Hello")['message_id']
+    messages = list(initial_object['messages'])
+    clear_v1()
+    assert message_location(m_id) is None
+    load_messages(messages)
+    assert message_location(m_id)["channel_id"] == c_id
+    clear_v1()
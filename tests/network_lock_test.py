@@ -0,0 +1,66 @@
+'''
+Tests that requests waiting on another host do not hold the data store lock while they wait.
+
+'''
+import io
+import os
+import threading
+import pytest
+from PIL import Image
+from src.data_store import data_store
+from src.other import clear_v1
+from src import server
+import src.user
+import src.auth
+
+@pytest.fixture
+def client():
+    clear_v1()
+    yield server.APP.test_client()
+    clear_v1()
+
+def lock_is_free():
+    ''' Checks whether another thread could lock the data store right now. '''
+    free = []
+    def try_lock():
+        if data_store.lock.acquire(blocking=False):
+            data_store.lock.release()
+            free.append(True)
+    thread = threading.Thread(target=try_lock)
+    thread.start()
+    thread.join()
+    return bool(free)
+
+def test_uploadphoto_downloads_unlocked(client, monkeypatch):
+    ''' Test the image is downloaded without the data store locked. '''
+    user = client.post('/auth/register/v2', json={'email': 'valid@email.com', 'password': 'password',
+        'name_first': 'first', 'name_last': 'last'}).get_json(force=True)
+    image = io.BytesIO()
+    Image.new('RGB', (10, 10)).save(image, 'JPEG')
+    downloads = []
+    def urlopen(img_url, timeout):
+        downloads.append(lock_is_free())
+        return io.BytesIO(image.getvalue())
+    monkeypatch.setattr(src.user.urllib.request, 'urlopen', urlopen)
+    response = client.post('/user/profile/uploadphoto/v1', json={'token': user['token'], 'img_url': 'http://image.jpg',
+        'x_start': 0, 'y_start': 0, 'x_end': 5, 'y_end': 5})
+    assert response.status_code == 200
+    assert downloads == [True]
+    assert data_store.get()['users'][0]['profile_img_url'] == f"static/{user['auth_user_id']}.jpg"
+    os.remove(f"static/{user['auth_user_id']}.jpg")
+
+def test_passwordreset_request_emails_unlocked(client, monkeypatch):
+    ''' Test the reset email is sent without the data store locked. '''
+    client.post('/auth/register/v2', json={'email': 'valid@email.com', 'password': 'password',
+        'name_first': 'first', 'name_last': 'last'})
+    sent = []
+    class SMTP:
+        def __init__(self, host, port, timeout):
+            sent.append(lock_is_free())
+        def __getattr__(self, name):
+            return lambda *args: None
+    monkeypatch.setattr(src.auth.smtplib, 'SMTP', SMTP)
+    response = client.post('/auth/passwordreset/request/v1', json={'email': 'valid@email.com'})
+    assert response.status_code == 200
+    assert sent == [True]
+    assert data_store.get()['tokens'] == []
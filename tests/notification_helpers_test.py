@@ -0,0 +1,82 @@
+'''
+Tests for the notifications and notifications_get_v1.
+
+'''
+import pytest
+from src.other import clear_v1
+from src.auth import auth_register_v1
+from src.channels import channels_create_v1
+from src.channel import channel_invite_v1, channel_join_v1, channel_leave_v1
+from src.dms import dm_create_v1
+from src.message import message_send_v1, message_senddm_v1, message_edit_v1, message_react_v1
+from src.incomplete import notifications_get_v1
+from src.notification_helpers import NOTIFICATION_LIMIT, NOTIFICATIONS, load_notifications
+from src.data_store import initial_object
+
+@pytest.fixture
+def users():
+    clear_v1()
+    owner = auth_register_v1('owner@email.com', 'password', 'first', 'owner')
+    user = auth_register_v1('user@email.com', 'password', 'first', 'user')
+    yield owner, user
+    clear_v1()
+
+def messages_of(token):
+    return [notification['notification_message'] for notification in notifications_get_v1(token)['notifications']]
+
+def test_added(users):
+    ''' Test users are notified when they are invited to a channel or added to a dm. '''
+    owner, user = users
+    channel_id = channels_create_v1(owner['token'], 'apple', True)['channel_id']
+    channel_invite_v1(owner['token'], channel_id, user['auth_user_id'])
+    dm_id = dm_create_v1(owner['token'], [user['auth_user_id']])['dm_id']
+    assert notifications_get_v1(user['token'])['notifications'] == [
+        {'channel_id': -1, 'dm_id': dm_id, 'notification_message': 'firstowner added you to firstowner, firstuser'},
+        {'channel_id': channel_id, 'dm_id': -1, 'notification_message': 'firstowner added you to apple'},
+    ]
+    assert messages_of(owner['token']) == []
+
+def test_tags(users):
+    ''' Test tagged members are notified once per message, on send and edit. '''
+    owner, user = users
+    channel_id = channels_create_v1(owner['token'], 'apple', True)['channel_id']
+    message_send_v1(owner['token'], channel_id, '@firstuser not a member')
+    channel_join_v1(user['token'], channel_id)
+    message_id = message_send_v1(owner['token'], channel_id, '@firstuser @firstuser @nobody hello there')['message_id']
+    message_edit_v1(owner['token'], message_id, 'hi @FIRSTUSER @firstuser.')
+    dm_id = dm_create_v1(user['token'], [owner['auth_user_id']])['dm_id']
+    message_senddm_v1(user['token'], dm_id, '@firstowner')
+    assert messages_of(user['token']) == [
+        'firstowner tagged you in apple: hi @FIRSTUSER @first',
+        'firstowner tagged you in apple: @firstuser @firstuse',
+    ]
+    assert messages_of(owner['token']) == ['firstuser tagged you in firstowner, firstuser: @firstowner', 'firstuser added you to firstowner, firstuser']
+
+def test_react(users):
+    ''' Test the sender is notified of reacts, unless they have left. '''
+    owner, user = users
+    channel_id = channels_create_v1(owner['token'], 'apple', True)['channel_id']
+    channel_join_v1(user['token'], channel_id)
+    message_id = message_send_v1(owner['token'], channel_id, 'react')['message_id']
+    left_id = message_send_v1(user['token'], channel_id, 'leaving')['message_id']
+    message_react_v1(user['token'], message_id, 1)
+    channel_leave_v1(user['token'], channel_id)
+    message_react_v1(owner['token'], left_id, 1)
+    assert messages_of(owner['token']) == ['firstuser reacted to your message in apple']
+    assert messages_of(user['token']) == []
+
+def test_limit_and_load(users):
+    ''' Test only the newest notifications are kept, and they are rebuilt from the store. '''
+    owner, user = users
+    channel_id = channels_create_v1(owner['token'], 'apple', True)['channel_id']
+    channel_join_v1(user['token'], channel_id)
+    for i in range(NOTIFICATION_LIMIT + 5):
+        message_send_v1(owner['token'], channel_id, f'@firstuser {i}')
+    notifications = messages_of(user['token'])
+    assert len(notifications) == NOTIFICATION_LIMIT
+    assert notifications[0] == 'firstowner tagged you in apple: @firstuser 24'
+    assert notifications[-1] == 'firstowner tagged you in apple: @firstuser 5'
+    assert len(initial_object['users'][1]['notifications']) == NOTIFICATION_LIMIT
+    NOTIFICATIONS.clear()
+    load_notifications(initial_object['users'])
+    assert messages_of(user['token']) == notifications
@@ -1,16 +1,481 @@
-# import requests
+'''
+Tests for saving and loading the data store.
 
-# BASE_URL = f"http://localhost:8063/"
+'''
+import json
+import time
+import pytest
+from src import config
+from src.data_store import data_store, initial_object
+from src.other import clear_v1
+from src.auth import auth_register_v1, auth_logout_v1
+from src.channels import channels_create_v1
+from src.channel import channel_join_v1
+from src.dms import dm_create_v1, dm_leave_v1
+from src.message import message_send_v1, message_edit_v1, message_remove_v1, message_senddm_v1, message_react_v1, message_pin_v1
+from src.message import message_unreact_v1, message_sendlater_v1, rearm_scheduled
+from src.channel import channel_messages_v1
+from src.scheduler import reset_scheduler, scheduler_stats
+from src.dms import dm_remove_v1
+from src.user import admin_user_remove_v1, user_setname_v1
+from src.auth import auth_login_v1
+from src.incomplete import notifications_get_v1
+from src.persistence import save_data, load_data, compact, compaction_due, flush_data
+from src.stats_sweeper import sweep_stats
+import src.persistence
+import src.tokens
+import src.message_helpers
+import src.journal
+import src.section_store
+import src.store_path
+from src.histories import history, RESIDENT
 
-# valid_user = {'email': 'valid@email.com', 'password': 'password', 'name_first': 'firstname', 'name_last': 'lastname'}
-# another_valid_user = {"email": "anothervalid@email.com", "password": "anotherpassword", "name_first": "firstname", "name_last": "lastname"}
+@pytest.fixture
+def files(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'data_file', str(tmp_path / 'data.json'))
+    monkeypatch.setattr(config, 'journal_file', str(tmp_path / 'data.journal'))
+    monkeypatch.setattr(config, 'sections_dir', str(tmp_path / 'sections'))
+    clear_v1()
+    yield tmp_path
+    data_store.set(initial_object)
+    clear_v1()
+    flush_data()
 
-# token_1 = requests.post(f"{BASE_URL}/auth/register/v2", json = valid_user).json()["token"]
-# token_2 = requests.post(f"{BASE_URL}/auth/register/v2", json = another_valid_user).json()["token"]
+def fill_store():
+    ''' Runs a mix of mutating functions and returns the resulting state. '''
+    user1 = auth_register_v1('valid@email.com', 'password', 'firstname', 'lastname')
+    user2 = auth_register_v1('valid2@email.com', 'password', 'first', 'last')
+    c_id = channels_create_v1(user1['token'], 'apple', True)['channel_id']
+    channel_join_v1(user2['token'], c_id)
+    m_id1 = message_send_v1(user1['token'], c_id, 'hello')['message_id']
+    m_id2 = message_send_v1(user2['token'], c_id, 'world')['message_id']
+    message_send_v1(user2['token'], c_id, 'again')
+    message_remove_v1(user1['token'], m_id1)
+    message_edit_v1(user1['token'], m_id2, 'edited')
+    message_react_v1(user1['token'], m_id2, 1)
+    message_pin_v1(user1['token'], m_id2)
+    message_sendlater_v1(user2['token'], c_id, 'later', int(time.time()) + 3600)
+    dm_id = dm_create_v1(user1['token'], [user2['auth_user_id']])['dm_id']
+    message_senddm_v1(user2['token'], dm_id, 'hi dm')
+    dm_leave_v1(user2['token'], dm_id)
+    auth_logout_v1(user2['token'])
+    return current_state()
 
-# json_body = {"token": token_1, "name": "channel 1", "is_public": True}
-# channel_1 = requests.post(f"{BASE_URL}/channels/create/v2", json = json_body).json()["channel_id"]
+def current_state():
+    store = data_store.get()
+    for section in ['channels', 'dms']:
+        for idx in range(len(store[section])):
+            history(store, section, idx)
+    return {
+        'data_store': json.loads(json.dumps(data_store.get(), default=list)),
+        'session_tracker': src.tokens.SESSION_TRACKER,
+        'message_tracker': src.message_helpers.MESSAGE_TRACKER,
+    }
 
-# json_body = {"token": token_1, "channel_id": channel_1, "message": "Hello World"}
-# requests.post(f"{BASE_URL}/message/send/v1", json = json_body)
+def restart():
+    ''' Forgets the in memory state, as if the server was restarted, then loads it back. '''
+    data_store.set({})
+    src.tokens.load_session_tracker(0)
+    src.message_helpers.load_message_tracker(0)
+    load_data()
 
+def test_journal_replay(files):
+    ''' Test the journal rebuilds the same store after a restart. '''
+    expected = fill_store()
+    restart()
+    assert current_state() == expected
+
+def test_replay_finds_messages_by_slot(files, monkeypatch):
+    ''' Test replaying changes to messages finds them through the slot map, not by walking
+    the history. '''
+    fill_store()
+    user = auth_login_v1('valid@email.com', 'password')
+    ids = [message_send_v1(user['token'], 0, f'message {i}')['message_id'] for i in range(20)]
+    message_remove_v1(user['token'], ids[3])
+    message_react_v1(user['token'], ids[10], 1)
+    message_edit_v1(user['token'], ids[15], 'edited again')
+    message_remove_v1(user['token'], ids[-1])
+    expected = current_state()
+    locate = src.store_path.locate
+    def no_message_selectors(node, key):
+        assert not (isinstance(key, dict) and 'message_id' in key)
+        return locate(node, key)
+    monkeypatch.setattr(src.store_path, 'locate', no_message_selectors)
+    restart()
+    assert current_state() == expected
+
+def test_journal_appends(files):
+    ''' Test saving only appends the new changes to the journal. '''
+    fill_store()
+    size = (files / 'data.journal').stat().st_size
+    auth_register_v1('valid3@email.com', 'password', 'first', 'last')
+    new_size = (files / 'data.journal').stat().st_size
+    assert new_size > size
+    assert new_size - size < 2000
+    assert not (files / 'data.json').exists()
+    save_data()
+    assert (files / 'data.journal').stat().st_size == new_size
+
+def test_snapshot_mode(files, monkeypatch):
+    ''' Test snapshot mode rewrites the whole store, and skips journal batches it already holds. '''
+    fill_store()
+    monkeypatch.setattr(config, 'persistence_mode', 'snapshot')
+    auth_register_v1('valid3@email.com', 'password', 'first', 'last')
+    expected = current_state()
+    restart()
+    assert current_state() == expected
+
+def test_torn_journal_line(files):
+    ''' Test a partly written batch at the end of the journal is ignored. '''
+    expected = fill_store()
+    with open(files / 'data.journal', 'a') as File:
+        File.write('{"seq": 1000, "ops": [{"op": "set", "pa')
+    restart()
+    assert current_state() == expected
+
+def test_compaction(files):
+    ''' Test compacting writes a snapshot and starts a new journal. '''
+    expected = fill_store()
+    compact()
+    assert (files / 'data.json').exists()
+    assert not (files / 'data.journal').exists()
+    restart()
+    assert current_state() == expected
+
+def test_compaction_keeps_fallback(files):
+    ''' Test the previous snapshot and the journal after it are kept, so a corrupt
+    snapshot can still be recovered from. '''
+    fill_store()
+    compact()
+    auth_register_v1('valid3@email.com', 'password', 'first', 'last')
+    compact()
+    auth_register_v1('valid4@email.com', 'password', 'first', 'last')
+    compact()
+    auth_register_v1('valid5@email.com', 'password', 'first', 'last')
+    expected = current_state()
+    assert len(list(files.glob('data.journal.*'))) == 1
+    with open(files / 'data.json', 'w') as File:
+        File.write('{"data_store": {"users": [')
+    restart()
+    assert current_state() == expected
+
+def test_compaction_copies_changes(files):
+    ''' Test a compaction only copies what changed since the last one, and the snapshot it
+    writes still matches the store. '''
+    expected = fill_store()
+    compact()
+    users = src.persistence.COPIES['users']['copy']
+    first_user = users[0]
+    history_copy = src.persistence.COPIES[('channels', 0)]['copy']
+    kept = history_copy[0]
+    token = auth_login_v1('valid2@email.com', 'password')['token']
+    c_id = channels_create_v1(token, 'banana', True)['channel_id']
+    message_send_v1(token, 0, 'new')
+    message_react_v1(token, history_copy[0]['message_id'], 1)
+    message_edit_v1(token, history_copy[-1]['message_id'], 'changed')
+    message_send_v1(token, c_id, 'in banana')
+    compact()
+    assert src.persistence.COPIES['users']['copy'] is users
+    assert users[0] is first_user
+    assert src.persistence.COPIES[('channels', 0)]['copy'] is history_copy
+    assert history_copy[0] is not kept
+    expected = current_state()
+    restart()
+    assert current_state() == expected
+    message_remove_v1(token, history_copy[0]['message_id'])
+    compact()
+    expected = current_state()
+    restart()
+    assert current_state() == expected
+
+def test_unreadable_snapshots(files):
+    ''' Test loading fails, rather than starting from an empty store, when the snapshots
+    exist but neither can be read. '''
+    fill_store()
+    compact()
+    auth_register_v1('valid3@email.com', 'password', 'first', 'last')
+    compact()
+    auth_register_v1('valid4@email.com', 'password', 'first', 'last')
+    for file_name in ['data.json', 'data.json.prev']:
+        with open(files / file_name, 'w') as File:
+            File.write('{"data_store": {"users": [')
+    with pytest.raises(ValueError):
+        restart()
+
+def test_compaction_due(files, monkeypatch):
+    ''' Test compaction is due once the journal passes the size or age limit. '''
+    monkeypatch.setattr(config, 'compaction_size', 2000)
+    fill_store()
+    assert compaction_due()
+    compact()
+    assert not compaction_due()
+    auth_register_v1('valid3@email.com', 'password', 'first', 'last')
+    assert not compaction_due()
+    monkeypatch.setattr(config, 'compaction_age', 0)
+    assert compaction_due()
+
+def journal_lines(files):
+    with open(files / 'data.journal', 'r') as File:
+        return len(File.readlines())
+
+def test_interval_durability(files, monkeypatch):
+    ''' Test saves are grouped into a single batch by the writer. '''
+    monkeypatch.setattr(config, 'durability', 'interval')
+    monkeypatch.setattr(config, 'flush_changes', 3)
+    src.persistence.FLUSH_WANTED.clear()
+    lines = journal_lines(files)
+    auth_register_v1('valid@email.com', 'password', 'firstname', 'lastname')
+    auth_register_v1('valid2@email.com', 'password', 'first', 'last')
+    assert journal_lines(files) == lines
+    assert not src.persistence.FLUSH_WANTED.is_set()
+    auth_register_v1('valid3@email.com', 'password', 'first', 'last')
+    assert src.persistence.FLUSH_WANTED.is_set()
+    expected = current_state()
+    flush_data()
+    assert journal_lines(files) == lines + 1
+    flush_data()
+    assert journal_lines(files) == lines + 1
+    restart()
+    assert current_state() == expected
+
+@pytest.mark.parametrize('durability, syncs', [('always', 1), ('interval', 0)])
+def test_always_durability_syncs(files, monkeypatch, durability, syncs):
+    ''' Test only the 'always' policy waits for each journal batch to reach the disk. '''
+    monkeypatch.setattr(config, 'durability', durability)
+    synced = []
+    monkeypatch.setattr(src.journal.os, 'fsync', synced.append)
+    auth_register_v1('valid@email.com', 'password', 'firstname', 'lastname')
+    flush_data()
+    assert len(synced) == syncs
+    restart()
+    assert auth_login_v1('valid@email.com', 'password')['auth_user_id'] == 1
+
+def test_shutdown_durability(files, monkeypatch):
+    ''' Test nothing is written until the final flush. '''
+    monkeypatch.setattr(config, 'durability', 'shutdown')
+    lines = journal_lines(files)
+    expected = fill_store()
+    assert journal_lines(files) == lines
+    flush_data()
+    restart()
+    assert current_state() == expected
+
+def test_binary_snapshot(files, monkeypatch):
+    ''' Test compacting to a binary snapshot, with a corrupt one falling back to the last. '''
+    monkeypatch.setattr(config, 'snapshot_format', 'binary')
+    fill_store()
+    compact()
+    auth_register_v1('valid3@email.com', 'password', 'first', 'last')
+    expected = current_state()
+    restart()
+    assert current_state() == expected
+    compact()
+    with open(files / 'data.json', 'r+b') as File:
+        File.truncate(100)
+    restart()
+    assert current_state() == expected
+
+def test_sections_mode(files, monkeypatch):
+    ''' Test the section files rebuild the same store after a restart. '''
+    expected = fill_store()
+    monkeypatch.setattr(config, 'persistence_mode', 'sections')
+    restart()
+    assert current_state() == expected
+    user = auth_register_v1('valid3@email.com', 'password', 'first', 'last')
+    channels_create_v1(user['token'], 'banana', True)
+    dm_create_v1(user['token'], [1])
+    expected = current_state()
+    restart()
+    assert current_state() == expected
+
+def test_sections_only_dirty(files, monkeypatch):
+    ''' Test only the files of changed records are rewritten, and the rest only appended to. '''
+    monkeypatch.setattr(config, 'persistence_mode', 'sections')
+    load_data()
+    fill_store()
+    sections = files / 'sections'
+    user = auth_register_v1('valid3@email.com', 'password', 'first', 'last')
+    c_id = channels_create_v1(user['token'], 'banana', True)['channel_id']
+    before = {path: path.read_text() for path in sections.rglob('*.json*')}
+    untouched = ['channels/0.json', 'dms/0.json', 'users/0.json', 'user_stats/0.jsonl']
+    for name in untouched:
+        (sections / name).write_text('untouched')
+    user_setname_v1(user['token'], 'new', 'name')
+    message_send_v1(user['token'], c_id, 'hello')
+    for name in untouched:
+        assert (sections / name).read_text() == 'untouched'
+    assert (sections / 'users' / '2.json').read_text() != before[sections / 'users' / '2.json']
+    for name in ['workspace_stats.jsonl', 'user_stats/2.jsonl', 'messages/0.jsonl', f'channel_messages/{c_id}.jsonl']:
+        after = (sections / name).read_text()
+        assert after.startswith(before[sections / name]) and after != before[sections / name]
+    clear_v1()
+    assert list((sections / 'channels').iterdir()) == []
+    assert list((sections / 'users').iterdir()) == []
+    assert list((sections / 'messages').iterdir()) == []
+    restart()
+    assert current_state()['data_store']['channels'] == []
+
+def test_sections_unfinished_flush(files, monkeypatch):
+    ''' Test lines appended by a flush that did not replace meta.json are ignored, even after later flushes. '''
+    monkeypatch.setattr(config, 'persistence_mode', 'sections')
+    load_data()
+    expected = fill_store()
+    tokens = files / 'sections' / 'tokens.jsonl'
+    saved = tokens.read_text()
+    seq = json.loads((files / 'sections' / 'meta.json').read_text())['seq']
+    tokens.write_text(saved + json.dumps([seq + 1, 'append', 'unsaved']) + '\n' + '[0, "torn')
+    restart()
+    assert current_state() == expected
+    assert tokens.read_text() == saved
+    token = auth_login_v1('valid@email.com', 'password')['token']
+    restart()
+    assert current_state()['data_store']['tokens'] == expected['data_store']['tokens'] + [token]
+    # Restarting does not leave a lost seq behind.
+    restart()
+    assert json.loads((files / 'sections' / 'meta.json').read_text())['lost'] == []
+
+def test_sections_failed_flush(files, monkeypatch):
+    ''' Test a flush that fails after appending cuts its lines off again, rather than keeping its seq as lost. '''
+    monkeypatch.setattr(config, 'persistence_mode', 'sections')
+    load_data()
+    expected = fill_store()
+    tokens = files / 'sections' / 'tokens.jsonl'
+    saved = tokens.read_text()
+    def fail(src, dst):
+        raise OSError('disk full')
+    with monkeypatch.context() as patch:
+        patch.setattr(src.section_store.os, 'replace', fail)
+        with pytest.raises(OSError):
+            auth_login_v1('valid@email.com', 'password')
+    assert tokens.read_text() == saved
+    assert src.section_store.LOST == set()
+    restart()
+    assert current_state() == expected
+
+def test_sections_lazy_histories(files, monkeypatch):
+    ''' Test histories are only loaded when used, and cold ones dropped over the budget. '''
+    monkeypatch.setattr(config, 'persistence_mode', 'sections')
+    monkeypatch.setattr(config, 'history_budget', 3)
+    load_data()
+    user = auth_register_v1('valid@email.com', 'password', 'firstname', 'lastname')
+    c_ids = [channels_create_v1(user['token'], name, True)['channel_id'] for name in ['a', 'b', 'c']]
+    m_ids = []
+    for c_id in c_ids:
+        m_ids.append(message_send_v1(user['token'], c_id, 'one')['message_id'])
+        message_send_v1(user['token'], c_id, 'two')
+    channels = data_store.get()['channels']
+    assert 'message' not in channels[c_ids[0]]
+    assert 'message' not in channels[c_ids[1]]
+    assert len(channels[c_ids[2]]['message']) == 2
+
+    restart()
+    channels = data_store.get()['channels']
+    assert all('message' not in channel for channel in channels)
+    message_edit_v1(user['token'], m_ids[0], 'edited')
+    assert 'message' in channels[c_ids[0]]
+    assert list(RESIDENT) == [('channels', c_ids[0])]
+    restart()
+    assert history(data_store.get(), 'channels', c_ids[0])[0]['message'] == 'edited'
+
+def test_sections_budget_without_flush(files, monkeypatch):
+    ''' Test the budget holds when histories are paged in between flushes, without dropping unsaved ones. '''
+    monkeypatch.setattr(config, 'persistence_mode', 'sections')
+    monkeypatch.setattr(config, 'history_budget', 3)
+    load_data()
+    user = auth_register_v1('valid@email.com', 'password', 'firstname', 'lastname')
+    c_ids = [channels_create_v1(user['token'], name, True)['channel_id'] for name in ['a', 'b', 'c']]
+    m_ids = [message_send_v1(user['token'], c_id, 'one')['message_id'] for c_id in c_ids for _ in range(2)]
+    restart()
+    monkeypatch.setattr(config, 'durability', 'shutdown')
+    token = auth_login_v1('valid@email.com', 'password')['token']
+    message_edit_v1(token, m_ids[0], 'edited')
+    channel_messages_v1(token, c_ids[1], 0)
+    channel_messages_v1(token, c_ids[2], 0)
+    assert list(RESIDENT) == [('channels', c_ids[0]), ('channels', c_ids[2])]
+    flush_data()
+    assert list(RESIDENT) == [('channels', c_ids[2])]
+    restart()
+    assert history(data_store.get(), 'channels', c_ids[0])[0]['message'] == 'edited'
+
+@pytest.mark.parametrize('mode', ['journal', 'sections'])
+def test_scheduled_messages_survive_restart(files, monkeypatch, mode):
+    ''' Test scheduled messages are saved, overdue ones are sent on start up and the rest are re-armed. '''
+    monkeypatch.setattr(config, 'persistence_mode', mode)
+    load_data()
+    user = auth_register_v1('valid@email.com', 'password', 'firstname', 'lastname')
+    c_id = channels_create_v1(user['token'], 'apple', True)['channel_id']
+    soon = message_sendlater_v1(user['token'], c_id, 'soon', int(time.time()) + 1)['message_id']
+    message_sendlater_v1(user['token'], c_id, 'later', int(time.time()) + 3600)
+    # The server stops before either is sent.
+    reset_scheduler()
+    time.sleep(1.1)
+    restart()
+    assert rearm_scheduled() == 1
+    assert scheduler_stats()['queue_depth'] == 1
+    token = auth_login_v1('valid@email.com', 'password')['token']
+    messages = channel_messages_v1(token, c_id, 0)['messages']
+    assert [(message['message_id'], message['message']) for message in messages] == [(soon, 'soon')]
+    restart()
+    assert rearm_scheduled() == 0
+
+@pytest.mark.parametrize('mode', ['journal', 'snapshot', 'sections'])
+def test_notifications_survive_restart(files, monkeypatch, mode):
+    ''' Test only the newest notifications are saved and loaded back. '''
+    monkeypatch.setattr(config, 'persistence_mode', mode)
+    load_data()
+    user1 = auth_register_v1('valid@email.com', 'password', 'firstname', 'lastname')
+    user2 = auth_register_v1('valid2@email.com', 'password', 'first', 'last')
+    c_id = channels_create_v1(user1['token'], 'apple', True)['channel_id']
+    channel_join_v1(user2['token'], c_id)
+    for i in range(25):
+        message_send_v1(user1['token'], c_id, f'@firstlast {i}')
+    expected = notifications_get_v1(user2['token'])['notifications']
+    assert len(expected) == 20
+    assert expected[0]['notification_message'] == 'firstnamelastname tagged you in apple: @firstlast 24'
+    restart()
+    token = auth_login_v1('valid2@email.com', 'password')['token']
+    assert notifications_get_v1(token)['notifications'] == expected
+    assert len(data_store.get()['users'][1]['notifications']) == 20
+
+@pytest.mark.parametrize('mode', ['journal', 'snapshot', 'sections'])
+def test_session_times_survive_restart(files, monkeypatch, mode):
+    ''' Test a restart keeps when each session was issued and last used, so it does not extend them. '''
+    monkeypatch.setattr(config, 'persistence_mode', mode)
+    monkeypatch.setattr(config, 'session_lifetime', 1)
+    monkeypatch.setattr(config, 'session_seen_interval', 0)
+    load_data()
+    user1 = auth_register_v1('valid@email.com', 'password', 'firstname', 'lastname')
+    user2 = auth_register_v1('valid2@email.com', 'password', 'first', 'last')
+    # A request from user2, as the server opens and closes it.
+    src.tokens.open_auth_context(user2['token'])
+    user_setname_v1(user2['token'], 'second', 'name')
+    src.tokens.close_auth_context()
+    def times(token):
+        session = src.tokens.SESSIONS[src.tokens.TOKEN_INDEX[token]]
+        return (session['issued_at'], session['last_seen'])
+    expected = [times(user1['token']), times(user2['token'])]
+    assert expected[1][1] > expected[1][0]
+    restart()
+    assert [times(user1['token']), times(user2['token'])] == expected
+    time.sleep(1.1)
+    restart()
+    assert not src.tokens.is_active_token(user1['token'])
+    assert not src.tokens.is_active_token(user2['token'])
+
+@pytest.mark.parametrize('mode', ['journal', 'snapshot', 'sections'])
+def test_folded_stats_survive_restart(files, monkeypatch, mode):
+    ''' Test a restart loads the stats series as the sweeper folded them. '''
+    monkeypatch.setattr(config, 'persistence_mode', mode)
+    monkeypatch.setattr(config, 'stats_raw_points', 2)
+    load_data()
+    user = auth_register_v1('valid@email.com', 'password', 'firstname', 'lastname')
+    for i in range(10):
+        channels_create_v1(user['token'], f'channel{i}', True)
+    assert sweep_stats() == 2
+    store = data_store.get()
+    expected = [store['workspace']['channels'], store['users'][0]['stats']['channels']]
+    assert len(expected[0]) <= 4
+    assert expected[0][-1]['num_channels_exist'] == 10
+    restart()
+    store = data_store.get()
+    assert [store['workspace']['channels'], store['users'][0]['stats']['channels']] == expected
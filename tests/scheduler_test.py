@@ -0,0 +1,60 @@
+'''
+Tests for the scheduler.
+
+'''
+import time
+import pytest
+from src.scheduler import schedule, cancel, scheduler_stats, reset_scheduler
+
+@pytest.fixture
+def reset():
+    reset_scheduler()
+    yield
+    reset_scheduler()
+
+def wait_for(condition):
+    deadline = time.time() + 2
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+
+def test_runs_in_due_order(reset):
+    ''' Test jobs run in the order they are due, not the order they were scheduled. '''
+    ran = []
+    for delay in [0.2, 0.05, 0.1, 0]:
+        schedule(delay, ran.append, [delay])
+    assert scheduler_stats()['queue_depth'] == 4
+    wait_for(lambda: len(ran) == 4)
+    assert ran == [0, 0.05, 0.1, 0.2]
+    stats = scheduler_stats()
+    assert stats['queue_depth'] == 0 and stats['dispatched'] == 4
+    assert 0 <= stats['last_lag'] <= stats['max_lag']
+
+def test_cancel(reset):
+    ''' Test a cancelled job never runs, and can only be cancelled once. '''
+    ran = []
+    job_id = schedule(0.05, ran.append, ['cancelled'])
+    schedule(0.1, ran.append, ['kept'])
+    assert cancel(job_id)
+    assert not cancel(job_id)
+    wait_for(lambda: ran)
+    time.sleep(0.05)
+    assert ran == ['kept']
+    assert scheduler_stats()['cancelled'] == 1
+
+def test_failed_job(reset):
+    ''' Test a job that raises does not stop later jobs. '''
+    ran = []
+    schedule(0, lambda: 1 / 0)
+    schedule(0.01, ran.append, ['after'])
+    wait_for(lambda: ran)
+    assert ran == ['after']
+    assert scheduler_stats()['failed'] == 1
+
+def test_reset(reset):
+    ''' Test resetting drops every pending job. '''
+    ran = []
+    for _ in range(100):
+        schedule(0.05, ran.append, [1])
+    reset_scheduler()
+    time.sleep(0.1)
+    assert ran == [] and scheduler_stats()['queue_depth'] == 0
@@ -0,0 +1,139 @@
+'''
+Tests for the search index and search_v1.
+
+'''
+import pytest
+from src.other import clear_v1
+from src.auth import auth_register_v1
+from src.channels import channels_create_v1
+from src.dms import dm_create_v1
+from src.channel import channel_join_v1
+from src.message import message_send_v1, message_senddm_v1, message_edit_v1, message_remove_v1, message_react_v1
+from src.error import InputError
+from src.user import admin_user_remove_v1
+from src.incomplete import search_v1
+from src.search_helpers import grams_of, candidate_messages, index_stats, POSTINGS, load_search
+import src.search_helpers
+
+@pytest.fixture
+def users():
+    clear_v1()
+    owner = auth_register_v1('owner@email.com', 'password', 'first', 'owner')
+    user = auth_register_v1('user@email.com', 'password', 'first', 'user')
+    yield owner, user
+    clear_v1()
+
+def found(token, query_str):
+    return [message['message'] for message in search_v1(token, query_str)['messages']]
+
+def test_grams():
+    ''' Test trigrams are of the case-folded text. '''
+    assert grams_of('DePloy') == {'dep', 'epl', 'plo', 'loy'}
+    assert grams_of('aaaa') == {'aaa'}
+    assert grams_of('?!') == set()
+
+def test_search_members_only(users):
+    ''' Test only messages in the user's channels and dms are found. '''
+    owner, user = users
+    channel_id = channels_create_v1(owner['token'], 'channel', True)['channel_id']
+    dm_id = dm_create_v1(owner['token'], [user['auth_user_id']])['dm_id']
+    message_send_v1(owner['token'], channel_id, 'Hello World')
+    message_senddm_v1(user['token'], dm_id, 'hello there, world')
+    message_send_v1(owner['token'], channel_id, 'goodbye')
+    assert found(owner['token'], 'WORLD') == ['hello there, world', 'Hello World']
+    assert found(owner['token'], 'o w') == ['Hello World']
+    assert found(user['token'], 'world') == ['hello there, world']
+    assert found(owner['token'], 'hello missing') == []
+
+def test_search_follows_changes(users):
+    ''' Test edits, removes and admin removal update the index. '''
+    owner, user = users
+    channel_id = channels_create_v1(user['token'], 'channel', True)['channel_id']
+    message_id = message_send_v1(user['token'], channel_id, 'apple')['message_id']
+    other_id = message_send_v1(user['token'], channel_id, 'apple pie')['message_id']
+    message_edit_v1(user['token'], message_id, 'banana')
+    assert found(user['token'], 'apple') == ['apple pie']
+    assert found(user['token'], 'banana') == ['banana']
+    message_remove_v1(user['token'], other_id)
+    assert found(user['token'], 'apple') == []
+    assert 'ppl' not in POSTINGS
+    auth_register_v1('new@email.com', 'password', 'first', 'new')
+    admin_user_remove_v1(owner['token'], user['auth_user_id'])
+    assert 'ana' not in POSTINGS
+    assert POSTINGS['rem'] == {message_id}
+
+def test_search_substrings(users):
+    ''' Test any part of a message is found, and candidates without the query in order are not. '''
+    owner, _ = users
+    channel_id = channels_create_v1(owner['token'], 'channel', True)['channel_id']
+    message_send_v1(owner['token'], channel_id, 'Redeployment done')
+    message_send_v1(owner['token'], channel_id, 'loyal deputy epl plo')
+    assert candidate_messages('deploy') == {0, 1}
+    assert found(owner['token'], 'deploy') == ['Redeployment done']
+    assert found(owner['token'], 'DONE') == ['Redeployment done']
+
+def test_search_reacts_and_scan(users):
+    ''' Test results say whether the user reacted, and short queries are still found. '''
+    owner, user = users
+    channel_id = channels_create_v1(owner['token'], 'channel', True)['channel_id']
+    other_id = channels_create_v1(user['token'], 'other', True)['channel_id']
+    message_send_v1(owner['token'], channel_id, 'what?!')
+    message_send_v1(owner['token'], channel_id, 'what')
+    message_send_v1(user['token'], other_id, 'what?!')
+    assert candidate_messages('?!') is None
+    assert found(owner['token'], '?!') == ['what?!']
+    assert found(owner['token'], 'T') == ['what', 'what?!']
+    assert search_v1(owner['token'], 'what')['messages'][0]['reacts'][0]['is_this_user_reacted'] == False
+
+def test_search_after_load(users):
+    ''' Test the index is built from the histories after a load. '''
+    owner, _ = users
+    channel_id = channels_create_v1(owner['token'], 'channel', True)['channel_id']
+    message_send_v1(owner['token'], channel_id, 'kept')
+    load_search()
+    assert POSTINGS == {}
+    message_send_v1(owner['token'], channel_id, 'kept too')
+    assert found(owner['token'], 'kept') == ['kept too', 'kept']
+    assert src.search_helpers.BUILT
+
+def test_index_stats(users):
+    ''' Test the report counts the index and its memory. '''
+    owner, _ = users
+    assert index_stats()['postings'] == 0
+    channel_id = channels_create_v1(owner['token'], 'channel', True)['channel_id']
+    message_send_v1(owner['token'], channel_id, 'abcd')
+    message_send_v1(owner['token'], channel_id, 'bcde')
+    stats = index_stats()
+    assert (stats['messages'], stats['grams'], stats['postings']) == (2, 3, 4)
+    assert stats['total_bytes'] == stats['postings_bytes'] + stats['message_grams_bytes'] > 0
+
+def test_search_pages(users):
+    ''' Test results come a page at a time, with end set to the start of the next page. '''
+    owner, _ = users
+    channel_id = channels_create_v1(owner['token'], 'channel', True)['channel_id']
+    for i in range(5):
+        message_send_v1(owner['token'], channel_id, f'page {i}')
+    result = search_v1(owner['token'], 'page', 0, 2)
+    assert [message['message'] for message in result['messages']] == ['page 4', 'page 3']
+    assert (result['start'], result['end']) == (0, 2)
+    result = search_v1(owner['token'], 'page', 2, 3)
+    assert [message['message'] for message in result['messages']] == ['page 2', 'page 1', 'page 0']
+    assert result['end'] == -1
+    assert search_v1(owner['token'], 'page', 10)['messages'] == []
+    assert len(search_v1(owner['token'], 'e')['messages']) == 5
+    for start, limit, order in [(-1, 50, 'newest'), (0, 0, 'newest'), (0, 50, 'oldest')]:
+        with pytest.raises(InputError):
+            search_v1(owner['token'], 'page', start, limit, order)
+
+def test_search_most_reacted(users):
+    ''' Test the most reacted messages come first, then the newest. '''
+    owner, user = users
+    channel_id = channels_create_v1(owner['token'], 'channel', True)['channel_id']
+    channel_join_v1(user['token'], channel_id)
+    ids = [message_send_v1(owner['token'], channel_id, f'vote {i}')['message_id'] for i in range(3)]
+    message_react_v1(owner['token'], ids[0], 1)
+    message_react_v1(user['token'], ids[0], 1)
+    message_react_v1(user['token'], ids[1], 1)
+    result = search_v1(user['token'], 'vote', order='reacts')['messages']
+    assert [message['message_id'] for message in result] == [ids[0], ids[1], ids[2]]
+    assert [message['reacts'][0]['is_this_user_reacted'] for message in result] == [True, True, False]
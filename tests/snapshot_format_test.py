@@ -0,0 +1,64 @@
+'''
+Tests for the binary snapshot format.
+
+'''
+import json
+import pytest
+from src.snapshot_format import dump_snapshot, load_snapshot, read_sections, convert_json, is_binary
+
+DATA = {
+    'data_store': {
+        'users': [{'id': 1, 'email': 'valid@email.com', 'removed': False, 'reset_code': None}],
+        'channels': [{'channel_id': 0, 'name': 'apple', 'members': [1], 'message': []}],
+        'tokens': ['token'],
+        'messages': [],
+        'dms': [],
+        'workspace': {'channels': [], 'dms': [], 'messages': [], 'num_users': 1},
+    },
+    'session_tracker': 3,
+    'message_tracker': 0,
+    'journal_seq': 7,
+}
+
+@pytest.fixture
+def snapshot(tmp_path):
+    file_name = str(tmp_path / 'data.snap')
+    with open(file_name, 'wb') as File:
+        dump_snapshot(DATA, File)
+    return file_name
+
+def test_round_trip(snapshot):
+    ''' Test a snapshot loads back unchanged. '''
+    assert is_binary(snapshot)
+    assert load_snapshot(snapshot) == DATA
+
+def test_read_some_sections(snapshot):
+    ''' Test sections can be read without the rest of the file. '''
+    assert read_sections(snapshot, ['users', 'tokens']) == {
+        'users': DATA['data_store']['users'],
+        'tokens': ['token'],
+    }
+
+def test_convert_json(tmp_path):
+    ''' Test converting a json snapshot. '''
+    json_file = str(tmp_path / 'data.json')
+    with open(json_file, 'w') as File:
+        json.dump(DATA, File)
+    assert not is_binary(json_file)
+    convert_json(json_file, str(tmp_path / 'data.snap'))
+    assert load_snapshot(str(tmp_path / 'data.snap')) == DATA
+
+def test_corrupt_section(snapshot):
+    ''' Test a damaged section fails its checksum. '''
+    with open(snapshot, 'r+b') as File:
+        File.seek(-3, 2)
+        File.write(b'xyz')
+    with pytest.raises(ValueError):
+        load_snapshot(snapshot)
+
+def test_truncated(snapshot):
+    ''' Test a partly written snapshot is rejected. '''
+    with open(snapshot, 'r+b') as File:
+        File.truncate(20)
+    with pytest.raises(ValueError):
+        load_snapshot(snapshot)
@@ -18,6 +18,7 @@ from src.auth import *
 from src.tokens import *
 from src.standup import *
 from src import config
+from src.scheduler import reset_scheduler
 
 BASE_URL = config.url
 valid_user = {'email': 'valid@email.com', 'password': 'password', 'name_first': 'firstname', 'name_last': 'lastname'}
@@ -360,3 +361,56 @@ def test_standup_2(H_clear, H_user_reg_S, H_user_reg_S2):
 
     requests.delete(f"{BASE_URL}/clear/v1", json = {})
 
+
+def test_standup_after_logout(clear, user_reg_S):
+    '''
+    Test the summary is still sent once the user who started the standup has logged out,
+    and the next standup starts with an empty queue
+    '''
+    u_token = user_reg_S['token']
+    c_id = channels_create_v1(u_token, 'SeamEgg', True)["channel_id"]
+
+    standup_start_v1(u_token, c_id, 0.05)
+    standup_send_v1(u_token, c_id, "Standing")
+    standup_send_v1(u_token, c_id, "Still standing")
+    auth_logout_v1(u_token)
+    time.sleep(0.1)
+    messages = initial_object["channels"][c_id]["message"]
+    assert [message["message"] for message in messages] == ["firstnamelastname: Standing\nfirstnamelastname: Still standing\n"]
+    assert messages[0]["u_id"] == user_reg_S['auth_user_id']
+
+    u_token = auth_login_v1('valid@email.com', 'password')['token']
+    standup_start_v1(u_token, c_id, 0.05)
+    standup_send_v1(u_token, c_id, "Sitting")
+    time.sleep(0.1)
+    assert initial_object["channels"][c_id]["message"][-1]["message"] == "firstnamelastname: Sitting\n"
+
+def test_rearm_standups(clear, user_reg_S):
+    '''
+    Test a standup that was running when the server stopped still finishes
+    '''
+    u_token = user_reg_S['token']
+    c_id = channels_create_v1(u_token, 'SeamEgg', True)["channel_id"]
+    standup_start_v1(u_token, c_id, 0.05)
+    standup_send_v1(u_token, c_id, "Standing")
+    reset_scheduler()
+    time.sleep(0.1)
+    assert standup_active_v1(u_token, c_id)['is_active']
+    rearm_standups()
+    time.sleep(0.05)
+    assert not standup_active_v1(u_token, c_id)['is_active']
+    assert initial_object["channels"][c_id]["message"][0]["message"] == "firstnamelastname: Standing\n"
+    clear_v1()
+
+def test_standup_summary_too_long(clear, user_reg_S):
+    '''
+    Test a summary longer than 1000 characters is not sent, the same as message_send_v1
+    '''
+    u_token = user_reg_S['token']
+    c_id = channels_create_v1(u_token, 'SeamEgg', True)["channel_id"]
+    standup_start_v1(u_token, c_id, 0.05)
+    standup_send_v1(u_token, c_id, "a" * 600)
+    standup_send_v1(u_token, c_id, "b" * 600)
+    time.sleep(0.1)
+    assert not standup_active_v1(u_token, c_id)['is_active']
+    assert initial_object["channels"][c_id]["message"] == []
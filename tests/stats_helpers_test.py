@@ -0,0 +1,124 @@
+'''
+Tests for the stats rollups.
+
+'''
+import pytest
+from src.other import clear_v1
+from src.auth import auth_register_v1
+from src.channels import channels_create_v1
+from src.channel import channel_join_v1, channel_leave_v1
+from src.dms import dm_create_v1, dm_remove_v1
+from src.user import users_stats_v1, user_stats_v1, admin_user_remove_v1
+from src.stats_helpers import query_series, reset_rollups, load_stats, fold_series, fold_due
+from src.stats_helpers import ROLLUPS, UTILIZERS, FOLDED
+from src import config
+from src.data_store import initial_object
+from src.error import InputError
+
+@pytest.fixture
+def clear():
+    clear_v1()
+    yield
+    clear_v1()
+
+def points_at(*time_stamps):
+    return [{'num_messages_exist': idx, 'time_stamp': time_stamp} for idx, time_stamp in enumerate(time_stamps)]
+
+def test_last_value_buckets(clear):
+    ''' Test each bucket holds the last point in it. '''
+    points = points_at(0, 30, 59, 60, 3599, 3600, 86400)
+    values = lambda result: [point['num_messages_exist'] for point in result]
+    assert query_series('series', points, 'raw') is points
+    assert values(query_series('series', points, 'minute')) == [2, 3, 4, 5, 6]
+    assert values(query_series('series', points, 'hour')) == [4, 5, 6]
+    assert values(query_series('series', points, 'day')) == [5, 6]
+
+def test_incremental(clear):
+    ''' Test points added after a query are rolled up, and a replaced series starts again. '''
+    points = points_at(0, 30)
+    assert len(query_series('series', points, 'minute')) == 1
+    points.append({'num_messages_exist': 2, 'time_stamp': 90})
+    assert query_series('series', points, 'minute')[-1]['time_stamp'] == 90
+    assert ROLLUPS['series']['seen'] == 3
+    assert len(query_series('series', points_at(0), 'minute')) == 1
+    reset_rollups()
+    assert ROLLUPS == {}
+
+def test_time_range(clear):
+    ''' Test the range includes points at either end. '''
+    points = points_at(0, 10, 20, 30)
+    assert query_series('series', points, 'raw', since=10, until=20) == points[1:3]
+    assert query_series('series', points, 'raw', since=25) == points[3:]
+    assert query_series('series', points, until=-1) == []
+    with pytest.raises(InputError):
+        query_series('series', points, 'week')
+    with pytest.raises(InputError):
+        query_series('series', points, since=20, until=10)
+
+def test_fold_series(clear, monkeypatch):
+    ''' Test recent points are kept and older ones are folded by their age, keeping the last in each bucket. '''
+    monkeypatch.setattr(config, 'stats_raw_points', 2)
+    day = 24 * 60 * 60
+    now = 10 * day
+    points = points_at(0, 100, day, 2 * day, now - 7000, now - 6000, now - 100, now - 90, now - 20, now - 10, now)
+    values = lambda result: [point['num_messages_exist'] for point in result]
+    assert values(fold_series(points, now)) == [1, 2, 3, 5, 7, 8, 9, 10]
+    old = points_at(0, 10, 20)
+    assert values(fold_series(old, now)) == [2]
+
+def test_fold_due(clear, monkeypatch):
+    ''' Test a series is folded once it has doubled in length since it was last folded. '''
+    monkeypatch.setattr(config, 'stats_raw_points', 2)
+    points = points_at(*range(4))
+    assert fold_due('series', points, 10 * 24 * 60 * 60) is None
+    points.append({'num_messages_exist': 4, 'time_stamp': 4})
+    assert fold_due('series', points, 10 * 24 * 60 * 60) == points[-1:]
+    assert FOLDED['series'] == 1
+    assert fold_due('series', points_at(0, 1), 10 * 24 * 60 * 60) is None
+
+def test_default_response_folded(clear, monkeypatch):
+    ''' Test the default response folds older points, while 'raw' gives every point. '''
+    monkeypatch.setattr(config, 'stats_raw_points', 2)
+    user = auth_register_v1('valid@email.com', 'password', 'first', 'last')
+    for i in range(10):
+        channels_create_v1(user['token'], f'channel{i}', True)
+    workspace = users_stats_v1(user['token'])['workspace_stats']['channels_exist']
+    assert 3 <= len(workspace) <= 4
+    assert workspace[-1]['num_channels_exist'] == 10
+    assert len(users_stats_v1(user['token'], 'raw')['workspace_stats']['channels_exist']) == 11
+
+def test_stats_endpoints(clear):
+    ''' Test both stats functions pass the resolution and range through. '''
+    user = auth_register_v1('valid@email.com', 'password', 'first', 'last')
+    for i in range(5):
+        channels_create_v1(user['token'], f'channel{i}', True)
+    workspace = users_stats_v1(user['token'], 'minute')['workspace_stats']
+    assert len(workspace['channels_exist']) <= 2
+    assert workspace['channels_exist'][-1]['num_channels_exist'] == 5
+    assert len(users_stats_v1(user['token'])['workspace_stats']['channels_exist']) == 6
+    stats = user_stats_v1(user['token'], 'day', since=0)['user_stats']
+    assert stats['channels_joined'][-1] == initial_object['users'][0]['stats']['channels'][-1]
+    assert user_stats_v1(user['token'], until=0)['user_stats']['channels_joined'] == []
+
+def test_utilizers(clear):
+    ''' Test users are counted only while they are in a channel or dm, and not once removed. '''
+    owner = auth_register_v1('owner@email.com', 'password', 'first', 'owner')
+    user = auth_register_v1('user@email.com', 'password', 'first', 'user')
+    other = auth_register_v1('other@email.com', 'password', 'first', 'other')
+    utilization = lambda: users_stats_v1(owner['token'])['workspace_stats']['utilization_rate']
+    assert utilization() == 0
+    channel_id = channels_create_v1(owner['token'], 'channel', True)['channel_id']
+    channel_join_v1(user['token'], channel_id)
+    dm_id = dm_create_v1(owner['token'], [user['auth_user_id']])['dm_id']
+    assert UTILIZERS == {owner['auth_user_id'], user['auth_user_id']}
+    channel_leave_v1(user['token'], channel_id)
+    assert utilization() == 2 / 3
+    dm_remove_v1(owner['token'], dm_id)
+    assert UTILIZERS == {owner['auth_user_id']}
+    dm_create_v1(owner['token'], [other['auth_user_id']])
+    assert utilization() == 2 / 3
+    admin_user_remove_v1(owner['token'], other['auth_user_id'])
+    assert utilization() == 1 / 2
+    UTILIZERS.clear()
+    load_stats(initial_object['users'])
+    assert UTILIZERS == {owner['auth_user_id']}
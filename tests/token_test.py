@@ -6,6 +6,8 @@ import pytest
 from src.data_store import initial_object
 from src.tokens import *
 from src.other import clear_v1
+from src import config
+from src.sessions import sweep_sessions
 
 @pytest.fixture
 def clear():
@@ -26,5 +28,95 @@ def test_decoder(clear):
     }
     assert decode_token(token) == answer
 
+def test_token_index(clear):
+    ''' Test the token index follows tokens being added, removed and cleared. '''
+    token1 = generate_token(1)
+    token2 = generate_token(2)
+    token3 = generate_token(1)
+    assert is_active_token(token1)
+    assert user_tokens(1) == [token1, token3]
+    remove_token(token1)
+    assert not is_active_token(token1)
+    assert initial_object['tokens'] == [token2, token3]
+    load_tokens([token1], {})
+    assert is_active_token(token1)
+    assert not is_active_token(token2)
+    clear_v1()
+    assert not is_active_token(token1)
+
+def test_token_cache(clear):
+    ''' Test decoded tokens are cached, and dropped when their session ends. '''
+    token = generate_token(1)
+    decode_token(token)
+    assert decode_token(token) == {'auth_user_id': 1, 'session_id': 1}
+    assert token_cache_stats() == {'hits': 1, 'misses': 1, 'size': 1}
+    remove_token(token)
+    assert token_cache_stats()['size'] == 0
+    decode_token(token)
+    assert token_cache_stats()['misses'] == 2
+    clear_v1()
+    assert token_cache_stats() == {'hits': 0, 'misses': 0, 'size': 0}
+
+def test_token_cache_bounded(clear, monkeypatch):
+    ''' Test the least recently used token is dropped once the cache is full. '''
+    monkeypatch.setattr(config, 'token_cache_size', 2)
+    tokens = [generate_token(u_id) for u_id in range(1, 4)]
+    decode_token(tokens[0])
+    decode_token(tokens[1])
+    decode_token(tokens[0])
+    decode_token(tokens[2])
+    assert list(TOKEN_CACHE) == [tokens[0], tokens[2]]
+
+def test_auth_context(clear):
+    ''' Test the token a request was sent with is resolved once, and only for active tokens. '''
+    initial_object['users'] = [{'id': 1, 'handle': 'first'}, {'id': 2, 'handle': 'second'}]
+    token1 = generate_token(1)
+    token2 = generate_token(2)
+    open_auth_context(token1)
+    misses = token_cache_stats()['misses']
+    assert token_user_id(token1) == 1
+    assert token_user(token1)['handle'] == 'first'
+    assert token_cache_stats()['misses'] == misses
+    assert token_user_id(token2) == 2
+    remove_token(token1)
+    assert AUTH_CONTEXT == {}
+    open_auth_context(token1)
+    assert AUTH_CONTEXT == {}
+    close_auth_context()
+
+def test_revoke_user_sessions(clear):
+    ''' Test every session of one user is ended, and no one else's. '''
+    tokens = [generate_token(u_id) for u_id in (1, 2, 1, 1)]
+    assert revoke_user_sessions(1) == 3
+    assert user_tokens(1) == []
+    assert initial_object['tokens'] == [tokens[1]]
+    assert is_active_token(tokens[1])
+    assert revoke_user_sessions(1) == 0
+
+def test_revoke_without_scanning_tokens(clear, monkeypatch):
+    ''' Test ending a user's sessions only looks at their tokens, not every token in the store. '''
+    tokens = [generate_token(u_id) for u_id in (1, 2, 2, 1)]
+    def scan(self):
+        raise AssertionError("store['tokens'] was scanned")
+    with monkeypatch.context() as patch:
+        patch.setattr(type(initial_object['tokens']), '__iter__', scan)
+        assert revoke_user_sessions(1) == 2
+    assert initial_object['tokens'] == [tokens[1], tokens[2]]
+
+def test_session_expiry(clear):
+    ''' Test idle and old sessions stop being active, and are swept from the store. '''
+    initial_object['users'] = [{'id': 1}]
+    token1 = generate_token(1)
+    token2 = generate_token(1)
+    SESSIONS[1]['last_seen'] -= config.session_idle_timeout
+    assert not is_active_token(token1)
+    assert is_active_token(token2)
+    open_auth_context(token2)
+    SESSIONS[2]['issued_at'] -= config.session_lifetime
+    assert not is_active_token(token2)
+    assert sweep_sessions() == 2
+    assert initial_object['tokens'] == [] and SESSIONS == {} and user_tokens(1) == []
+    assert sweep_sessions() == 0
+
 
 clear_v1()
@@ -0,0 +1,59 @@
+'''
+Tests for the email and handle indexes.
+
+'''
+import pytest
+from src.other import clear_v1
+from src.auth import auth_register_v1, auth_login_v1
+from src.user import user_sethandle_v1, user_setemail_v1, admin_user_remove_v1
+from src.user_helpers import user_by_email, user_by_handle, load_users, NEXT_SUFFIX
+from src.data_store import initial_object
+from src.error import InputError
+
+@pytest.fixture
+def clear():
+    clear_v1()
+    yield
+    clear_v1()
+
+def handle_of(user):
+    return initial_object['users'][user['auth_user_id'] - 1]['handle']
+
+def test_handle_suffixes(clear):
+    ''' Test repeated names get the next free suffix. '''
+    users = [auth_register_v1(f'valid{i}@email.com', 'password', 'john', 'smith') for i in range(5)]
+    assert [handle_of(user) for user in users] == ['johnsmith', 'johnsmith0', 'johnsmith1', 'johnsmith2', 'johnsmith3']
+    assert NEXT_SUFFIX['johnsmith'] == 3
+
+def test_freed_suffix_reused(clear):
+    ''' Test a suffix freed by a handle change is given out again first. '''
+    users = [auth_register_v1(f'valid{i}@email.com', 'password', 'john', 'smith') for i in range(4)]
+    user_sethandle_v1(users[2]['token'], 'someoneelse')
+    assert handle_of(auth_register_v1('valid9@email.com', 'password', 'john', 'smith')) == 'johnsmith1'
+    assert handle_of(auth_register_v1('valid10@email.com', 'password', 'john', 'smith')) == 'johnsmith3'
+
+def test_removed_users_ignored(clear):
+    ''' Test a removed user's email and handle can be used again. '''
+    owner = auth_register_v1('owner@email.com', 'password', 'first', 'owner')
+    user = auth_register_v1('valid@email.com', 'password', 'john', 'smith')
+    admin_user_remove_v1(owner['token'], user['auth_user_id'])
+    assert user_by_email('valid@email.com') is None
+    with pytest.raises(InputError):
+        auth_login_v1('valid@email.com', 'password')
+    new_user = auth_register_v1('valid@email.com', 'password', 'john', 'smith')
+    assert handle_of(new_user) == 'johnsmith'
+    assert auth_login_v1('valid@email.com', 'password')['auth_user_id'] == new_user['auth_user_id']
+
+def test_setters_and_load(clear):
+    ''' Test changing an email or handle moves it in the indexes, and loading rebuilds them. '''
+    user = auth_register_v1('valid@email.com', 'password', 'john', 'smith')
+    user_setemail_v1(user['token'], 'new@email.com')
+    user_sethandle_v1(user['token'], 'newhandle')
+    assert user_by_email('valid@email.com') is None
+    assert user_by_handle('johnsmith') is None
+    users = initial_object['users']
+    clear_v1()
+    assert user_by_email('new@email.com') is None
+    load_users(users)
+    assert user_by_email('new@email.com')['id'] == user['auth_user_id']
+    assert user_by_handle('newhandle')['id'] == user['auth_user_id']